@@ -1,6 +1,8 @@
 import json
 import math
+import os
 import re
+import sys
 from multiprocessing.pool import ThreadPool as Pool
 
 import requests
@@ -9,6 +11,14 @@ from geopy.distance import geodesic
 from shapely.geometry import shape
 from tqdm import tqdm
 
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telemetry import Telemetry
+import columnar
+import warehouse
+
+telemetry = Telemetry("abs")
+
 # Constants
 CBD_COORDINATES = (-31.953512, 115.857048)
 MAX_DISTANCE_KM = 100
@@ -126,7 +136,7 @@ def process_suburb(suburb):
             return None
 
         url = f"https://www.abs.gov.au/census/find-census-data/quickstats/2021/SAL{scc_code}"
-        response = requests.get(url)
+        response = telemetry.request(requests.get, "quickstats", url)
         if response.status_code != 200:
             return None
 
@@ -162,7 +172,7 @@ def process_suburb(suburb):
 def main():
     """Main function to execute the data extraction and processing."""
     url = "https://public.opendatasoft.com/api/explore/v2.1/catalog/datasets/georef-australia-state-suburb/exports/json?lang=en&refine=ste_name%3A%22Western%20Australia%22&facet=facet(name%3D%22ste_name%22%2C%20disjunctive%3Dtrue)&timezone=Australia%2FPerth"
-    response = requests.get(url)
+    response = telemetry.request(requests.get, "suburb_list", url)
 
     if response.status_code == 200:
         data = response.json()
@@ -179,8 +189,14 @@ def main():
     with open("census_data_processed.json", "w") as file:
         json.dump(extracted_data, file, indent=2)
 
+    if warehouse.enabled():
+        warehouse.write_table("census", list(extracted_data.values()), key="abs_scc_name", indexes=("abs_scc_code",))
+    if columnar.enabled():
+        columnar.write_columns(columnar.columns_path("census_data_processed.json"), list(extracted_data.values()))
+
     print("Data extraction completed.")
 
 
 if __name__ == "__main__":
-    main()
+    with telemetry:
+        main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+
+from preprocessing import Preprocessor, suburb_frame, school_frame, merge_reference_data, prepare_listings
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+MODES = ['dense', 'native']
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB (None when it cannot be measured)"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+    if psutil is not None:
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    return None
+
+
+def prepare_frame(native_categorical, args):
+    """The notebook's training frame (without its row sanity filters), one-hot or native categorical"""
+    with open(args.listings, 'r') as file:
+        property_df = prepare_listings(pd.DataFrame(json.load(file)).drop_duplicates(subset='reiwa_listing_id'))
+    with open(args.suburbs, 'r') as file:
+        suburb_df = suburb_frame(json.load(file), set(property_df['reiwa_suburb'])).fillna(0)
+    with open(args.schools, 'r') as file:
+        school_df = school_frame(json.load(file))
+
+    df = merge_reference_data(property_df, suburb_df, school_df)
+    preprocessor = Preprocessor(exclude_columns=['reiwa_price', 'reiwa_is_sold'], native_categorical=native_categorical)
+    df = preprocessor.fill_missing(df, fit=True)
+    df = preprocessor.encode(df, fit=True)
+    return preprocessor.fit_transform(df)
+
+
+def run_mode(mode, args):
+    native_categorical = mode == 'native'
+    df = prepare_frame(native_categorical, args)
+    df_sold = df[df['reiwa_is_sold'] == True]
+    df_unsold = df[df['reiwa_is_sold'] == False]
+    X = df_sold.drop(columns=['reiwa_price', 'reiwa_is_sold'])
+    X_train, X_test, y_train, y_test = train_test_split(X, df_sold['reiwa_price'], test_size=0.06, random_state=42)
+    X_unsold = df_unsold.drop(columns=['reiwa_price', 'reiwa_is_sold'])
+    rss_before = peak_rss_mb()
+
+    start = time.perf_counter()
+    dtrain = xgb.DMatrix(X_train, label=y_train, nthread=-1, enable_categorical=native_categorical)
+    dtest = xgb.DMatrix(X_test, label=y_test, nthread=-1, enable_categorical=native_categorical)
+    dunsold = xgb.DMatrix(X_unsold, label=df_unsold['reiwa_price'], nthread=-1, enable_categorical=native_categorical)
+    dmatrix_seconds = time.perf_counter() - start
+
+    params = {'tree_method': 'hist', 'device': 'cpu', 'eval_metric': 'rmse', 'learning_rate': 0.05, 'max_depth': 9}
+    evals_result = {}
+    start = time.perf_counter()
+    booster = xgb.train(params, dtrain, num_boost_round=args.rounds, evals=[(dtest, 'eval'), (dunsold, 'unsold')],
+                        evals_result=evals_result, verbose_eval=False)
+    train_seconds = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'columns': X.shape[1],
+        'frame_mb': X.memory_usage(deep=True).sum() / 1024 ** 2,
+        'dmatrix_s': dmatrix_seconds,
+        'ms_per_round': train_seconds / booster.num_boosted_rounds() * 1000,
+        'peak_rss_before_mb': rss_before,
+        'peak_rss_mb': peak_rss_mb(),
+        'eval_rmse': evals_result['eval']['rmse'][-1],
+        'unsold_rmse': evals_result['unsold']['rmse'][-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the one-hot (dense) and native categorical training paths.')
+    parser.add_argument('--listings', default='property_data.json')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--schools', default='school_data.json')
+    parser.add_argument('--rounds', type=int, default=200, help='boosting rounds to time')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Each mode runs in its own process so their peak memory is measured separately
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args)))
+        return
+
+    results = []
+    for mode in MODES:
+        command = [sys.executable, __file__, '--mode', mode, '--listings', args.listings, '--suburbs', args.suburbs,
+                   '--schools', args.schools, '--rounds', str(args.rounds)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'{"mode":<8} {"columns":>8} {"frame MB":>9} {"DMatrix s":>10} {"ms/round":>9} {"peak MB":>8} {"eval RMSE":>10} {"unsold RMSE":>12}')
+    for result in results:
+        peak = f'{result["peak_rss_mb"]:.0f}' if result['peak_rss_mb'] is not None else 'n/a'
+        print(f'{result["mode"]:<8} {result["columns"]:>8} {result["frame_mb"]:>9.1f} {result["dmatrix_s"]:>10.3f} '
+              f'{result["ms_per_round"]:>9.2f} {peak:>8} {result["eval_rmse"]:>10.5f} {result["unsold_rmse"]:>12.5f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+import columnar
+from run_all_scripts import COLUMNAR_OUTPUTS, ROOT_DIR
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def load_json(path):
+    with open(path, 'r') as file:
+        if path.endswith('.jsonl'):
+            return [json.loads(line) for line in file if line.strip()]
+        return json.load(file)
+
+
+def to_records(data):
+    """Flatten an artifact into the row records its stage writes in the columnar format"""
+    if isinstance(data, list):
+        return data
+    if data.get('type') == 'FeatureCollection':
+        return [{**feature['properties'], 'longitude': feature['geometry']['coordinates'][0],
+                 'latitude': feature['geometry']['coordinates'][1]} for feature in data['features']]
+    first = next(iter(data.values()), {})
+    if first and all(isinstance(value, dict) for value in first.values()):
+        # Crime data: locality -> financial year -> row
+        return [row for years in data.values() for row in years.values()]
+    return [{'key': key, **value} for key, value in data.items()]
+
+
+def best_time(function, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(path, repeats):
+    columns_dir = columnar.columns_path(path)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Use the stage's own columnar output when there is one, otherwise convert the JSON
+        if not os.path.exists(os.path.join(columns_dir, columnar.MANIFEST_FILE)):
+            columns_dir = os.path.join(temp_dir, 'columns')
+            columnar.write_columns(columns_dir, to_records(load_json(path)))
+
+        return {
+            'artifact': os.path.relpath(path),
+            'json_bytes': os.path.getsize(path),
+            'columnar_bytes': directory_size(columns_dir),
+            'json_load_s': best_time(lambda: load_json(path), repeats),
+            'json_frame_s': best_time(lambda: pd.DataFrame(to_records(load_json(path))), repeats),
+            'columnar_mmap_s': best_time(lambda: columnar.read_columns(columns_dir), repeats),
+            'columnar_frame_s': best_time(lambda: columnar.read_frame(columns_dir), repeats),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare load time and size of the JSON stage outputs against the columnar format.')
+    parser.add_argument('artifacts', nargs='*', help='artifacts to benchmark (default: every stage output that exists)')
+    parser.add_argument('--repeats', type=int, default=3, help='take the best of this many loads')
+    parser.add_argument('--output', help='also save the results to this JSON file')
+    args = parser.parse_args()
+
+    paths = [os.path.abspath(path) for path in args.artifacts] or \
+        [os.path.join(ROOT_DIR, path) for path in COLUMNAR_OUTPUTS if os.path.exists(os.path.join(ROOT_DIR, path))]
+
+    results = []
+    print(f'{"artifact":<42} {"JSON MB":>8} {"cols MB":>8} {"JSON s":>8} {"JSON df s":>10} {"mmap s":>8} {"cols df s":>10}')
+    for path in paths:
+        result = benchmark(path, args.repeats)
+        results.append(result)
+        print(f'{result["artifact"]:<42} {result["json_bytes"] / 1e6:>8.2f} {result["columnar_bytes"] / 1e6:>8.2f} '
+              f'{result["json_load_s"]:>8.3f} {result["json_frame_s"]:>10.3f} '
+              f'{result["columnar_mmap_s"]:>8.3f} {result["columnar_frame_s"]:>10.3f}')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results saved to {args.output}')
+
+if __name__ == '__main__':
+    main()
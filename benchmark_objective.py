@@ -0,0 +1,73 @@
+import argparse
+import json
+import time
+
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import train_test_split
+
+from benchmark_categorical import prepare_frame
+from hyperparameter_search import BASE_PARAMS, WeightedSquaredError
+from training_data import FrameBatches
+
+PARAMS = {**BASE_PARAMS, 'learning_rate': 0.05, 'max_depth': 9, 'lambda': 0.1, 'alpha': 0.1}
+
+
+def train(params, dtrain, evals, rounds, objective=None):
+    start = time.perf_counter()
+    booster = xgb.train(params, dtrain, num_boost_round=rounds, evals=evals, obj=objective, verbose_eval=False)
+    return booster, (time.perf_counter() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that sample weights with the built-in objective reproduce the weighted custom objective, and time both.')
+    parser.add_argument('--listings', default='property_data.json')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--schools', default='school_data.json')
+    parser.add_argument('--rounds', type=int, default=200, help='boosting rounds to time')
+    parser.add_argument('--quantile', action='store_true',
+                        help='train on a QuantileDMatrix, whose bins are fixed before the weights are set')
+    args = parser.parse_args()
+
+    df = prepare_frame(False, args)
+    df_sold = df[df['reiwa_is_sold'] == True]
+    df_unsold = df[df['reiwa_is_sold'] == False]
+    X = df_sold.drop(columns=['reiwa_price', 'reiwa_is_sold'])
+    y = df_sold['reiwa_price']
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.06, random_state=42)
+    X_unsold = df_unsold.drop(columns=['reiwa_price', 'reiwa_is_sold'])
+
+    if args.quantile:
+        dtrain = xgb.QuantileDMatrix(FrameBatches(X_train, y_train))
+        dtest = xgb.QuantileDMatrix(FrameBatches(X_test, y_test), ref=dtrain)
+        dunsold = xgb.QuantileDMatrix(FrameBatches(X_unsold, df_unsold['reiwa_price']), ref=dtrain)
+    else:
+        dtrain = xgb.DMatrix(X_train, label=y_train, nthread=-1)
+        dtest = xgb.DMatrix(X_test, label=y_test, nthread=-1)
+        dunsold = xgb.DMatrix(X_unsold, label=df_unsold['reiwa_price'], nthread=-1)
+    evals = [(dtest, 'eval'), (dunsold, 'unsold')]
+
+    objective = WeightedSquaredError(np.percentile(y_train, 10), np.percentile(y_train, 90), y.min(), y.max())
+    custom, custom_ms = train(PARAMS, dtrain, evals, args.rounds, objective)
+
+    # A custom objective starts from base_score 0.5; pin it so only the gradients are compared
+    base_score = float(json.loads(custom.save_config())['learner']['learner_model_param']['base_score'].strip('[]'))
+    dtrain.set_weight(objective.sample_weights(dtrain.get_label()))
+    weighted, weighted_ms = train({**PARAMS, 'base_score': base_score}, dtrain, evals, args.rounds)
+    # As trained: the built-in objective also estimates its own starting point
+    default, default_ms = train(PARAMS, dtrain, evals, args.rounds)
+
+    print(f'{args.rounds} rounds on {dtrain.num_row()} x {dtrain.num_col()} ({"QuantileDMatrix" if args.quantile else "DMatrix"})')
+    print(f'custom objective:         {custom_ms:8.2f} ms/round')
+    print(f'sample weights:           {weighted_ms:8.2f} ms/round ({custom_ms / weighted_ms:.2f}x)')
+    for dmatrix, name in evals:
+        custom_predictions = custom.predict(dmatrix)
+        weighted_predictions = weighted.predict(dmatrix)
+        labels = dmatrix.get_label()
+        print(f'{name}: max |difference| {np.abs(custom_predictions - weighted_predictions).max():.3g} transformed, '
+              f'RMSE custom {np.sqrt(np.mean((custom_predictions - labels) ** 2)):.6f}, '
+              f'weights {np.sqrt(np.mean((weighted_predictions - labels) ** 2)):.6f}, '
+              f'weights with estimated base_score {np.sqrt(np.mean((default.predict(dmatrix) - labels) ** 2)):.6f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+
+import xgboost as xgb
+
+from benchmark_categorical import peak_rss_mb
+from preprocessing import Preprocessor, merge_reference_data
+from retrain_model import load_listings, load_reference_data
+from training_data import BATCH_SIZE, FIT_SAMPLE_SIZE, TEST_SIZE, fit_preprocessor, hashed_fraction, listing_dmatrices
+
+MODES = ['memory', 'quantile', 'external']
+
+PARAMS = {'tree_method': 'hist', 'device': 'cpu', 'eval_metric': 'rmse', 'learning_rate': 0.05, 'max_depth': 9}
+
+
+def memory_dmatrices(args, suburb_df, school_df):
+    """The notebook's path: every listing loaded into one frame, transformed, split and copied into DMatrix objects"""
+    listings = load_listings(args.listings)
+    df = merge_reference_data(listings, suburb_df, school_df)
+    preprocessor = Preprocessor(exclude_columns=['reiwa_price', 'reiwa_is_sold', 'identifier'])
+    df = preprocessor.fill_missing(df, fit=True)
+    df = df[df['reiwa_suburb_interest_level'].notnull()]
+    df = preprocessor.encode(df, fit=True)
+    df = preprocessor.fit_transform(df)
+
+    # Same train/test split as the streamed modes
+    df_sold = df[df['reiwa_is_sold'] == True]
+    listing_ids = listings.set_index('identifier')['reiwa_listing_id']
+    in_test = hashed_fraction(listing_ids[df_sold['identifier']]) < TEST_SIZE
+    X = df_sold.drop(['reiwa_price', 'reiwa_is_sold', 'identifier'], axis=1)
+    y = df_sold['reiwa_price']
+    dtrain = xgb.DMatrix(X[~in_test], label=y[~in_test], nthread=-1)
+    dtest = xgb.DMatrix(X[in_test], label=y[in_test], nthread=-1)
+    return dtrain, dtest
+
+
+def run_mode(mode, args):
+    suburb_df, school_df = load_reference_data(args.suburbs, args.schools)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        if mode == 'memory':
+            dtrain, dtest = memory_dmatrices(args, suburb_df, school_df)
+        else:
+            preprocessor = Preprocessor(exclude_columns=['reiwa_price', 'reiwa_is_sold', 'identifier'])
+            fit_preprocessor(args.listings, suburb_df, school_df, preprocessor, args.sample_size, args.batch_size)
+            dtrain, dtest = listing_dmatrices(args.listings, suburb_df, school_df, preprocessor, batch_size=args.batch_size,
+                                              cache_dir=cache_dir if mode == 'external' else None)
+        build_seconds = time.perf_counter() - start
+        rss_after_build = peak_rss_mb()
+
+        evals_result = {}
+        start = time.perf_counter()
+        booster = xgb.train(PARAMS, dtrain, num_boost_round=args.rounds, evals=[(dtest, 'test')],
+                            evals_result=evals_result, verbose_eval=False)
+        train_seconds = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'rows': dtrain.num_row() + dtest.num_row(),
+        'columns': dtrain.num_col(),
+        'build_s': build_seconds,
+        'ms_per_round': train_seconds / booster.num_boosted_rounds() * 1000,
+        'peak_rss_build_mb': rss_after_build,
+        'peak_rss_mb': peak_rss_mb(),
+        'test_rmse': evals_result['test']['rmse'][-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare peak memory of in-memory, QuantileDMatrix and external memory training data.')
+    parser.add_argument('--listings', default='property_data.json', help='JSON list, .jsonl or columnar directory')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--schools', default='school_data.json')
+    parser.add_argument('--rounds', type=int, default=50, help='boosting rounds to time')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--sample-size', type=int, default=FIT_SAMPLE_SIZE, help='listings the streamed preprocessing is fitted on')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Each mode runs in its own process so their peak memory is measured separately
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args)))
+        return
+
+    results = []
+    for mode in MODES:
+        command = [sys.executable, __file__, '--mode', mode, '--listings', args.listings, '--suburbs', args.suburbs,
+                   '--schools', args.schools, '--rounds', str(args.rounds), '--batch-size', str(args.batch_size),
+                   '--sample-size', str(args.sample_size)]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f'{"mode":<9} {"rows":>8} {"columns":>8} {"build s":>8} {"ms/round":>9} {"build MB":>9} {"peak MB":>8} {"test RMSE":>10}')
+    for result in results:
+        build_peak = f'{result["peak_rss_build_mb"]:.0f}' if result['peak_rss_build_mb'] is not None else 'n/a'
+        peak = f'{result["peak_rss_mb"]:.0f}' if result['peak_rss_mb'] is not None else 'n/a'
+        print(f'{result["mode"]:<9} {result["rows"]:>8} {result["columns"]:>8} {result["build_s"]:>8.2f} '
+              f'{result["ms_per_round"]:>9.2f} {build_peak:>9} {peak:>8} {result["test_rmse"]:>10.5f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import http.client
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from score_listings import read_listings
+from valuation_service import HOST, PORT
+
+# Fields the service adds to a listing, compared against build_property_data's output
+ENRICHED_PREFIXES = ('osm_', 'scsa_school_')
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.unix_socket = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_socket)
+
+
+def connect(args):
+    return UnixHTTPConnection(args.socket) if args.socket else http.client.HTTPConnection(HOST, args.port)
+
+
+def request(connection, method, path, body=None):
+    connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                       headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def wait_until_ready(args, service, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if service.poll() is not None:
+            raise RuntimeError('the valuation service exited before it was ready')
+        try:
+            if request(connect(args), 'GET', '/health')[0] == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('the valuation service did not become ready')
+
+
+def load_test(args, listings):
+    """Send `args.requests` valuations from `args.concurrency` clients, each on a persistent connection"""
+    latencies = [[] for _ in range(args.concurrency)]
+    service_ms = [[] for _ in range(args.concurrency)]
+    errors = []
+
+    def client(worker):
+        connection = connect(args)
+        for position in range(worker, args.requests, args.concurrency):
+            listing = listings[position % len(listings)]
+            start = time.perf_counter()
+            status, body = request(connection, 'POST', '/value', listing)
+            latencies[worker].append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                errors.append(body['error'])
+            else:
+                service_ms[worker].append(body['elapsed_ms'])
+
+    threads = [threading.Thread(target=client, args=(worker,)) for worker in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return np.concatenate(latencies), np.concatenate(service_ms), errors, elapsed
+
+
+def compare_enrichment(args, listings):
+    """Largest difference between the service's enriched fields and build_property_data's, per field"""
+    enriched = {listing['reiwa_listing_id']: listing for listing in read_listings(args.compare)}
+    connection = connect(args)
+    differences = {}
+    compared = 0
+    for listing in listings[:args.compare_count]:
+        expected = enriched.get(listing['reiwa_listing_id'])
+        if expected is None:
+            continue
+        status, body = request(connection, 'POST', '/value', listing)
+        if status != 200:
+            continue
+        compared += 1
+        for key, value in body['features'].items():
+            if key.startswith(ENRICHED_PREFIXES):
+                difference = abs(value - expected[key]) if value != expected[key] else 0.0
+                differences[key] = max(differences.get(key, 0.0), difference)
+    return compared, differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test valuation_service.py and report its latency percentiles.')
+    parser.add_argument('--listings', default='reiwa/reiwa_listings.jsonl', help='listings to value (JSON list or .jsonl)')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--model', default='xgb_model.json')
+    parser.add_argument('--preprocessing', default='preprocessing.json')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4, help='concurrent clients')
+    parser.add_argument('--warmup', type=int, default=100, help='requests sent before timing')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--socket', help='start the service on this Unix socket instead of a TCP port')
+    parser.add_argument('--compare', metavar='PROPERTY_DATA',
+                        help="check the service's enriched fields against build_property_data's output, e.g. property_data.json")
+    parser.add_argument('--compare-count', type=int, default=200, help='listings to check with --compare')
+    args = parser.parse_args()
+
+    listings = list(read_listings(args.listings))
+    command = [sys.executable, 'valuation_service.py', '--suburbs', args.suburbs, '--model', args.model,
+               '--preprocessing', args.preprocessing]
+    command += ['--socket', args.socket] if args.socket else ['--port', str(args.port)]
+    service = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        start = time.time()
+        wait_until_ready(args, service)
+        print(f'Service ready in {time.time() - start:.2f} seconds')
+
+        if args.compare:
+            compared, differences = compare_enrichment(args, listings)
+            print(f'Enriched fields of {compared} listings vs {args.compare}: largest difference '
+                  f'{max(differences.values(), default=0.0):.3g} ({max(differences, key=differences.get, default="-")})')
+
+        warmup = argparse.Namespace(**{**vars(args), 'requests': args.warmup})
+        load_test(warmup, listings)
+        latencies, service_ms, errors, elapsed = load_test(args, listings)
+    finally:
+        service.terminate()
+        service.wait()
+
+    print(f'{len(latencies)} requests from {args.concurrency} clients in {elapsed:.2f} s ({len(latencies) / elapsed:.0f} requests/s), {len(errors)} errors')
+    print(f'{"":<8} {"p50":>7} {"p95":>7} {"p99":>7} {"max":>7}  (ms)')
+    for name, timings in [('client', latencies), ('service', service_ms)]:
+        if len(timings):
+            p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+            print(f'{name:<8} {p50:>7.2f} {p95:>7.2f} {p99:>7.2f} {timings.max():>7.2f}')
+    if errors:
+        print(f'First error: {errors[0]}')
+
+if __name__ == '__main__':
+    main()
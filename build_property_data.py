@@ -1,9 +1,16 @@
+import argparse
 import json
 import math
+import os
 import time
 from multiprocessing import Pool
 from tqdm import tqdm
 from difflib import get_close_matches
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+import columnar
+import warehouse
 
 
 # Constants
@@ -12,6 +19,13 @@ PERTH_AIRPORT_COORDS = (115.9672, -31.9385)
 LOCAL_COMMUNITY_RADIUS = 1.5  # in kilometers
 EARTH_RADIUS = 6371.0  # in kilometers
 
+# Optional per-listing instrumentation of process_property. Read from the environment so
+# that Pool workers pick it up however they are started.
+PROFILE_ENRICHMENT = os.environ.get('PROFILE_ENRICHMENT') == '1'
+PROFILE_KEY = '_enrichment_profile'
+PROFILE_TOP_N = 20
+PROFILE_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
 # Map for how to aggregate features
 feature_categories = {
     'fuel_station': 'nearest',
@@ -30,7 +44,6 @@ feature_categories = {
     'administrative_building': 'nearest',
     'financial_services': 'nearest',
     'religious_building': 'nearest',
-    'coast': 'nearest',
     'dining': 'local',
     'shop': 'local',
     'waste_facility': 'local',
@@ -51,21 +64,39 @@ for feature_type, category in feature_categories.items():
     elif category == 'local':
         osm_feature_template[f'osm_local_{feature_type}'] = 0
 
-# Load the property data from reiwa/reiwa_listings.json
-with open('reiwa/reiwa_listings.json', 'r') as file:
-    property_data_list = json.load(file)
+# Reference data the enrichment reads, set by load_reference_data
+mesh_block_data = None
+osm_node_data = None
+coast_line_data = None
+student_data = None
+scsa_school_data = None
+
+def load_reference_data():
+    """
+    Load the mesh block, OSM node, coastline and student achievement data and build the school
+    data, once per process (Pool workers started by fork already have it)
+    """
+    global mesh_block_data, osm_node_data, coast_line_data, student_data, scsa_school_data
+    if scsa_school_data is not None:
+        return
+
+    # Load the mesh block data
+    with open('mesh/aus_mesh_blocks_processed.geojson', 'r') as file:
+        mesh_block_data = json.load(file)
 
-# Load the mesh block data
-with open('mesh/aus_mesh_blocks_processed.geojson', 'r') as file:
-    mesh_block_data = json.load(file)
+    # Load the OSM node data
+    with open('osm/osm_nodes_processed.geojson', 'r') as file:
+        osm_node_data = json.load(file)
 
-# Load the OSM node data
-with open('osm/osm_nodes_processed.geojson', 'r') as file:
-    osm_node_data = json.load(file)
+    # Load the coastline data
+    with open('osm/osm_coast_processed.geojson', 'r') as file:
+        coast_line_data = json.load(file)
 
-# Load the student achievement data
-with open('scsa/processed_student_achievement_data.json') as file:
-    student_data = json.load(file)
+    # Load the student achievement data
+    with open('scsa/processed_student_achievement_data.json') as file:
+        student_data = json.load(file)
+
+    scsa_school_data = build_school_data()
 
 def build_school_data():
     """
@@ -93,6 +124,7 @@ def build_school_data():
             matching_school = next(school for school in schools if school['properties']['name'] == closest_school_name)
             longitude, latitude = matching_school['geometry']['coordinates']
             combined_entry = {
+                'school_id': len(combined_data),
                 'school_name': school_name,
                 'longitude': longitude,
                 'latitude': latitude,
@@ -102,7 +134,9 @@ def build_school_data():
             
     return combined_data
 
-scsa_school_data = build_school_data()
+def school_records():
+    """Flat school table keyed on scsa_school_id, which property rows reference"""
+    return [{'scsa_school_id': school['school_id'], **school['achievement_data']} for school in scsa_school_data]
 
 def haversine_distance(lon1, lat1, lon2, lat2):
     """
@@ -117,7 +151,127 @@ def haversine_distance(lon1, lat1, lon2, lat2):
     distance = EARTH_RADIUS * c
     return distance
 
+def haversine_distance_array(lon1, lat1, lon2, lat2):
+    """
+    Vectorised haversine distance for numpy arrays of coordinates (decimal degrees)
+    """
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arcsin(np.sqrt(a))
+    return EARTH_RADIUS * c
+
+def project_coordinates(coordinates):
+    """
+    Project lon/lat pairs onto a local equirectangular plane (km) centred on Perth,
+    so that planar nearest-neighbour queries agree with distances on the ground
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    x = np.radians(coordinates[..., 0]) * math.cos(math.radians(PERTH_CBD_COORDS[1])) * EARTH_RADIUS
+    y = np.radians(coordinates[..., 1]) * EARTH_RADIUS
+    return np.stack([x, y], axis=-1)
+
+def unproject_coordinates(coordinates):
+    """
+    Inverse of project_coordinates, returning lon/lat pairs
+    """
+    lon = np.degrees(coordinates[..., 0] / (math.cos(math.radians(PERTH_CBD_COORDS[1])) * EARTH_RADIUS))
+    lat = np.degrees(coordinates[..., 1] / EARTH_RADIUS)
+    return np.stack([lon, lat], axis=-1)
+
+def build_coast_index():
+    """
+    Split the coastline into two-point segments and index them in an R-tree
+    """
+    segments = []
+    for feature in coast_line_data['features']:
+        coordinates = project_coordinates(feature['geometry']['coordinates'])
+        segments.append(np.stack([coordinates[:-1], coordinates[1:]], axis=1))
+
+    segments = shapely.linestrings(np.concatenate(segments))
+    return segments, STRtree(segments)
+
+def nearest_coast_distances(lons, lats, coast_index=None):
+    """
+    Bulk query the distance (km) from each coordinate to the nearest point on the coast, against
+    `coast_index` from build_coast_index (built here if not given)
+    """
+    coast_segments, coast_tree = coast_index or build_coast_index()
+    points = shapely.points(project_coordinates(np.column_stack([lons, lats])))
+
+    # Find the closest segment for every point, then measure to the closest point on it
+    point_indices, segment_indices = coast_tree.query_nearest(points, all_matches=False)
+    nearest_lines = shapely.shortest_line(points[point_indices], coast_segments[segment_indices])
+    nearest_points = unproject_coordinates(shapely.get_coordinates(nearest_lines).reshape(-1, 2, 2)[:, 1])
+
+    distances = np.full(len(points), float('inf'))
+    distances[point_indices] = haversine_distance_array(
+        np.asarray(lons, dtype=float)[point_indices], np.asarray(lats, dtype=float)[point_indices],
+        nearest_points[:, 0], nearest_points[:, 1]
+    )
+    return distances
+
+class PhaseTimer:
+    """Records the time and number of nodes visited in each phase of process_property"""
+
+    def __init__(self):
+        self.phases = {}
+        self.last = time.perf_counter()
+
+    def lap(self, phase, visits):
+        now = time.perf_counter()
+        self.phases[phase] = {'ms': (now - self.last) * 1000, 'visits': visits}
+        self.last = now
+
+class NullPhaseTimer:
+    """Stand-in used when profiling is off, so the hot path only pays for a no-op call"""
+
+    def lap(self, phase, visits):
+        pass
+
+def summarise_enrichment_profile(profiles):
+    """Aggregate per-listing phase timings into histograms and a top-N slow listings report"""
+    summary = {'listings': len(profiles), 'bucket_edges_ms': PROFILE_BUCKETS_MS, 'phases': {}, 'slowest_listings': []}
+    if not profiles:
+        return summary
+    phase_names = list(profiles[0]['phases'])
+
+    for phase in phase_names + ['total']:
+        if phase == 'total':
+            timings = np.array([profile['total_ms'] for profile in profiles])
+            visits = None
+        else:
+            timings = np.array([profile['phases'][phase]['ms'] for profile in profiles])
+            visits = np.array([profile['phases'][phase]['visits'] for profile in profiles])
+
+        histogram = np.bincount(np.searchsorted(PROFILE_BUCKETS_MS, timings), minlength=len(PROFILE_BUCKETS_MS) + 1)
+        summary['phases'][phase] = {
+            'total_ms': float(timings.sum()),
+            'mean_ms': float(timings.mean()),
+            'p50_ms': float(np.percentile(timings, 50)),
+            'p95_ms': float(np.percentile(timings, 95)),
+            'max_ms': float(timings.max()),
+            'histogram': histogram.tolist()
+        }
+        if visits is not None:
+            summary['phases'][phase]['mean_visits'] = float(visits.mean())
+            summary['phases'][phase]['max_visits'] = int(visits.max())
+
+    summary['slowest_listings'] = sorted(profiles, key=lambda profile: profile['total_ms'], reverse=True)[:PROFILE_TOP_N]
+    return summary
+
+def print_enrichment_profile(summary):
+    print(f"\nEnrichment profile over {summary['listings']} listings:")
+    for phase, stats in summary['phases'].items():
+        visits = f", {stats['mean_visits']:.0f} visits avg" if 'mean_visits' in stats else ""
+        print(f"  {phase:<12} total {stats['total_ms'] / 1000:8.2f}s  mean {stats['mean_ms']:7.3f}ms  p95 {stats['p95_ms']:7.3f}ms  max {stats['max_ms']:8.3f}ms{visits}")
+    print("  Slowest listings:")
+    for profile in summary['slowest_listings'][:5]:
+        print(f"    {profile['reiwa_listing_id']} {profile['reiwa_suburb']}: {profile['total_ms']:.2f}ms ({profile['phases']['osm_walk']['visits']} nodes walked)")
+
 def process_property(property_data):
+    timer = PhaseTimer() if PROFILE_ENRICHMENT else NullPhaseTimer()
     property_lon = property_data['reiwa_longitude']
     property_lat = property_data['reiwa_latitude']
 
@@ -131,6 +285,8 @@ def process_property(property_data):
             min_distance = distance
             closest_school = school
 
+    timer.lap('school', len(scsa_school_data))
+
     # Calculate the local community population and dwelling count
     local_community_population = 0
     local_community_dwellings = 0
@@ -145,6 +301,8 @@ def process_property(property_data):
     property_data['osm_local_community_population'] = local_community_population
     property_data['osm_local_community_dwellings'] = local_community_dwellings
 
+    timer.lap('mesh', len(mesh_block_data['features']))
+
     # Calculate haversine distances for each OSM node feature and store them in osm_node_indices
     osm_node_indices = []
     for idx, feature in enumerate(osm_node_data['features']):
@@ -156,13 +314,17 @@ def process_property(property_data):
     # Sort the indices of OSM node features by distance to the property
     osm_node_indices.sort(key=lambda x: x[1])
 
+    timer.lap('osm_sort', len(osm_node_indices))
+
     # Create copy of feature template for storing data
     osm_features = osm_feature_template.copy()
 
     # Once we have found values for all nearest_ keys, we can exit once we exceed local distance
     all_nearest_found = False
+    nodes_walked = 0
 
     for idx, distance in osm_node_indices:
+        nodes_walked += 1
         feature = osm_node_data['features'][idx]
         properties = feature['properties']
 
@@ -179,6 +341,8 @@ def process_property(property_data):
         if all_nearest_found and distance > LOCAL_COMMUNITY_RADIUS:
             break
 
+    timer.lap('osm_walk', nodes_walked)
+
     # Calculate distances to Perth CBD and airport
     property_data['osm_distance_to_perth_cbd'] = haversine_distance(property_lon, property_lat, PERTH_CBD_COORDS[0], PERTH_CBD_COORDS[1])
     property_data['osm_distance_to_perth_airport'] = haversine_distance(property_lon, property_lat, PERTH_AIRPORT_COORDS[0], PERTH_AIRPORT_COORDS[1])
@@ -186,11 +350,34 @@ def process_property(property_data):
     # Merge the OSM feature data into the property data
     property_data.update(osm_features)
 
-    # Merge school data into property data
-    property_data.update(closest_school["achievement_data"])
+    # Reference the closest school by id, its achievement data lives in school_data.json
+    property_data['scsa_school_id'] = closest_school['school_id']
+    property_data['scsa_school_distance'] = min_distance
+
+    if PROFILE_ENRICHMENT:
+        property_data[PROFILE_KEY] = {
+            'reiwa_listing_id': property_data['reiwa_listing_id'],
+            'reiwa_suburb': property_data['reiwa_suburb'],
+            'total_ms': sum(phase['ms'] for phase in timer.phases.values()),
+            'phases': timer.phases
+        }
     return property_data
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Enrich REIWA listings with school, mesh block and OSM features.")
+    parser.add_argument('--profile-enrichment', action='store_true', help="record per-phase timings for every listing to 'enrichment_profile.json'")
+    args = parser.parse_args()
+
+    if args.profile_enrichment:
+        # Set in the environment as well so spawned Pool workers inherit it
+        os.environ['PROFILE_ENRICHMENT'] = '1'
+        PROFILE_ENRICHMENT = True
+
+    # Load the property data from reiwa/reiwa_listings.jsonl (one listing per line)
+    with open('reiwa/reiwa_listings.jsonl', 'r') as file:
+        property_data_list = [json.loads(line) for line in file if line.strip()]
+    load_reference_data()
+
     # Process properties using multiprocessing and measure execution time
     start_time = time.time()
 
@@ -204,7 +391,15 @@ if __name__ == '__main__':
             unique_listing_ids.add(reiwa_listing_id)
             unique_property_data_list.append(property_data)
 
-    with Pool() as pool:
+    # Distance to the coast is measured for all properties at once against the indexed coastline
+    coast_distances = nearest_coast_distances(
+        [property_data['reiwa_longitude'] for property_data in unique_property_data_list],
+        [property_data['reiwa_latitude'] for property_data in unique_property_data_list]
+    )
+    for property_data, coast_distance in zip(unique_property_data_list, coast_distances):
+        property_data['osm_nearest_coast'] = float(coast_distance)
+
+    with Pool(initializer=load_reference_data) as pool:
         results = []
         with tqdm(total=len(unique_property_data_list), unit='property', desc='Processing properties') as pbar:
             for i, _ in enumerate(pool.imap_unordered(process_property, unique_property_data_list), start=1):
@@ -213,6 +408,12 @@ if __name__ == '__main__':
 
     updated_property_data_list = [property for property in results if property is not None]
 
+    if PROFILE_ENRICHMENT:
+        enrichment_profile = summarise_enrichment_profile([property.pop(PROFILE_KEY) for property in updated_property_data_list])
+        print_enrichment_profile(enrichment_profile)
+        with open('enrichment_profile.json', 'w') as file:
+            json.dump(enrichment_profile, file, indent=2)
+
     end_time = time.time()
     execution_time = end_time - start_time
 
@@ -222,8 +423,15 @@ if __name__ == '__main__':
     with open('property_data.json', 'w') as file:
         json.dump(updated_property_data_list, file, indent=2)
 
-    # Output raw school data for mapping projects
+    # Output school data, keyed on school_id, for the notebook join and mapping projects
     with open('school_data.json', 'w') as file:
         json.dump(scsa_school_data, file, indent=2)
 
+    if warehouse.enabled():
+        warehouse.write_listings('properties', updated_property_data_list)
+        warehouse.write_table('schools', school_records(), key='scsa_school_id')
+    if columnar.enabled():
+        columnar.write_columns(columnar.columns_path('property_data.json'), updated_property_data_list)
+        columnar.write_columns(columnar.columns_path('school_data.json'), school_records())
+
     print("Property data updated with additional information and saved to 'property_data.json'.")
@@ -2,6 +2,8 @@ import json
 import datetime
 from multiprocessing.pool import ThreadPool
 from geopy.distance import geodesic
+import columnar
+import warehouse
 
 # Constants
 CBD_COORDINATES = (-31.953512, 115.857048)
@@ -156,4 +158,10 @@ for result in results:
 with open('suburb_data.json', 'w') as file:
     json.dump(aggregated_suburb_data, file, indent=2)
 
+suburb_records = [{'suburb': suburb, **data} for suburb, data in aggregated_suburb_data.items()]
+if warehouse.enabled():
+    warehouse.write_table('suburbs', suburb_records, key='suburb')
+if columnar.enabled():
+    columnar.write_columns(columnar.columns_path('suburb_data.json'), suburb_records)
+
 print("Aggregated suburb data saved to 'suburb_data.json'.")
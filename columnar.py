@@ -0,0 +1,194 @@
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+
+# Stages also write <artifact>.columns/ next to their JSON output when PIPELINE_COLUMNAR is set
+COLUMNAR_ENV = 'PIPELINE_COLUMNAR'
+MANIFEST_FILE = 'manifest.json'
+FORMAT_VERSION = 1
+
+# Column kinds and the array dtype they are stored as
+KIND_DTYPES = {'bool': np.bool_, 'int': np.int64, 'float': np.float64}
+VALUE_KINDS = {bool: 'bool', int: 'int', float: 'float', str: 'str'}
+
+
+def enabled():
+    return os.environ.get(COLUMNAR_ENV) == '1'
+
+
+def columns_path(json_path):
+    """Columnar directory written alongside a JSON artifact, e.g. property_data.json -> property_data.columns"""
+    return os.path.splitext(json_path)[0] + '.columns'
+
+
+def merge_kinds(current, kind):
+    if current is None or current == kind:
+        return kind
+    if {current, kind} <= {'bool', 'int', 'float'}:
+        return 'float'
+    return 'json'
+
+
+def infer_columns(records):
+    """Column name -> kind over all records, plus the row count and which columns have missing values"""
+    kinds = {}
+    counts = {}
+    rows = 0
+    for record in records:
+        rows += 1
+        for column, value in record.items():
+            if value is None:
+                kinds.setdefault(column, None)
+                continue
+            counts[column] = counts.get(column, 0) + 1
+            kinds[column] = merge_kinds(kinds.get(column), VALUE_KINDS.get(type(value), 'json'))
+
+    nullable = {column for column in kinds if counts.get(column, 0) < rows}
+    for column in nullable:
+        # Missing numbers become NaN, so a nullable int or bool column is stored as float
+        if kinds[column] in ('bool', 'int'):
+            kinds[column] = 'float'
+    return {column: kind or 'str' for column, kind in kinds.items()}, rows, nullable
+
+
+def write_columns(directory, records):
+    """
+    Write records as one array per column plus a manifest. Numeric and boolean columns of the same
+    kind are stored as the rows of one column-major .npy matrix, so wide tables with hundreds of
+    columns are still a handful of files while each column stays contiguous. Strings are stored
+    as an int64 offsets array into a UTF-8 byte buffer (lists and dicts likewise, as JSON text).
+    `records` must be re-iterable: it is read once to infer the schema and once to fill the arrays.
+    """
+    kinds, rows, nullable = infer_columns(records)
+    names = list(kinds)
+    # Row of each numeric column within its kind's matrix
+    positions = {}
+    widths = {kind: 0 for kind in KIND_DTYPES}
+    for name in names:
+        if kinds[name] in KIND_DTYPES:
+            positions[name] = widths[kinds[name]]
+            widths[kinds[name]] += 1
+    matrices = {kind: np.zeros((widths[kind], rows), dtype=dtype) for kind, dtype in KIND_DTYPES.items()}
+    numeric = {name: matrices[kinds[name]][position] for name, position in positions.items()}
+    text = {name: [] for name in names if name not in numeric}
+
+    for row, record in enumerate(records):
+        for name, array in numeric.items():
+            value = record.get(name)
+            array[row] = math.nan if value is None else value
+        for name, values in text.items():
+            value = record.get(name)
+            if value is not None and kinds[name] == 'json':
+                value = json.dumps(value)
+            values.append(value)
+
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+
+    for kind, matrix in matrices.items():
+        if len(matrix):
+            np.save(os.path.join(directory, f'{kind}.npy'), matrix)
+
+    columns = []
+    for index, name in enumerate(names):
+        if name in numeric:
+            columns.append({'name': name, 'kind': kinds[name], 'file': kinds[name], 'row': positions[name]})
+            continue
+        entry = {'name': name, 'kind': kinds[name], 'file': f'c{index}'}
+        encoded = [b'' if value is None else value.encode('utf-8') for value in text[name]]
+        offsets = np.zeros(rows + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        np.save(os.path.join(directory, f'c{index}.offsets.npy'), offsets)
+        np.save(os.path.join(directory, f'c{index}.utf8.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        if name in nullable:
+            np.save(os.path.join(directory, f'c{index}.valid.npy'), np.array([value is not None for value in text[name]]))
+            entry['nullable'] = True
+        columns.append(entry)
+
+    # The manifest is written last, so a directory without one is an interrupted write
+    with open(os.path.join(directory, MANIFEST_FILE), 'w') as file:
+        json.dump({'version': FORMAT_VERSION, 'rows': rows, 'columns': columns}, file, indent=2)
+
+
+def write_features(directory, feature_collection):
+    """Write a point FeatureCollection as its properties plus longitude and latitude columns"""
+    write_columns(directory, [{**feature['properties'], 'longitude': feature['geometry']['coordinates'][0],
+                               'latitude': feature['geometry']['coordinates'][1]}
+                              for feature in feature_collection['features']])
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_FILE), 'r') as file:
+        return json.load(file)
+
+
+def decode_strings(directory, entry, start=0, stop=None):
+    """Decode rows [start, stop) of a string or JSON column (all rows by default) into an object array"""
+    offsets = np.load(os.path.join(directory, entry['file'] + '.offsets.npy'), mmap_mode='r')
+    offsets = np.array(offsets[start:None if stop is None else stop + 1])
+    buffer = np.load(os.path.join(directory, entry['file'] + '.utf8.npy'), mmap_mode='r')[offsets[0]:offsets[-1]].tobytes()
+    offsets -= offsets[0]
+    values = np.array([buffer[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+    if entry['kind'] == 'json':
+        # Assigned one by one so equal-length lists are not turned into a 2-D array
+        for index, value in enumerate(values):
+            values[index] = json.loads(value) if value else None
+    if entry.get('nullable'):
+        values[~np.load(os.path.join(directory, entry['file'] + '.valid.npy'), mmap_mode='r')[start:stop]] = None
+    return values
+
+
+def read_columns(directory, columns=None):
+    """
+    Load columns (all by default) as a dict of arrays. Numeric columns are memory-mapped, so
+    only the pages actually touched are read; string columns are decoded into object arrays.
+    """
+    manifest = read_manifest(directory)
+    entries = manifest['columns']
+    if columns is not None:
+        wanted = set(columns)
+        entries = [entry for entry in entries if entry['name'] in wanted]
+
+    matrices = {}
+    data = {}
+    for entry in entries:
+        if entry['kind'] in KIND_DTYPES:
+            if entry['file'] not in matrices:
+                matrices[entry['file']] = np.load(os.path.join(directory, entry['file'] + '.npy'), mmap_mode='r')
+            data[entry['name']] = matrices[entry['file']][entry['row']]
+        else:
+            data[entry['name']] = decode_strings(directory, entry)
+    return data
+
+
+def read_rows(directory, start, stop, columns=None):
+    """
+    Load rows [start, stop) of columns (all by default) as a dict of arrays copied out of the files,
+    so a large table can be processed in batches without holding all of it in memory
+    """
+    entries = read_manifest(directory)['columns']
+    if columns is not None:
+        wanted = set(columns)
+        entries = [entry for entry in entries if entry['name'] in wanted]
+
+    matrices = {}
+    data = {}
+    for entry in entries:
+        if entry['kind'] in KIND_DTYPES:
+            if entry['file'] not in matrices:
+                matrices[entry['file']] = np.load(os.path.join(directory, entry['file'] + '.npy'), mmap_mode='r')
+            data[entry['name']] = np.array(matrices[entry['file']][entry['row'], start:stop])
+        else:
+            data[entry['name']] = decode_strings(directory, entry, start, stop)
+    return data
+
+
+def read_frame(directory, columns=None):
+    """Load columns into a pandas DataFrame (copied out of the memory maps, so it can be modified)"""
+    import pandas as pd
+
+    return pd.DataFrame(read_columns(directory, columns))
@@ -0,0 +1,159 @@
+import numpy as np
+import pandas as pd
+from scipy import special
+
+# Area of a circle with radius 1.5 km, the radius of the osm_local_* counts
+RADIUS_AREA_KM2 = 3.14 * (1.5 ** 2)
+
+# Census percentage blocks the diversity indices are computed over
+RELIGION_PREFIX = 'abs_sub_religious_affiliation_top_responses'
+ANCESTRY_PREFIX = 'abs_sub_ancestry_top_responses'
+
+
+def block_columns(columns, prefix):
+    """The percentage columns of a census block"""
+    return [col for col in columns if col.startswith(prefix) and col.endswith('_pct')]
+
+
+def shannon_entropy(percentages):
+    """Shannon diversity index of each row of a 2-D array of percentages, ignoring zero shares"""
+    proportions = percentages / 100
+    return special.entr(np.where(proportions > 0, proportions, 0)).sum(axis=1)
+
+
+class FeatureFrame:
+    """
+    A listing frame's columns by name as float arrays, with each engineered feature computed from
+    its expression the first time it is asked for (by a caller or another feature) and kept
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.values = {}
+
+    def __getitem__(self, name):
+        if name not in self.values:
+            if name in FEATURES:
+                self.values[name] = FEATURES[name](self)
+            else:
+                self.values[name] = self.df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+        return self.values[name]
+
+    def sum(self, names):
+        """Row sums of the named columns, skipping missing values as DataFrame.sum does"""
+        return np.nansum([self[name] for name in names], axis=0)
+
+    def block(self, prefix):
+        return self.df[block_columns(self.df.columns, prefix)].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+# Engineered features, in the order they are added, as expressions over a FeatureFrame
+FEATURES = {
+    # Property and Land Features
+    'bedrooms_to_bathrooms_ratio': lambda f: f['reiwa_bedrooms'] / f['reiwa_bathrooms'],
+    'total_parking_spaces': lambda f: f['reiwa_parking'] + f['reiwa_bedrooms'],
+    'distance_to_cbd_airport_ratio': lambda f: f['osm_distance_to_perth_cbd'] / f['osm_distance_to_perth_airport'],
+    'rooms_per_square_meter': lambda f: (f['reiwa_bedrooms'] + f['reiwa_bathrooms']) / f['reiwa_landsize'],
+
+    # Community and Amenities (within 1.5 km radius)
+    'population_density_within_1_5km': lambda f: f['osm_local_community_population'] / RADIUS_AREA_KM2,
+    'dwellings_density_within_1_5km': lambda f: f['osm_local_community_dwellings'] / RADIUS_AREA_KM2,
+    'healthcare_accessibility_index': lambda f: f['osm_nearest_healthcare_facility'] / f['abs_people'],
+    'education_accessibility_index': lambda f: f['osm_nearest_primary_education'] + f['osm_nearest_higher_education'],
+    'public_service_density': lambda f: (f['osm_nearest_fire_station'] + f['osm_nearest_police_station'] + f['osm_nearest_library']) / RADIUS_AREA_KM2,
+    'recreation_density_within_1_5km': lambda f: (f['osm_local_leisure_facility'] + f['osm_local_sports_facility']) / RADIUS_AREA_KM2,
+    'proximity_to_public_transport': lambda f: (f['osm_nearest_bus_stop'] + f['osm_nearest_train_station']) / 2,
+
+    # Crime and Safety
+    'person_crime_to_property_crime_ratio': lambda f: f['wapol_total_person_crime'] / f['wapol_total_property_crime'],
+    'crime_rate': lambda f: (f['wapol_total_person_crime'] + f['wapol_total_property_crime']) / f['abs_people'],
+    'violent_crime_rate': lambda f: (f['wapol_offences_homicide'] + f['wapol_offences_sexual'] + f['wapol_offences_assault_family'] + f['wapol_offences_assault_non_family']) / f['abs_people'],
+    'property_crime_rate': lambda f: (f['wapol_offences_dwelling_burglary'] + f['wapol_offences_non_dwelling_burglary'] + f['wapol_offences_stealing'] + f['wapol_offences_property_damage'] + f['wapol_offences_arson']) / f['abs_people'],
+    'crime_density': lambda f: (f['wapol_total_person_crime'] + f['wapol_total_property_crime']) / f['abs_area_km2'],
+
+    # School and Education
+    'school_score_index': lambda f: f['scsa_awper'] + f['scsa_cert2fouratarper'] + f['scsa_numendper'] + f['scsa_readendper'] + f['scsa_writeendpe'],
+    'school_to_population_ratio': lambda f: f['scsa_ewnum'] / f['osm_local_community_population'],
+    'school_success_rate': lambda f: f['scsa_awnum'] / f['scsa_ewnum'],
+    'ATAR_success_rate': lambda f: f['scsa_fouratarper'] / 100,
+
+    # Socioeconomic Indicators
+    'income_to_rent_ratio': lambda f: f['abs_median_weekly_household_income'] / f['abs_median_weekly_rent'],
+    'income_to_mortgage_ratio': lambda f: f['abs_median_weekly_household_income'] / (f['abs_median_monthly_mortgage_repayment'] / 4),
+    'vehicle_ownership_rate': lambda f: f['abs_avg_vehicles_per_house'],
+    'unemployment_rate': lambda f: f['abs_sub_employment_status_unemployed_pct'],
+    'fulltime_employment_rate': lambda f: f['abs_sub_employment_status_worked_fulltime_pct'],
+
+    # Demographic and Health
+    'elderly_population_ratio': lambda f: (f['abs_sub_age_6569_years_val'] + f['abs_sub_age_7074_years_val'] + f['abs_sub_age_7579_years_val'] + f['abs_sub_age_8084_years_val'] + f['abs_sub_age_85_years_and_over_val']) / f['abs_people'],
+    'youth_population_ratio': lambda f: (f['abs_sub_age_04_years_val'] + f['abs_sub_age_59_years_val'] + f['abs_sub_age_1014_years_val'] + f['abs_sub_age_1519_years_val']) / f['abs_people'],
+    'longterm_health_condition_rate': lambda f: (f['abs_sub_type_of_longterm_health_condition_arthritis_val'] + f['abs_sub_type_of_longterm_health_condition_asthma_val'] + f['abs_sub_type_of_longterm_health_condition_cancer_val'] + f['abs_sub_type_of_longterm_health_condition_diabetes_val'] + f['abs_sub_type_of_longterm_health_condition_mental_health_condition_val']) / f['abs_people'],
+    'no_health_condition_rate': lambda f: f['abs_sub_type_of_longterm_health_condition_no_longterm_health_condition_pct'],
+
+    # Transportation and Commuting
+    'car_dependency_rate': lambda f: f['abs_sub_method_of_travel_to_work_on_the_day_of_the_census_top_responses_people_who_travelled_to_work_by_car_as_driver_or_passenger_pct'],
+    'public_transport_usage_rate': lambda f: f['abs_sub_method_of_travel_to_work_on_the_day_of_the_census_top_responses_people_who_travelled_to_work_by_public_transport_pct'],
+    'work_from_home_rate': lambda f: f['abs_sub_method_of_travel_to_work_on_the_day_of_the_census_top_responses_worked_at_home_pct'],
+    'non_commuting_population_rate': lambda f: f['abs_sub_method_of_travel_to_work_on_the_day_of_the_census_top_responses_did_not_go_to_work_pct'],
+
+    # Family and Housing
+    'household_size': lambda f: f['abs_people_per_household'],
+    'children_per_family': lambda f: f['abs_child_per_family'],
+    'family_households_rate': lambda f: f['abs_sub_household_composition_family_households_pct'],
+    'single_person_households_rate': lambda f: f['abs_sub_household_composition_single_person_households_pct'],
+    'couple_with_children_rate': lambda f: f['abs_sub_family_composition_couple_family_with_children_pct'],
+    'owned_outright_rate': lambda f: f['abs_sub_tenure_type_owned_outright_pct'],
+    'owned_with_mortgage_rate': lambda f: f['abs_sub_tenure_type_owned_with_a_mortgage_pct'],
+    'rental_affordability_index': lambda f: f['abs_sub_rent_weekly_payments_median_rent_val'] / f['abs_median_weekly_household_income'],
+
+    # New Features from Existing Data
+    'nearby_schools_quality_index': lambda f: f['scsa_awper'] * f['scsa_readendper'] / 100,
+    'crime_trend': lambda f: f['wapol_avg_person_crime_prev_3y'] / f['wapol_total_person_crime'],
+
+    # Odd features
+    'lat_long_interaction': lambda f: f['reiwa_latitude'] * f['reiwa_longitude'],
+    'bedrooms_to_land_size_ratio': lambda f: f['reiwa_bedrooms'] / f['reiwa_landsize'],
+    'bathrooms_to_land_size_ratio': lambda f: f['reiwa_bathrooms'] / f['reiwa_landsize'],
+    'parking_to_land_size_ratio': lambda f: f['reiwa_parking'] / f['reiwa_landsize'],
+    'coast_and_transport_score': lambda f: f['osm_nearest_coast'] * f['proximity_to_public_transport'],
+    'combined_education_accessibility': lambda f: f['osm_nearest_primary_education'] + f['osm_nearest_higher_education'] + f['osm_nearest_library'],
+    'combined_crime_rate': lambda f: (f['wapol_total_person_crime'] + f['wapol_total_property_crime']) / f['abs_people'],
+    'high_school_performance_index': lambda f: f['ATAR_success_rate'] * f['school_score_index'],
+    'affordability_index': lambda f: f['income_to_rent_ratio'] + f['income_to_mortgage_ratio'],
+    'employment_health_index': lambda f: f['fulltime_employment_rate'] * f['no_health_condition_rate'],
+    'suburb_density_ratio': lambda f: f['abs_people'] / f['abs_houses'],
+    'vehicle_to_person_ratio': lambda f: f['abs_avg_vehicles_per_house'] / f['abs_people_per_household'],
+    'gender_ratio': lambda f: f['abs_male_ratio'] / f['abs_female_ratio'],
+    'nearby_amenities_score': lambda f: f.sum(['osm_local_dining', 'osm_local_shop', 'osm_local_sports_facility',
+                                               'osm_local_leisure_facility', 'osm_local_public_art']),
+    'crime_to_amenities_ratio': lambda f: f['combined_crime_rate'] / f['nearby_amenities_score'],
+    'suburb_socioeconomic_status': lambda f: f['abs_median_weekly_household_income'] / f['abs_median_age'],
+    'proximity_to_essential_services': lambda f: f.sum(['osm_nearest_healthcare_facility', 'osm_nearest_police_station',
+                                                        'osm_nearest_fire_station', 'osm_nearest_post_office',
+                                                        'osm_nearest_financial_services']),
+
+    # Diversity Features
+    'religious_diversity': lambda f: shannon_entropy(f.block(RELIGION_PREFIX)),
+    'cultural_diversity': lambda f: shannon_entropy(f.block(ANCESTRY_PREFIX)),
+}
+
+
+def selected_features(columns):
+    """The engineered features among `columns`"""
+    return [col for col in columns if col in FEATURES]
+
+
+def add_features(df, names=None):
+    """
+    Add the engineered features `names` (default: all of them) to a listing frame. Only those and
+    the features they are built from are computed, so scoring a model that kept a few of them
+    does not pay for the rest.
+    """
+    names = list(FEATURES) if names is None else list(names)
+    frame = FeatureFrame(df)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        features = pd.DataFrame({name: frame[name] for name in names}, index=df.index)
+
+    # Ratios with a zero denominator are missing rather than infinite, which the scaler rejects
+    features = features.replace([np.inf, -np.inf], np.nan)
+    return pd.concat([df.drop(columns=[name for name in names if name in df.columns]), features], axis=1)
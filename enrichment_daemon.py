@@ -0,0 +1,177 @@
+import argparse
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime
+
+import listing_queue
+import warehouse
+from score_listings import read_listings
+from valuation_service import Valuer
+
+OUTPUT_FILE = 'property_data_live_predictions.jsonl'
+
+# Warehouse table the valued listings are appended to when the warehouse is enabled
+WAREHOUSE_TABLE = 'live_predictions'
+
+# Seconds between checks for new batches
+POLL_INTERVAL = 1.0
+
+# Queue entries valued together
+QUEUE_BATCH_SIZE = 1000
+
+# Drop directory files holding listing batches; writers should write under another name
+# (e.g. a leading '.' or a .tmp suffix) and rename the finished file into place
+BATCH_SUFFIXES = ('.json', '.jsonl')
+
+
+class DropDirectory:
+    """Listing batches dropped as JSON list or .jsonl files, moved to processed/ or failed/ once handled"""
+
+    def __init__(self, path):
+        self.path = path
+        self.processed_dir = os.path.join(path, 'processed')
+        self.failed_dir = os.path.join(path, 'failed')
+        os.makedirs(self.processed_dir, exist_ok=True)
+        os.makedirs(self.failed_dir, exist_ok=True)
+
+    def next_batch(self):
+        """(name, arrival time) of the oldest dropped file, or None when there is none"""
+        entries = [(entry.stat().st_mtime, entry.name) for entry in os.scandir(self.path)
+                   if entry.is_file() and entry.name.endswith(BATCH_SUFFIXES) and not entry.name.startswith('.')]
+        if not entries:
+            return None
+        arrived_at, name = min(entries)
+        return name, arrived_at
+
+    def read(self, name):
+        return list(read_listings(os.path.join(self.path, name)))
+
+    def complete(self, name, error=None):
+        os.replace(os.path.join(self.path, name), os.path.join(self.failed_dir if error else self.processed_dir, name))
+
+
+class QueueTable:
+    """Listing batches from the SQLite listing queue, marked processed (with any error) once handled"""
+
+    def __init__(self, path, batch_size=QUEUE_BATCH_SIZE):
+        self.connection = listing_queue.connect(path)
+        self.batch_size = batch_size
+        self.batches = {}
+
+    def next_batch(self):
+        ids, entries, enqueued_at = listing_queue.pending(self.connection, self.batch_size)
+        if not ids:
+            return None
+        name = f'queue entries {ids[0]}-{ids[-1]}'
+        self.batches[name] = ids, entries
+        return name, enqueued_at
+
+    def read(self, name):
+        return [json.loads(entry) for entry in self.batches[name][1]]
+
+    def complete(self, name, error=None):
+        listing_queue.mark_processed(self.connection, self.batches.pop(name)[0], error)
+
+
+def unique_listings(listings):
+    """First listing per reiwa_listing_id, as build_property_data keeps them"""
+    seen = set()
+    unique = []
+    for listing in listings:
+        if listing['reiwa_listing_id'] not in seen:
+            seen.add(listing['reiwa_listing_id'])
+            unique.append(listing)
+    return unique
+
+
+def append_results(path, listings):
+    """Append valued listings to the output file (and warehouse table), synced before the batch is marked done"""
+    with open(path, 'a') as file:
+        for listing in listings:
+            file.write(json.dumps(listing) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+    if warehouse.enabled() and listings:
+        warehouse.append_table(WAREHOUSE_TABLE, listings, key='reiwa_listing_id')
+
+
+def log(message):
+    print(f"{datetime.now().isoformat(timespec='seconds')} {message}", flush=True)
+
+
+def run(valuer, source, output, interval=POLL_INTERVAL, once=False, stopping=None):
+    """
+    Value batches from `source` as they arrive until stopped (or, with `once`, until none are left).
+    A batch is marked done only after its results are written, so a batch interrupted by a crash
+    is valued again on restart. A batch that cannot be read or valued is marked failed, and the
+    daemon moves on to the next one.
+    """
+    stopping = stopping or threading.Event()
+
+    def complete(name, error=None):
+        try:
+            source.complete(name, error)
+        except Exception as complete_error:
+            # The batch is left pending and retried after the interval
+            log(f"Could not mark {name} {'failed' if error else 'done'}: {type(complete_error).__name__}: {complete_error}")
+            stopping.wait(interval)
+
+    while not stopping.is_set():
+        try:
+            batch = source.next_batch()
+        except Exception as error:
+            log(f"Could not check for new batches: {type(error).__name__}: {error}")
+            stopping.wait(interval)
+            continue
+        if batch is None:
+            if once:
+                return
+            stopping.wait(interval)
+            continue
+
+        name, arrived_at = batch
+        start = time.perf_counter()
+        try:
+            valued = valuer.value_batch(unique_listings(source.read(name)))
+            append_results(output, valued)
+        except Exception as error:
+            log(f"Failed to value {name}: {type(error).__name__}: {error}")
+            complete(name, f'{type(error).__name__}: {error}')
+            continue
+        complete(name)
+        log(f"Valued {len(valued)} listings from {name} in {(time.perf_counter() - start) * 1000:.0f} ms, "
+            f"{time.time() - arrived_at:.2f} s after they arrived")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep the reference indexes and model in memory and enrich and score new listing batches as they arrive.')
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument('--watch', metavar='DIR', help='drop directory of listing batches (JSON list or .jsonl files)')
+    source_group.add_argument('--queue', metavar='DB', help='SQLite listing queue (reiwa/get_property_data.py --queue)')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--model', default='xgb_model.json')
+    parser.add_argument('--preprocessing', default='preprocessing.json', help='fitted preprocessing saved with the model')
+    parser.add_argument('--output', default=OUTPUT_FILE, help='newline-delimited JSON file the valued listings are appended to')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help='seconds between checks for new batches')
+    parser.add_argument('--batch-size', type=int, default=QUEUE_BATCH_SIZE, help='queue entries valued together')
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='XGBoost prediction threads')
+    parser.add_argument('--once', action='store_true', help='value the pending batches and exit')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    valuer = Valuer(args.model, args.preprocessing, args.suburbs, args.threads)
+    source = DropDirectory(args.watch) if args.watch else QueueTable(args.queue, args.batch_size)
+    print(f"Loaded the reference data, indexes and model in {time.time() - start_time:.2f} seconds; "
+          f"watching {args.watch or args.queue}.", flush=True)
+
+    # Stop between batches on SIGTERM or Ctrl-C
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    run(valuer, source, args.output, args.interval, args.once, stopping)
+
+if __name__ == '__main__':
+    main()
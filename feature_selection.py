@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.feature_selection import VarianceThreshold
+from sklearn.inspection import permutation_importance
+
+CACHE_DIR = 'feature_selection_cache'
+METHODS = ['gain', 'permutation']
+
+# Short boosting run used to rank the features
+RANKING_PARAMS = {'tree_method': 'hist', 'device': 'cpu', 'learning_rate': 0.3, 'max_depth': 6}
+RANKING_ROUNDS = 100
+
+# Rows the permutation importances are measured on
+PERMUTATION_SAMPLE_SIZE = 5000
+
+
+def frame_fingerprint(df, settings):
+    """Identifies the frame's columns, dtypes and values together with the selection settings"""
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode())
+    digest.update(json.dumps([[col, str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def gain_importances(X, y):
+    """Share of the total split gain of a short boosting run attributed to each column"""
+    dtrain = xgb.DMatrix(X, label=y, nthread=-1)
+    booster = xgb.train(RANKING_PARAMS, dtrain, num_boost_round=RANKING_ROUNDS)
+    gains = booster.get_score(importance_type='total_gain')
+    importances = np.array([gains.get(col, 0) for col in X.columns])
+    return importances / importances.sum()
+
+
+def permutation_importances(X, y):
+    """
+    Increase in squared error when each column is shuffled, for a short boosting run scored on a
+    held-out subsample, as a share of the total
+    """
+    rng = np.random.default_rng(42)
+    held_out = np.zeros(len(X), dtype=bool)
+    held_out[rng.choice(len(X), min(PERMUTATION_SAMPLE_SIZE, len(X) // 5), replace=False)] = True
+    model = xgb.XGBRegressor(n_estimators=RANKING_ROUNDS, n_jobs=-1, **RANKING_PARAMS)
+    model.fit(X[~held_out], y[~held_out])
+    result = permutation_importance(model, X[held_out], y[held_out], scoring='neg_mean_squared_error',
+                                    n_repeats=3, random_state=42, n_jobs=1)
+    importances = np.clip(result.importances_mean, 0, None)
+    return importances / importances.sum() if importances.sum() else importances
+
+
+def select_features(df, target, protected_columns, method='gain', variance_threshold=0.01,
+                    importance_threshold=0.005, cache_dir=CACHE_DIR):
+    """
+    Drop low-variance columns and columns with less than `importance_threshold` of the importance
+    (XGBoost gain from a short run, or permutation importance on a subsample), keeping the
+    protected and native categorical columns. The selected columns are cached in `cache_dir`
+    under a hash of the frame and settings, so selection only reruns when the data changes.
+
+    Returns the dataframe with the unselected columns dropped.
+    """
+    settings = {'target': target, 'protected': sorted(protected_columns), 'method': method, 'variance_threshold': variance_threshold,
+                'importance_threshold': importance_threshold, 'params': RANKING_PARAMS, 'rounds': RANKING_ROUNDS}
+    cache_path = os.path.join(cache_dir, f'{frame_fingerprint(df, settings)}.json')
+
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as file:
+            selected = json.load(file)['selected']
+        print(f'Using the cached feature selection {cache_path}')
+    else:
+        # Native categorical columns are not ranked, and always kept
+        categorical_columns = list(df.select_dtypes(include='category').columns)
+        X = df.drop(columns=[col for col in [target] + list(protected_columns) + categorical_columns if col in df.columns])
+        y = df[target]
+
+        # Apply Variance Threshold to reduce dimensionality
+        vt = VarianceThreshold(threshold=variance_threshold)
+        vt.fit(X)
+        X = X[X.columns[vt.get_support()]]
+
+        importances = gain_importances(X, y) if method == 'gain' else permutation_importances(X, y)
+        ranked = sorted(zip(X.columns, importances.tolist()), key=lambda item: -item[1])
+        selected = [col for col, importance in ranked if importance >= importance_threshold]
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, 'w') as file:
+            json.dump({'settings': settings, 'selected': selected, 'importances': dict(ranked)}, file, indent=2)
+
+    columns_to_keep = set(selected) | set(protected_columns) | set(df.select_dtypes(include='category').columns) | {target}
+    return df[[col for col in df.columns if col in columns_to_keep]]
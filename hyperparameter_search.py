@@ -0,0 +1,269 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import xgboost as xgb
+from tqdm import tqdm
+
+SEARCH_DIR = 'hyperparameter_search'
+RESULTS_FILE = 'results.jsonl'
+
+# CPU training profile shared by every candidate
+BASE_PARAMS = {
+    'tree_method': 'hist',
+    'device': 'cpu',
+    'eval_metric': 'rmse',
+}
+
+# Successive halving: candidates are first trained for MIN_ROUNDS, then each rung keeps the best
+# 1/ETA of them and trains the survivors ETA times longer, up to MAX_ROUNDS
+MIN_ROUNDS = 250
+MAX_ROUNDS = 10000
+ETA = 3
+EARLY_STOPPING_ROUNDS = 50
+
+
+class WeightedSquaredError:
+    """
+    Squared error weighting the head and tail of the price distribution. Training uses it as
+    per-row sample weights with the built-in squared error objective (sample_weights); calling it
+    gives the equivalent custom objective. A class rather than a closure so it can be sent to the
+    search's worker processes.
+    """
+
+    def __init__(self, low, high, min_price, max_price):
+        self.low = low
+        self.high = high
+        self.min_price = min_price
+        self.max_price = max_price
+
+    def weights(self, y_true):
+        weights = np.where((y_true <= self.low) | (y_true >= self.high), 2.5, 1)  # Prioritize head/tail prediction accuracy
+        weights += np.where((y_true <= self.min_price) | (y_true >= self.max_price), 100, 0)  # Prioritize predicting inside 50k - 10m
+        return weights
+
+    def sample_weights(self, labels):
+        """
+        Per-row weights for the built-in reg:squarederror objective, whose gradient (weight * residual)
+        and hessian (weight) then equal this objective's, computed once instead of every round
+        """
+        return 2 * self.weights(np.asarray(labels))
+
+    def __call__(self, preds, dtrain):
+        y_true = dtrain.get_label()
+        residuals = preds - y_true
+        weights = self.weights(y_true)
+        weighted_residuals = weights * residuals
+        grad = 2 * weighted_residuals
+        hess = 2 * weights
+        return grad, hess
+
+
+def rung_budgets(min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS, eta=ETA):
+    """Cumulative boosting rounds at each rung, e.g. 250, 750, 2250, 6750, 10000"""
+    budgets = []
+    rounds = min_rounds
+    while rounds < max_rounds:
+        budgets.append(rounds)
+        rounds *= eta
+    return budgets + [max_rounds]
+
+
+def candidate_id(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def matrix_digest(digest, dmatrix, buffer_path=None):
+    """Add a matrix's shape, feature names and types, labels, weights and feature values to `digest`"""
+    digest.update(f'{dmatrix.num_row()}x{dmatrix.num_col()}'.encode())
+    digest.update(json.dumps([dmatrix.feature_names, dmatrix.feature_types]).encode())
+    for info in (dmatrix.get_label(), dmatrix.get_weight(), dmatrix.get_base_margin()):
+        digest.update(np.ascontiguousarray(info).tobytes())
+
+    # The binary buffer saved for the workers holds the feature values
+    if buffer_path is not None:
+        with open(buffer_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        return
+
+    # Quantized and external memory matrices: their quantile cuts, and the binned values where XGBoost returns them
+    for read in (dmatrix.get_quantile_cut, dmatrix.get_data):
+        try:
+            arrays = read()
+        except xgb.core.XGBoostError:
+            continue
+        if not isinstance(arrays, tuple):
+            arrays = (arrays.indptr, arrays.indices, arrays.data)
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array).tobytes())
+
+
+def data_fingerprint(dmatrices, objective=None, early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    """
+    Identifies the training inputs (the matrices' features, labels and sample weights, the objective
+    and early stopping), so logged results and checkpoints are only resumed against the same ones.
+    `dmatrices` are (DMatrix, saved binary buffer path or None) pairs. Parameters are part of each
+    candidate's id.
+    """
+    digest = hashlib.sha1()
+    for dmatrix, buffer_path in dmatrices:
+        matrix_digest(digest, dmatrix, buffer_path)
+    objective_state = vars(objective) if hasattr(objective, '__dict__') else {}
+    digest.update(json.dumps([type(objective).__qualname__, getattr(objective, '__qualname__', None), objective_state,
+                              early_stopping_rounds], sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:12]
+
+
+def read_results(path, fingerprint):
+    """Logged (candidate, rung) results for this data, keyed by (candidate id, rounds)"""
+    results = {}
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            for line in file:
+                row = json.loads(line)
+                if row['data'] == fingerprint:
+                    results[(row['candidate'], row['rounds'])] = row
+    return results
+
+
+# Per-worker state, loaded once by init_worker
+worker_data = {}
+
+
+def init_worker(dmatrices, objective, nthread):
+    """`dmatrices` are (name, binary DMatrix path) pairs, or (name, DMatrix) when training in-process"""
+    worker_data['evals'] = [(xgb.DMatrix(data) if isinstance(data, str) else data, name) for name, data in dmatrices]
+    worker_data['objective'] = objective
+    worker_data['nthread'] = nthread
+
+
+def train_candidate(params, rounds, model_path, early_stopping_rounds):
+    """
+    Continue training a candidate from its checkpoint (if any) up to `rounds` boosting rounds.
+    The last eval set decides early stopping and the candidate's score.
+    """
+    start = time.perf_counter()
+    evals = worker_data['evals']
+    dtrain = evals[0][0]
+    previous = None
+    if os.path.exists(model_path):
+        previous = xgb.Booster(model_file=model_path)
+    done = previous.num_boosted_rounds() if previous is not None else 0
+
+    # Interrupted after checkpointing but before logging: score the checkpoint as it is
+    if done >= rounds:
+        score = float(previous.eval(evals[-1][0], evals[-1][1]).split(':')[-1])
+        return {'trained_rounds': done, 'score': score, 'best_iteration': done - 1, 'finished': False,
+                'seconds': time.perf_counter() - start}
+
+    evals_result = {}
+    booster = xgb.train(
+        params={**params, 'nthread': worker_data['nthread']},
+        dtrain=dtrain,
+        num_boost_round=rounds - done,
+        evals=evals,
+        obj=worker_data['objective'],
+        callbacks=[xgb.callback.EarlyStopping(rounds=early_stopping_rounds)],
+        evals_result=evals_result,
+        verbose_eval=False,
+        xgb_model=previous
+    )
+    booster.save_model(model_path)
+
+    scores = evals_result[evals[-1][1]]['rmse']
+    best_index = int(np.argmin(scores))
+    return {
+        'trained_rounds': booster.num_boosted_rounds(),
+        'score': float(scores[best_index]),
+        'best_iteration': done + best_index,
+        'finished': booster.num_boosted_rounds() < rounds,
+        'seconds': time.perf_counter() - start
+    }
+
+
+def search(param_grid, dtrain, dtest, dunsold, objective=None, search_dir=SEARCH_DIR, workers=None,
+           min_rounds=MIN_ROUNDS, max_rounds=MAX_ROUNDS, eta=ETA, early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    """
+    Successive-halving search over every combination in `param_grid`, scored on the RMSE of
+    `dunsold`. Candidates train in a process pool with each worker's nthread pinned to its share
+    of the cores (or one at a time in this process for a QuantileDMatrix or external memory data,
+    which cannot be saved for the workers). Every (candidate, rung) result is appended to search_dir/results.jsonl and each
+    candidate is checkpointed, so an interrupted search resumes where it stopped.
+
+    Returns the best parameters, its booster and the list of final results per candidate.
+    """
+    os.makedirs(os.path.join(search_dir, 'models'), exist_ok=True)
+    results_path = os.path.join(search_dir, RESULTS_FILE)
+
+    names = list(param_grid)
+    candidates = {}
+    for values in itertools.product(*(param_grid[name] for name in names)):
+        params = {**BASE_PARAMS, **dict(zip(names, values))}
+        candidates[candidate_id(params)] = params
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or max(1, cpus // 4), len(candidates)))
+    dmatrices = [('train', dtrain), ('eval', dtest), ('unsold', dunsold)]
+
+    # Workers load the data from XGBoost's binary format rather than having it pickled per task
+    executor_type = ProcessPoolExecutor
+    try:
+        dmatrix_paths = []
+        for name, dmatrix in dmatrices:
+            path = os.path.join(search_dir, f'{name}.buffer')
+            dmatrix.save_binary(path)
+            dmatrix_paths.append((name, path))
+        fingerprint = data_fingerprint([(dmatrix, path) for (_, dmatrix), (_, path) in zip(dmatrices, dmatrix_paths)],
+                                       objective, early_stopping_rounds)
+        dmatrices = dmatrix_paths
+    except xgb.core.XGBoostError:
+        # Only in-memory DMatrix objects can be saved; train anything else here, one candidate at a time
+        executor_type = ThreadPoolExecutor
+        workers = 1
+        fingerprint = data_fingerprint([(dmatrix, None) for _, dmatrix in dmatrices], objective, early_stopping_rounds)
+    nthread = max(1, cpus // workers)
+
+    logged = read_results(results_path, fingerprint)
+    latest = {}
+    survivors = list(candidates)
+
+    with executor_type(max_workers=workers, initializer=init_worker,
+                       initargs=(dmatrices, objective, nthread)) as executor, open(results_path, 'a') as log:
+        for rung, rounds in enumerate(rung_budgets(min_rounds, max_rounds, eta)):
+            futures = {}
+            for cid in survivors:
+                if (cid, rounds) in logged:
+                    latest[cid] = logged[(cid, rounds)]
+                elif not latest.get(cid, {}).get('finished'):
+                    model_path = os.path.join(search_dir, 'models', f'{fingerprint}-{cid}.json')
+                    futures[executor.submit(train_candidate, candidates[cid], rounds, model_path, early_stopping_rounds)] = cid
+
+            for future in tqdm(as_completed(futures), total=len(futures), desc=f'Rung {rung} ({rounds} rounds)'):
+                cid = futures[future]
+                result = future.result()
+
+                # Training resumes from the last round, not the best, so keep the best score seen so far
+                previous = latest.get(cid)
+                if previous is not None and previous['score'] <= result['score']:
+                    result['score'], result['best_iteration'] = previous['score'], previous['best_iteration']
+
+                row = {'data': fingerprint, 'candidate': cid, 'rung': rung, 'rounds': rounds,
+                       'params': candidates[cid], **result}
+                log.write(json.dumps(row) + '\n')
+                log.flush()
+                latest[cid] = row
+
+            # Keep the best 1/eta for the next rung
+            survivors.sort(key=lambda cid: latest[cid]['score'])
+            print(f'Rung {rung}: best unsold RMSE {latest[survivors[0]]["score"]:.8f} ({survivors[0]})')
+            survivors = survivors[:max(1, math.ceil(len(survivors) / eta))]
+
+    best = survivors[0]
+    best_model = xgb.Booster(model_file=os.path.join(search_dir, 'models', f'{fingerprint}-{best}.json'))
+    return candidates[best], best_model, list(latest.values())
@@ -0,0 +1,54 @@
+import json
+import sqlite3
+import time
+
+DEFAULT_PATH = 'listing_queue.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listing_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    processed_at REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS listing_queue_pending ON listing_queue (processed_at, id);
+"""
+
+
+def connect(path=DEFAULT_PATH):
+    """Open the queue; WAL mode lets the harvester enqueue while the daemon reads"""
+    connection = sqlite3.connect(path, timeout=300)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def enqueue(path, listings):
+    """Queue raw listings (as harvested) for enrichment and scoring, returning how many were queued"""
+    listings = list(listings)
+    if not listings:
+        return 0
+    connection = connect(path)
+    with connection:
+        enqueued_at = time.time()
+        connection.executemany('INSERT INTO listing_queue (data, enqueued_at) VALUES (?, ?)',
+                               [(json.dumps(listing), enqueued_at) for listing in listings])
+    connection.close()
+    return len(listings)
+
+
+def pending(connection, limit):
+    """The oldest unprocessed entries as (ids, JSON encoded listings, earliest enqueue time)"""
+    rows = connection.execute('SELECT id, data, enqueued_at FROM listing_queue WHERE processed_at IS NULL ORDER BY id LIMIT ?',
+                              (limit,)).fetchall()
+    if not rows:
+        return [], [], None
+    return [row[0] for row in rows], [row[1] for row in rows], min(row[2] for row in rows)
+
+
+def mark_processed(connection, ids, error=None):
+    with connection:
+        processed_at = time.time()
+        connection.executemany('UPDATE listing_queue SET processed_at = ?, error = ? WHERE id = ?',
+                               [(processed_at, error, entry_id) for entry_id in ids])
@@ -4,10 +4,16 @@ import requests
 import zipfile
 import io
 import os
+import sys
 import shapefile  # pyshp library
 import pandas as pd
 from geojson import Feature, FeatureCollection
 
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import columnar
+import warehouse
+
 # URLs for the required files
 census_csv_url = "https://www.abs.gov.au/census/guide-census-data/mesh-block-counts/2021/Mesh%20Block%20Counts%2C%202021.xlsx"
 geojson_url = "https://www.abs.gov.au/statistics/standards/australian-statistical-geography-standard-asgs-edition-3/jul2021-jun2026/access-and-downloads/digital-boundary-files/MB_2021_AUST_SHP_GDA2020.zip"
@@ -149,3 +155,8 @@ new_geojson = {
 # Save the new GeoJSON data to a file
 with open("aus_mesh_blocks_processed.geojson", "w") as file:
     json.dump(new_geojson, file)
+
+if warehouse.enabled():
+    warehouse.write_features("mesh_blocks", new_geojson)
+if columnar.enabled():
+    columnar.write_features(columnar.columns_path("aus_mesh_blocks_processed.geojson"), new_geojson)
@@ -1,6 +1,13 @@
 import json
+import os
+import sys
 import requests
 
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import columnar
+import warehouse
+
 USE_LOCAL_FILES = False
 
 def fetch_overpass_data(query, output_file):
@@ -95,9 +102,7 @@ def simplify_geojson(geojson_data):
         simplified_properties = {"name": properties.get("name", "")}
         
         for key, value in properties.items():
-            if key == "coast" and value == 1:
-                simplified_properties["coast"] = 1
-            elif key == "amenity":
+            if key == "amenity":
                 if value in ["cafe", "fast_food", "restaurant", "pub", "bar", "biergarten", "food_court", "ice_cream"]:
                     simplified_properties["dining"] = 1
                 elif value in ["parking", "parking_entrance", "parking_space", "motorcycle_parking", "bicycle_parking"]:
@@ -176,25 +181,40 @@ def simplify_geojson(geojson_data):
     
     return simplified_geojson
 
-def add_coast_property(coast_geojson_data):
+def extract_coast_lines(coast_geojson_data):
+    """
+    Flatten the coastline into individual LineString features. The property stage
+    splits these into segments and indexes them, so we keep the line geometry rather
+    than exploding every vertex into its own point feature.
+    """
     new_features = []
-    
+
     for feature in coast_geojson_data['features']:
-        if feature['geometry']['type'] == 'MultiLineString':
-            for line in feature['geometry']['coordinates']:
-                for coord in line:
-                    new_feature = {
-                        'type': 'Feature',
-                        'geometry': {
-                            'type': 'Point',
-                            'coordinates': coord
-                        },
-                        'properties': {'coast': 1}
-                    }
-                    new_features.append(new_feature)
-    
-    coast_geojson_data['features'] = new_features
-    return coast_geojson_data
+        geometry = feature['geometry']
+        if geometry['type'] == 'MultiLineString':
+            lines = geometry['coordinates']
+        elif geometry['type'] == 'LineString':
+            lines = [geometry['coordinates']]
+        else:
+            continue
+
+        for line in lines:
+            if len(line) < 2:
+                continue
+            new_feature = {
+                'type': 'Feature',
+                'geometry': {
+                    'type': 'LineString',
+                    'coordinates': line
+                },
+                'properties': {'coast': 1}
+            }
+            new_features.append(new_feature)
+
+    return {
+        'type': 'FeatureCollection',
+        'features': new_features
+    }
 
 def process_geojson_data(main_file_path, coast_file_path):
     with open(main_file_path, 'r', errors="ignore") as main_file:
@@ -203,10 +223,10 @@ def process_geojson_data(main_file_path, coast_file_path):
     with open(coast_file_path, 'r', errors="ignore") as coast_file:
         coast_geojson_data = json.load(coast_file)
 
-    coast_geojson_data = add_coast_property(coast_geojson_data)
-    
-    # Append coast features to main geojson features
-    geojson_data['features'].extend(coast_geojson_data['features'])
+    # Coastline is kept as lines in its own file instead of being merged into the node set
+    coast_lines = extract_coast_lines(coast_geojson_data)
+    with open('osm_coast_processed.geojson', 'w') as file:
+        json.dump(coast_lines, file)
 
     property_combinations = {}
 
@@ -252,6 +272,11 @@ def process_geojson_data(main_file_path, coast_file_path):
     with open('osm_nodes_processed.geojson', 'w') as file:
         json.dump(geojson_data, file, indent=2)
 
+    if warehouse.enabled():
+        warehouse.write_features('osm_nodes', geojson_data)
+    if columnar.enabled():
+        columnar.write_features(columnar.columns_path('osm_nodes_processed.geojson'), geojson_data)
+
 if __name__ == '__main__':
     main_query = """
     [out:json][timeout:25];
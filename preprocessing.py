@@ -0,0 +1,417 @@
+import json
+import os
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import special
+from scipy.stats import boxcox, boxcox_normmax
+from sklearn.preprocessing import StandardScaler
+
+import engineered_features
+
+FORMAT_VERSION = 1
+
+# Text fields that are not encoded, and list fields that cannot be
+TEXT_FIELDS = ['reiwa_address', 'reiwa_image_url', 'reiwa_details_url', 'reiwa_agency_name']
+LIST_FIELDS = ['abs_coordinates']
+
+# Categorical fields that are one-hot encoded
+CATEGORICAL_COLUMNS = ['reiwa_agency_no', 'reiwa_suburb', 'reiwa_house_type', 'reiwa_local_government', 'scsa_school']
+
+# Columns dropped before training (the per-offence counts are summarised by the wapol_total_* columns)
+DROP_PREFIXES = ['wapol_offences_']
+
+TARGET = 'reiwa_price'
+
+# Columns with at most this many distinct values are square rooted rather than Box-Cox transformed
+SQRT_MAX_UNIQUE = 20
+
+# Box-Cox lambdas are fitted in worker processes once there are at least this many columns per worker
+BOXCOX_COLUMNS_PER_WORKER = 8
+
+
+def flatten_dict(d, parent_key='', sep='_'):
+    """Flatten nested dictionaries, joining keys with `sep`"""
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, MutableMapping):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+
+def suburb_frame(suburb_data, suburbs=None):
+    """Suburb table from suburb_data.json, optionally limited to the given suburbs"""
+    filtered_suburb_data = {k: flatten_dict(v) for k, v in suburb_data.items() if suburbs is None or k in suburbs}
+    return pd.DataFrame.from_dict(filtered_suburb_data, orient='index').reset_index().rename(columns={'index': 'reiwa_suburb'})
+
+
+def school_frame(school_data):
+    """School table from school_data.json, keyed on scsa_school_id"""
+    return pd.DataFrame([{'scsa_school_id': school['school_id'], **school['achievement_data']} for school in school_data])
+
+
+def merge_reference_data(property_df, suburb_df, school_df):
+    """Join suburb attributes onto properties by suburb name and school attributes by scsa_school_id, then drop the school keys"""
+    df = pd.merge(property_df, suburb_df, on='reiwa_suburb', how='left')
+    df = pd.merge(df, school_df, on='scsa_school_id', how='left')
+    return df.drop(columns=['scsa_school_id', 'scsa_school_distance'])
+
+
+def landsize_in_hectares(house_type, landsize, total_rooms):
+    """Whether land sizes (single values or columns) were entered in hectares rather than square metres"""
+    return ((house_type == 'Land') & (landsize < 100)) | ((house_type != 'Land') & (landsize < 40) & (total_rooms > 4))
+
+
+def prepare_listings(property_df):
+    """
+    Zero missing listing fields and fix land sizes entered in hectares, without dropping any
+    listings. Applied before training and before scoring, so the model sees the same values in both.
+    """
+    property_df = property_df.fillna(0)
+    total_rooms = property_df['reiwa_bedrooms'] + property_df['reiwa_bathrooms'] + property_df['reiwa_parking']
+    property_df.loc[landsize_in_hectares(property_df['reiwa_house_type'], property_df['reiwa_landsize'], total_rooms), 'reiwa_landsize'] *= 10000
+    return property_df
+
+
+def prepare_listing(listing):
+    """prepare_listings for a single listing given as a dict"""
+    listing = {key: 0 if value is None or (isinstance(value, float) and np.isnan(value)) else value for key, value in listing.items()}
+    total_rooms = listing['reiwa_bedrooms'] + listing['reiwa_bathrooms'] + listing['reiwa_parking']
+    if landsize_in_hectares(listing['reiwa_house_type'], listing['reiwa_landsize'], total_rooms):
+        listing['reiwa_landsize'] *= 10000
+    return listing
+
+
+def clean_listings(property_df):
+    """
+    Drop duplicate and unrealistic listings (already prepared by prepare_listings) and take the
+    higher of the listing and sale price as the price
+    """
+    property_df = (
+        property_df.drop_duplicates(subset='reiwa_listing_id', keep='first')
+        .assign(reiwa_price=lambda x: x[['reiwa_listing_price', 'reiwa_price']].max(axis=1))
+        .drop(columns=['reiwa_listing_price'])
+        .query('osm_local_community_population != 0')
+    )
+
+    # Create total rooms count for various filtering tasks
+    property_df['total_rooms'] = property_df['reiwa_bedrooms'] + property_df['reiwa_bathrooms'] + property_df['reiwa_parking']
+
+    # Sanity check to filter out unrealistic properties
+    min_price_per_sqm = 1000
+    max_price_per_sqm = 100000
+    conditions = (
+        (property_df['reiwa_price'] <= 10000000) &  # Property price should be less than or equal to 10 million
+        (property_df['reiwa_price'] >= 50000) &  # Property price should be greater than or equal to 50k
+        (property_df['reiwa_landsize'] > 25) & (property_df['reiwa_landsize'] <= 10000) &  # Land size should be between 25 sqm and 10,000 sqm
+        ((property_df['total_rooms'] == 0) | (property_df['reiwa_landsize'] / property_df['total_rooms'] >= 10)) &  # If no rooms, condition is met; else, land size per room should be at least 10 sqm
+        ((property_df['reiwa_bedrooms'] == 0) | (property_df['reiwa_price'] / property_df['reiwa_bedrooms'] >= 50000)) &  # If no bedrooms, condition is met; else, price per bedroom should be at least 50k
+        ((property_df['total_rooms'] > 0) |  # If total rooms are more than 0,
+        ((property_df['reiwa_price'] / property_df['reiwa_landsize'] >= min_price_per_sqm) &  # price per sqm should be at least 1k
+        (property_df['reiwa_price'] / property_df['reiwa_landsize'] <= max_price_per_sqm)))  # and not exceed 100k
+    )
+    return property_df[conditions].drop(columns=['total_rooms'])
+
+
+def encode_categoricals(df):
+    """Drop the unencoded text and list fields and one-hot encode the categorical fields"""
+    df = df.drop(columns=[col for col in TEXT_FIELDS + LIST_FIELDS if col in df.columns])
+    return pd.get_dummies(df, columns=[col for col in CATEGORICAL_COLUMNS if col in df.columns])
+
+
+def drop_columns_by_prefix(df, prefixes):
+    """
+    Drop columns that begin with any of the specified prefixes.
+
+    Parameters:
+    df (pd.DataFrame): The input dataframe.
+    prefixes (list of str): The list of prefixes to check.
+
+    Returns:
+    pd.DataFrame: The dataframe with the specified columns dropped.
+    """
+    cols_to_drop = [col for col in df.columns if any(col.startswith(prefix) for prefix in prefixes)]
+    df_dropped = df.drop(columns=cols_to_drop)
+    return df_dropped
+
+
+def count_unique(values):
+    """Distinct non-missing values in each column of a 2-D array (DataFrame.nunique for a whole matrix)"""
+    values = np.sort(values, axis=0)
+    present = ~np.isnan(values)
+    changes = (np.diff(values, axis=0) != 0) & present[1:]
+    return changes.sum(axis=0) + present[:1].sum(axis=0)
+
+
+def boxcox_lambdas(values):
+    """
+    Maximum likelihood Box-Cox lambda of each column of `values`, as scipy.stats.boxcox fits it,
+    or NaN for columns that cannot be Box-Cox transformed (constant or not positive)
+    """
+    lambdas = np.full(values.shape[1], np.nan)
+    for index in range(values.shape[1]):
+        column = values[:, index]
+        if np.all(column == column[0]) or np.any(column <= 0):
+            continue
+        try:
+            lambdas[index] = boxcox_normmax(column, method='mle')
+        except ValueError:
+            continue
+    return lambdas
+
+
+def fit_boxcox_lambdas(values, workers=None):
+    """boxcox_lambdas with the columns split across worker processes, as the fits are independent"""
+    workers = min(workers or os.cpu_count() or 1, values.shape[1] // BOXCOX_COLUMNS_PER_WORKER)
+    if workers <= 1:
+        return boxcox_lambdas(values)
+
+    chunks = np.array_split(np.arange(values.shape[1]), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return np.concatenate(list(executor.map(boxcox_lambdas, [values[:, chunk] for chunk in chunks])))
+
+
+class Preprocessor:
+    """
+    The notebook's preprocessing, fitted once on the training frame and saved as JSON next to
+    xgb_model.json so new listings can be scored with exactly the same transformation: median
+    fills, the one-hot column layout (or the categories, with native categorical encoding),
+    the engineered features, per-column sign flips, square roots, shifts and Box-Cox lambdas, the StandardScaler state
+    and the target's Box-Cox lambda.
+    """
+
+    def __init__(self, use_transformation=True, use_scaler=True, exclude_columns=(), use_feature_engineering=False,
+                 native_categorical=False):
+        self.use_transformation = use_transformation
+        self.use_scaler = use_scaler
+        self.exclude_columns = list(exclude_columns)
+        self.use_feature_engineering = use_feature_engineering
+        self.native_categorical = native_categorical
+        self.categories = {}
+        self.medians = {}
+        self.target_lambda = None
+        self.columns = {}
+        self.feature_columns = []
+
+        # Whether feature_columns were chosen by feature selection (kept as they are by a full retrain)
+        self.feature_selection = False
+
+    def fill_missing(self, df, fit=False):
+        """Fill missing numeric values with the column medians (computed here when fitting)"""
+        if fit:
+            self.medians = {col: float(df[col].median()) for col in df.columns
+                            if pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])}
+        return df.fillna({col: median for col, median in self.medians.items() if col in df.columns})
+
+    def encode(self, df, fit=False):
+        """
+        Drop the unencoded text and list fields and encode the categorical fields: one-hot, or
+        with native categorical encoding as pandas categoricals (for XGBoost's enable_categorical)
+        over the categories seen when fitting
+        """
+        if not self.native_categorical:
+            return encode_categoricals(df)
+
+        df = df.drop(columns=[col for col in TEXT_FIELDS + LIST_FIELDS if col in df.columns])
+        if fit:
+            self.categories = {col: sorted(df[col].dropna().unique().tolist()) for col in CATEGORICAL_COLUMNS if col in df.columns}
+        for col, categories in self.categories.items():
+            df[col] = pd.Categorical(df[col], categories=categories)
+        return df
+
+    def add_features(self, df, names=None):
+        """Add the engineered features (only `names`, when given) if the preprocessing uses them"""
+        if not self.use_feature_engineering:
+            return df
+        return engineered_features.add_features(df, names)
+
+    def fit_transform(self, df, workers=None):
+        """
+        Drop the prefixed columns, Box-Cox the target and fit and apply the feature transformations.
+        The sign flips, square root or Box-Cox choices and shifts are fitted for all columns at once
+        on a single matrix, and the Box-Cox lambdas in `workers` processes (default: all cores).
+        """
+        df = drop_columns_by_prefix(df, DROP_PREFIXES)
+
+        # Boxcox our target variable (must take place before scaler)
+        df[TARGET], self.target_lambda = boxcox(df[TARGET])
+
+        # Collect transformable columns (all numeric except the excluded, bool and 0/1 columns)
+        candidates = [col for col in df.columns if not (col in self.exclude_columns or df[col].dtype == bool
+                                                        or isinstance(df[col].dtype, pd.CategoricalDtype))]
+        values = df[candidates].to_numpy(dtype=np.float64, na_value=np.nan)
+        binary = ((values == 0) | (values == 1)).all(axis=0) & (values == 0).any(axis=0) & (values == 1).any(axis=0)
+        transformable_columns = [col for col, is_binary in zip(candidates, binary) if not is_binary]
+        values = values[:, ~binary]
+        self.columns = {col: {} for col in transformable_columns}
+
+        if self.use_transformation:
+            negate = (values < 0).any(axis=0)
+            flipped = np.where(negate, -values, values)
+            sqrt = count_unique(flipped) <= SQRT_MAX_UNIQUE
+
+            # Shift to make all values positive before Box-Cox
+            minimum = np.min(flipped, axis=0, initial=np.inf, where=~np.isnan(flipped))
+            shift = np.where(~sqrt & (flipped <= 0).any(axis=0), np.abs(minimum) + 1, 0)
+            lambdas = np.full(len(transformable_columns), np.nan)
+            lambdas[~sqrt] = fit_boxcox_lambdas(flipped[:, ~sqrt] + shift[~sqrt], workers)
+            del flipped
+
+            for index, col in enumerate(transformable_columns):
+                state = self.columns[col]
+                if negate[index]:
+                    state['negate'] = True
+                if sqrt[index]:
+                    state['method'] = 'sqrt'
+                    continue
+                if shift[index]:
+                    state['shift'] = float(shift[index])
+                if not np.isnan(lambdas[index]):
+                    state['method'] = 'boxcox'
+                    state['lambda'] = float(lambdas[index])
+
+            values = self.transform_values(transformable_columns, values)
+
+        if self.use_scaler:
+            scaler = StandardScaler()
+            values = scaler.fit_transform(values)
+            for col, mean, scale in zip(transformable_columns, scaler.mean_, scaler.scale_):
+                self.columns[col]['mean'] = float(mean)
+                self.columns[col]['scale'] = float(scale)
+
+        if transformable_columns and (self.use_transformation or self.use_scaler):
+            df[transformable_columns] = values
+        return df
+
+    def transform_values(self, columns, values):
+        """
+        Apply the fitted transformations in place to a 2-D float array whose columns are `columns`,
+        as whole-array operations over the columns that have fitted state
+        """
+        active = [index for index, col in enumerate(columns) if self.columns.get(col)]
+        if not active:
+            return values
+        states = [self.columns[columns[index]] for index in active]
+        negate = np.array([state.get('negate', False) for state in states], dtype=bool)
+        sqrt = np.array([state.get('method') == 'sqrt' for state in states], dtype=bool)
+        shift = np.array([state.get('shift', 0) for state in states], dtype=np.float64)
+        lambdas = np.array([state.get('lambda', np.nan) for state in states], dtype=np.float64)
+        mean = np.array([state.get('mean', 0) for state in states], dtype=np.float64)
+        scale = np.array([state.get('scale', 1) for state in states], dtype=np.float64)
+
+        subset = values[:, active]
+        subset[:, negate] *= -1
+        subset[:, sqrt] = np.sqrt(subset[:, sqrt])
+        subset += shift
+        boxcox_columns = ~np.isnan(lambdas)
+        subset[:, boxcox_columns] = special.boxcox(subset[:, boxcox_columns], lambdas[boxcox_columns])
+        values[:, active] = (subset - mean) / scale
+        return values
+
+    def transform(self, df):
+        """
+        Turn enriched listings (already joined with suburb and school data) into the model's
+        feature matrix, using only the fitted state
+        """
+        df = self.fill_missing(df)
+        df = self.encode(df)
+
+        # Only the engineered features the model was trained on are computed
+        df = self.add_features(df, engineered_features.selected_features(self.feature_columns))
+
+        # Categories unseen in training have no column, and missing one-hot columns are all zero
+        df = df.reindex(columns=self.feature_columns, fill_value=0)
+
+        features = np.empty((len(df), len(self.feature_columns)), dtype=np.float32)
+        fitted = [index for index, col in enumerate(self.feature_columns) if col in self.columns]
+        fitted_columns = [self.feature_columns[index] for index in fitted]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # transform_values writes into the array, and when the columns are all float64 pandas
+            # returns a (read-only, under copy-on-write) view of the frame's data unless asked to copy
+            values = df[fitted_columns].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+            features[:, fitted] = self.transform_values(fitted_columns, values)
+
+        # One-hot and 0/1 columns are used as they are
+        unchanged = [index for index, col in enumerate(self.feature_columns) if col not in self.columns and col not in self.categories]
+        features[:, unchanged] = df[[self.feature_columns[index] for index in unchanged]].to_numpy(dtype=np.float32, na_value=np.nan)
+
+        # Native categorical features are passed as category codes, unseen categories as missing
+        for index, col in enumerate(self.feature_columns):
+            if col in self.categories:
+                codes = df[col].cat.codes.to_numpy(dtype=np.float32)
+                codes[codes < 0] = np.nan
+                features[:, index] = codes
+        return features
+
+    def transform_record(self, record):
+        """
+        transform for a single listing given as a dict (already joined with its suburb and school
+        fields), applying the same fills, encoding and transformations without building a
+        DataFrame, so valuing one listing is not dominated by pandas overhead
+        """
+        if self.use_feature_engineering:
+            return self.transform(pd.DataFrame([record]))
+
+        encoded = {}
+        for col, value in record.items():
+            if col in TEXT_FIELDS or col in LIST_FIELDS:
+                continue
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                value = self.medians.get(col, np.nan)
+            if col in CATEGORICAL_COLUMNS and self.native_categorical:
+                categories = self.categories.get(col, [])
+                encoded[col] = categories.index(value) if value in categories else np.nan
+            elif col in CATEGORICAL_COLUMNS:
+                # One-hot columns are named as pd.get_dummies names them
+                if not (isinstance(value, float) and np.isnan(value)):
+                    encoded[f'{col}_{value}'] = 1
+            else:
+                encoded[col] = value
+
+        # Missing columns are zero, as in transform
+        values = np.array([[encoded.get(col, 0) for col in self.feature_columns]], dtype=np.float64)
+        features = values.astype(np.float32)
+        fitted = [index for index, col in enumerate(self.feature_columns) if col in self.columns]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            features[:, fitted] = self.transform_values([self.feature_columns[index] for index in fitted], values[:, fitted])
+        return features
+
+    def inverse_target(self, predictions):
+        return special.inv_boxcox(predictions, self.target_lambda)
+
+    def save(self, path):
+        state = {
+            'version': FORMAT_VERSION,
+            'use_transformation': self.use_transformation,
+            'use_scaler': self.use_scaler,
+            'use_feature_engineering': self.use_feature_engineering,
+            'native_categorical': self.native_categorical,
+            'exclude_columns': self.exclude_columns,
+            'categories': self.categories,
+            'target_lambda': float(self.target_lambda),
+            'feature_columns': self.feature_columns,
+            'feature_selection': self.feature_selection,
+            'medians': self.medians,
+            'columns': self.columns,
+        }
+        with open(path, 'w') as file:
+            json.dump(state, file, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as file:
+            state = json.load(file)
+        preprocessor = cls(state['use_transformation'], state['use_scaler'], state['exclude_columns'],
+                           state['use_feature_engineering'], state.get('native_categorical', False))
+        preprocessor.categories = state.get('categories', {})
+        preprocessor.target_lambda = state['target_lambda']
+        preprocessor.feature_columns = state['feature_columns']
+        preprocessor.feature_selection = state.get('feature_selection', False)
+        preprocessor.medians = state['medians']
+        preprocessor.columns = state['columns']
+        return preprocessor
@@ -1,8 +1,95 @@
+import argparse
+import hashlib
 import json
+import os
 import re
+import sys
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telemetry import Telemetry
+
+CACHE_DIR = "suburb_cache"
+CACHE_TTL = 7 * 24 * 60 * 60  # Pages younger than this are used without contacting REIWA
+REQUEST_TIMEOUT = 30
+MAX_WORKERS = 16
+
+telemetry = Telemetry("reiwa_housing")
+
+def create_session():
+    """Shared session so suburb requests reuse pooled keep-alive connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS)
+    session.mount("https://", adapter)
+    return session
+
+def suburb_slug(suburb_name_raw):
+    return suburb_name_raw.lower().replace(" ", "-")
+
+def cache_paths(slug):
+    return os.path.join(CACHE_DIR, f"{slug}.html"), os.path.join(CACHE_DIR, f"{slug}.json")
+
+def read_cache(slug):
+    """Return the cached page and its metadata (ETag, Last-Modified, fetch time), or (None, None)"""
+    page_path, meta_path = cache_paths(slug)
+    if not os.path.exists(page_path) or not os.path.exists(meta_path):
+        return None, None
+    with open(page_path, 'r', encoding='utf-8') as file:
+        page = file.read()
+    with open(meta_path, 'r') as file:
+        meta = json.load(file)
+    return page, meta
+
+def write_cache(slug, page, meta):
+    page_path, meta_path = cache_paths(slug)
+    with open(page_path, 'w', encoding='utf-8') as file:
+        file.write(page)
+    with open(meta_path, 'w') as file:
+        json.dump(meta, file)
+
+def fetch_suburb_page(session, slug):
+    """
+    Fetch a suburb page through the on-disk cache. Fresh entries are returned as-is, stale
+    entries are revalidated with ETag/Last-Modified so unchanged pages cost only a 304.
+    Returns the page and how it was obtained ('cached', 'revalidated', 'fetched' or 'not found').
+    Suburbs without a REIWA page (404) are kept, parsing to the default values as they always have.
+    """
+    page, meta = read_cache(slug)
+    if page is not None and time.time() - meta["fetched_at"] < CACHE_TTL:
+        return page, "cached"
+
+    headers = {}
+    if page is not None:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    url = f"https://reiwa.com.au/suburb/{slug}/"
+    response = telemetry.request(session.get, "suburb_page", url, headers=headers, timeout=REQUEST_TIMEOUT)
+
+    if response.status_code == 304 and page is not None:
+        meta["fetched_at"] = time.time()
+        write_cache(slug, page, meta)
+        return page, "revalidated"
+
+    if response.status_code != 404:
+        response.raise_for_status()
+    meta = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_hash": hashlib.sha1(response.content).hexdigest(),
+        "fetched_at": time.time()
+    }
+    write_cache(slug, response.text, meta)
+    return response.text, "not found" if response.status_code == 404 else "fetched"
 
 def extract_stat_value(soup, label_text):
     stat_box_label = soup.find("span", class_="o-stat-box__lbl", text=label_text)
@@ -11,13 +98,8 @@ def extract_stat_value(soup, label_text):
         return stat_box_value
     return None
 
-def get_reiwa_suburb(suburb_name_raw):
-    suburb_name = suburb_name_raw.lower().replace(" ", "-")
-    print(suburb_name)
-    
-    url = f"https://reiwa.com.au/suburb/{suburb_name}/"
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, "html.parser")
+def parse_reiwa_suburb(page):
+    soup = BeautifulSoup(page, "html.parser")
 
     data = {}
 
@@ -42,7 +124,7 @@ def get_reiwa_suburb(suburb_name_raw):
             data["reiwa_median_house_sale"] = int(float(median_sales_price_value) * 1000)
     else:
         data["reiwa_median_house_sale"] = 0
-        
+
     # Sales Growth
     sales_growth_text = extract_stat_value(soup, "Sales growth")
     if sales_growth_text:
@@ -60,30 +142,52 @@ def get_reiwa_suburb(suburb_name_raw):
 
     return data
 
-def fetch_suburb_data(suburb):
+def fetch_suburb_data(session, suburb, offline):
+    suburb_name = suburb['abs_scc_name']
+    slug = suburb_slug(suburb_name)
     try:
-        return suburb['abs_scc_name'], get_reiwa_suburb(suburb['abs_scc_name'])
+        if offline:
+            page, _ = read_cache(slug)
+            source = "cached"
+            if page is None:
+                return suburb_name, None, "missing"
+        else:
+            page, source = fetch_suburb_page(session, slug)
+        return suburb_name, parse_reiwa_suburb(page), source
     except Exception as e:
-        print(f"Error occurred for suburb {suburb['abs_scc_name']}:", e)
-        return suburb['abs_scc_name'], None
+        print(f"Error occurred for suburb {suburb_name}:", e)
+        return suburb_name, None, "failed"
+
+def main(offline):
+    # Load the census data from abs/extracted_data.json
+    with open('../abs/census_data_processed.json', 'r') as file:
+        census_data = json.load(file)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
 
-# Load the census data from abs/extracted_data.json
-with open('../abs/census_data_processed.json', 'r') as file:
-    census_data = json.load(file)
+    # Initialize the REIWA housing data
+    reiwa_housing_data = {}
+    sources = {}
 
-# Initialize the REIWA housing data
-reiwa_housing_data = {}
+    # Use ThreadPoolExecutor to fetch data concurrently over one pooled session
+    with create_session() as session, ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(fetch_suburb_data, session, suburb, offline) for suburb in census_data.values()]
+        for future in tqdm(as_completed(futures), total=len(futures), unit='suburb'):
+            suburb_name, data, source = future.result()
+            sources[source] = sources.get(source, 0) + 1
+            if data:
+                reiwa_housing_data[suburb_name] = data
 
-# Use ThreadPoolExecutor to fetch data concurrently
-with ThreadPoolExecutor() as executor:
-    futures = [executor.submit(fetch_suburb_data, suburb) for suburb in census_data.values()]
-    for future in as_completed(futures):
-        suburb_name, data = future.result()
-        if data:
-            reiwa_housing_data[suburb_name] = data
+    # Save the REIWA housing data to a JSON file
+    with open('reiwa_housing_data.json', 'w') as file:
+        json.dump(reiwa_housing_data, file, indent=2)
 
-# Save the REIWA housing data to a JSON file
-with open('reiwa_housing_data.json', 'w') as file:
-    json.dump(reiwa_housing_data, file, indent=2)
+    print(f"Suburb pages: {', '.join(f'{count} {source}' for source, count in sorted(sources.items()))}.")
+    print("REIWA housing data saved to 'reiwa_housing_data.json'.")
 
-print("REIWA housing data saved to 'reiwa_housing_data.json'.")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Collect REIWA suburb statistics for every census suburb.")
+    parser.add_argument("--offline", action="store_true", help="rebuild reiwa_housing_data.json from cached pages only")
+    args = parser.parse_args()
+    with telemetry:
+        main(args.offline)
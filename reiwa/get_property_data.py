@@ -1,11 +1,42 @@
-import requests
-import json
+import argparse
+import asyncio
+import copy
+import os
+import sys
 import time
-from multiprocessing import Pool, Manager
 import re
 
-base_url = "https://reiwa.com.au/api/search/listing"
-output_file = "reiwa_listings.json"
+from listing_store import ListingStore, timestamp
+from reiwa_client import ReiwaClient, ReiwaRequestError
+
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telemetry import Telemetry
+import columnar
+import listing_queue
+import warehouse
+
+output_file = "reiwa_listings.jsonl"
+store_file = "reiwa_listings.db"
+
+# Price bands are searched adaptively: wide bands are probed for their result count and
+# only bisected when they hold listings. Bands stop splitting at PRICE_RESOLUTION since
+# reiwa_price is taken from the midpoint of the band a listing was found in.
+MAX_PRICE = 10_000_000
+PRICE_RESOLUTION = 10_000
+INITIAL_BAND_WIDTH = PRICE_RESOLUTION * 64
+PAGE_SIZE = 5000
+
+# Incremental sync walks each known band newest-first in small pages and stops once a page
+# holds nothing new or changed
+INCREMENTAL_PAGE_SIZE = 100
+INCREMENTAL_SORT_BY = "date"
+INCREMENTAL_SORT_DIRECTION = "desc"
+
+# Client limits: sustained requests per second, burst size and pooled connections
+REQUEST_RATE = 10
+REQUEST_BURST = 20
+MAX_CONNECTIONS = 16
 
 # Helper function to process prices from free-text input to int
 def process_price(price):
@@ -53,69 +84,103 @@ def process_price(price):
         print(e)
         return 0
 
-def mine_listings(args):
-    params, is_sold, min_price, max_price, listings = args
+def split_price_range(min_price, max_price):
+    """Bisect an inclusive price range on a PRICE_RESOLUTION boundary"""
+    bands = (max_price - min_price + 1) // PRICE_RESOLUTION
+    mid_price = min_price + (bands // 2) * PRICE_RESOLUTION
+    return [(min_price, mid_price - 1), (mid_price, max_price)]
+
+def search_params(params, min_price, max_price, page, page_size):
+    """Copy the base search parameters for one page of a price range"""
+    params = copy.deepcopy(params)
     params["SearchCriteria"]["MinPrice"] = min_price
     params["SearchCriteria"]["MaxPrice"] = max_price
+    params["PaginatedRequest"]["CurrentPage"] = page
+    params["PaginatedRequest"]["PageSize"] = page_size
+    return params
 
-    page = 1
+async def probe_listings(client, params, min_price, max_price):
+    """Read TotalResults for a price range without downloading its listings"""
+    try:
+        data, requests_made = await client.search(search_params(params, min_price, max_price, 1, 1))
+    except ReiwaRequestError as e:
+        print(f"Probe failed for price range {min_price} - {max_price}: {e}")
+        return min_price, max_price, None, e.attempts
 
-    while True:
-        params["PaginatedRequest"]["CurrentPage"] = page
+    if not data["Success"]:
+        # Keep splitting the range if we couldn't read the count
+        return min_price, max_price, None, requests_made
 
-        while True:
-            try:
-                response = requests.post(base_url, json=params)
-                data = response.json()
-                break
-            except Exception as e:
-                print(f"Request failed: {str(e)}. Retrying...")
-                time.sleep(5)  # Wait before retrying the request
+    total_results = data["Result"]["PaginatedResponse"]["TotalResults"]
+    return min_price, max_price, total_results, requests_made
 
-        if data["Success"]:
-            results = data["Result"]["PaginatedResponse"]["Results"]
-            total_results = data["Result"]["PaginatedResponse"]["TotalResults"]
-            page_size = params["PaginatedRequest"]["PageSize"]
-            total_pages = (total_results + page_size - 1) // page_size
+def parse_listing(result, is_sold, min_price, max_price):
+    """Convert a search result into our listing record"""
+    return {
+        "reiwa_address": result["Address"],
+        "reiwa_price": (min_price + max_price) // 2,
+        "reiwa_landsize": result.get("LandArea", 0),
+        "reiwa_latitude": result['Latitude'],
+        "reiwa_longitude": result['Longitude'],
+        "reiwa_bedrooms": result.get("Bedrooms", 0),
+        "reiwa_bathrooms": result.get("Bathrooms", 0),
+        "reiwa_parking": result.get("Carspaces", 0),
+        "reiwa_house_type": result["PropertyType"],
+        "reiwa_image_url": result["ListingImageUrls"][0] if result["ListingImageUrls"] else None,
+        "reiwa_details_url": result["PropertyDetailsURL"],
+        "reiwa_is_sold": is_sold,
+        "reiwa_floor_plan_count": result.get("FloorPlanCount", 0),
+        "reiwa_agency_name": result.get("AgencyName", ""),
+        "reiwa_agency_no": result.get("AgencyNo", ""),
+        "reiwa_pets_allowed": result.get("PetsAllowed", False),
+        "reiwa_suburb": result.get("Suburb", ""),
+        "reiwa_listing_price": process_price(result.get("DisplayPrice", "0")),
+        "reiwa_listing_id": result.get("ListingId", 0),
+    }
 
-            if total_results == 0:
-                print(f"No listings found for price range {min_price} - {max_price}.")
-                break
-
-            print(f"Total results found for price range {min_price} - {max_price}: {total_results}")
-            print(f"Scraping page {page} of {total_pages}")
-
-            for result in results:
-                listing = {
-                    "reiwa_address": result["Address"],
-                    "reiwa_price": (params["SearchCriteria"]["MinPrice"] + params["SearchCriteria"]["MaxPrice"]) // 2,
-                    "reiwa_landsize": result.get("LandArea", 0),
-                    "reiwa_latitude": result['Latitude'],
-                    "reiwa_longitude": result['Longitude'],
-                    "reiwa_bedrooms": result.get("Bedrooms", 0),
-                    "reiwa_bathrooms": result.get("Bathrooms", 0),
-                    "reiwa_parking": result.get("Carspaces", 0),
-                    "reiwa_house_type": result["PropertyType"],
-                    "reiwa_image_url": result["ListingImageUrls"][0] if result["ListingImageUrls"] else None,
-                    "reiwa_details_url": result["PropertyDetailsURL"],
-                    "reiwa_is_sold": is_sold,
-                    "reiwa_floor_plan_count": result.get("FloorPlanCount", 0),
-                    "reiwa_agency_name": result.get("AgencyName", ""),
-                    "reiwa_agency_no": result.get("AgencyNo", ""),
-                    "reiwa_pets_allowed": result.get("PetsAllowed", False),
-                    "reiwa_suburb": result.get("Suburb", ""),
-                    "reiwa_listing_price": process_price(result.get("DisplayPrice", "0")),
-                    "reiwa_listing_id": result.get("ListingId", 0),
-                }
-                listings.append(listing)
+async def mine_listing_page(client, params, is_sold, min_price, max_price, page, page_size=PAGE_SIZE):
+    """
+    Fetch one page of a price range, returning its listings, TotalResults and requests made.
+    TotalResults is None when the request failed or the search was unsuccessful.
+    """
+    try:
+        data, requests_made = await client.search(search_params(params, min_price, max_price, page, page_size))
+    except ReiwaRequestError as e:
+        print(f"Page {page} failed for price range {min_price} - {max_price}: {e}")
+        return [], None, e.attempts
+
+    if not data["Success"]:
+        return [], None, requests_made
+
+    results = data["Result"]["PaginatedResponse"]["Results"]
+    total_results = data["Result"]["PaginatedResponse"]["TotalResults"]
+    listings = [parse_listing(result, is_sold, min_price, max_price) for result in results]
+    return listings, total_results, requests_made
+
+async def mine_listings(client, params, is_sold, min_price, max_price):
+    """
+    Fetch every page of a price range, requesting pages after the first concurrently. Also
+    returns whether any page failed, in which case the listings are incomplete.
+    """
+    listings, total_results, requests_made = await mine_listing_page(client, params, is_sold, min_price, max_price, 1, PAGE_SIZE)
+    if not total_results:
+        return min_price, max_price, listings, requests_made, total_results is None
+
+    total_pages = (total_results + PAGE_SIZE - 1) // PAGE_SIZE
 
-            if page >= total_pages:
-                break
+    pages = await asyncio.gather(*[
+        mine_listing_page(client, params, is_sold, min_price, max_price, page, PAGE_SIZE) for page in range(2, total_pages + 1)
+    ])
+    failed = False
+    for page_listings, page_total_results, page_requests in pages:
+        listings.extend(page_listings)
+        requests_made += page_requests
+        failed = failed or page_total_results is None
 
-            page += 1
+    return min_price, max_price, listings, requests_made, failed
 
-def process_listings(is_sold):
-    initial_params = {
+def build_search_params(is_sold):
+    return {
         "UserInitiated": True,
         "PaginatedRequest": {
             "PageSize": 5000,
@@ -155,30 +220,160 @@ def process_listings(is_sold):
         }
     }
 
-    with Manager() as manager:
-        listings = manager.list()
-        price_ranges = [(price, price + 9999) for price in range(0, 10000000, 10000)]
+async def process_listings(client, is_sold, store, seen_at):
+    """
+    Full harvest of a listing category into the store. Returns the listing and request counts and
+    the price ranges that could not be fully harvested; when there are any, the recorded price
+    bands are left as they were.
+    """
+    initial_params = build_search_params(is_sold)
+    request_counts = {"probe": 0, "harvest": 0}
+    listing_counts = {"new": 0, "changed": 0, "unchanged": 0}
+    populated_ranges = []
+    failed_ranges = []
 
-        with Pool() as pool:
-            pool.map(mine_listings, [(initial_params, is_sold, min_price, max_price, listings) for min_price, max_price in price_ranges])
+    # Probe wide ranges and bisect those holding listings until they reach the price resolution
+    price_ranges = [(price, price + INITIAL_BAND_WIDTH - 1) for price in range(0, MAX_PRICE, INITIAL_BAND_WIDTH)]
+    harvest_ranges = []
 
-        return list(listings)
+    while price_ranges:
+        probes = await asyncio.gather(*[probe_listings(client, initial_params, min_price, max_price) for min_price, max_price in price_ranges])
+        price_ranges = []
 
-if __name__ == "__main__":
-    try:
-        # Collect sold listings
-        sold_listings = process_listings(True)
-        print("Sold listings data mining completed.")
+        for min_price, max_price, total_results, requests_made in probes:
+            request_counts["probe"] += requests_made
+            if total_results == 0:
+                continue
+
+            # Dense ranges are likely to have listings in most bands, so probing them further only adds requests
+            bands = (max_price - min_price + 1) // PRICE_RESOLUTION
+            if bands <= 2 or (total_results is not None and total_results >= bands):
+                harvest_ranges.extend((price, price + PRICE_RESOLUTION - 1) for price in range(min_price, max_price, PRICE_RESOLUTION))
+            else:
+                price_ranges.extend(split_price_range(min_price, max_price))
 
-        # Collect for sale listings
-        for_sale_listings = process_listings(False)
-        print("For sale listings data mining completed.")
+    print(f"Harvesting {len(harvest_ranges)} price ranges.")
 
-        # Combine sold and for sale listings
-        all_listings = sold_listings + for_sale_listings
+    # Batches go into the store as they arrive so the full listing set is never held in memory
+    harvests = [mine_listings(client, initial_params, is_sold, min_price, max_price) for min_price, max_price in harvest_ranges]
+    for harvest in asyncio.as_completed(harvests):
+        min_price, max_price, listings, requests_made, failed = await harvest
+        request_counts["harvest"] += requests_made
+        if failed:
+            failed_ranges.append((min_price, max_price))
+        if listings:
+            populated_ranges.append((min_price, max_price))
+        for key, count in store.upsert_listings(listings, seen_at).items():
+            listing_counts[key] += count
 
-        with open(output_file, "w") as file:
-            json.dump(all_listings, file, indent=4)
+    # A failed range may hold listings, so it must not drop out of the incremental sync
+    if not failed_ranges:
+        store.replace_price_bands(is_sold, populated_ranges, seen_at)
+    return listing_counts, request_counts, failed_ranges
 
+async def sync_listings(client, is_sold, store, seen_at):
+    """
+    Incremental sync of a listing category. Every band that held listings in the last full
+    harvest is read newest-first, one page at a time, until a page holds nothing new or changed.
+    Returns the listing and request counts and the price ranges whose sync stopped on a failure.
+    """
+    initial_params = build_search_params(is_sold)
+    initial_params["PaginatedRequest"]["SortBy"] = INCREMENTAL_SORT_BY
+    initial_params["PaginatedRequest"]["SortDirection"] = INCREMENTAL_SORT_DIRECTION
+    request_counts = {"probe": 0, "harvest": 0}
+    listing_counts = {"new": 0, "changed": 0, "unchanged": 0}
+    failed_ranges = []
+
+    price_ranges = [(min_price, max_price, 1) for min_price, max_price in store.price_bands(is_sold)]
+    if not price_ranges:
+        print("No price bands recorded yet, run a full harvest first.")
+        return listing_counts, request_counts, failed_ranges
+
+    while price_ranges:
+        pages = await asyncio.gather(*[
+            mine_listing_page(client, initial_params, is_sold, min_price, max_price, page, INCREMENTAL_PAGE_SIZE)
+            for min_price, max_price, page in price_ranges
+        ])
+
+        next_ranges = []
+        for (min_price, max_price, page), (listings, total_results, requests_made) in zip(price_ranges, pages):
+            request_counts["harvest"] += requests_made
+            if total_results is None:
+                failed_ranges.append((min_price, max_price))
+            counts = store.upsert_listings(listings, seen_at)
+            for key, count in counts.items():
+                listing_counts[key] += count
+
+            has_more_pages = total_results is not None and page * INCREMENTAL_PAGE_SIZE < total_results
+            if has_more_pages and (counts["new"] or counts["changed"]):
+                next_ranges.append((min_price, max_price, page + 1))
+        price_ranges = next_ranges
+
+    return listing_counts, request_counts, failed_ranges
+
+def print_request_report(label, request_counts, elapsed):
+    """Summarise the requests issued for one listing category"""
+    total_requests = request_counts["probe"] + request_counts["harvest"]
+    print(f"{label}: {total_requests} requests ({request_counts['probe']} probe, {request_counts['harvest']} harvest) in {elapsed:.1f} seconds.")
+
+async def harvest_listings(client, store, incremental, run_started):
+    """
+    Harvest sold and then for sale listings into the store. Returns the request counts and time
+    taken per category and the price ranges whose requests failed.
+    """
+    harvest = sync_listings if incremental else process_listings
+    request_reports = []
+    failed_ranges = []
+
+    for label, is_sold in [("Sold", True), ("For sale", False)]:
+        start_time = time.time()
+        listing_counts, request_counts, failed = await harvest(client, is_sold, store, run_started)
+        request_reports.append((label, request_counts, time.time() - start_time))
+        failed_ranges.extend(failed)
+        print(f"{label} listings data mining completed ({listing_counts}).")
+
+    # A full harvest sees every live listing, so anything for sale it missed has been withdrawn.
+    # After a failed request it has not seen every listing, so nothing is marked.
+    if failed_ranges:
+        ranges = ", ".join(f"{min_price} - {max_price}" for min_price, max_price in failed_ranges[:10])
+        print(f"Requests failed for {len(failed_ranges)} price ranges ({ranges}{', ...' if len(failed_ranges) > 10 else ''}); "
+              f"withdrawn listings and price bands were left unchanged.")
+    elif not incremental:
+        withdrawn = store.mark_unseen_withdrawn(run_started)
+        print(f"{withdrawn} for sale listings marked as withdrawn.")
+
+    return request_reports, failed_ranges
+
+async def main(incremental, queue=None):
+    run_started = timestamp()
+
+    # New and changed listings are queued for the enrichment daemon as soon as they are stored
+    on_change = (lambda listings: listing_queue.enqueue(queue, listings)) if queue else None
+
+    with Telemetry("reiwa_listings") as telemetry:
+        async with ReiwaClient(rate=REQUEST_RATE, burst=REQUEST_BURST, max_connections=MAX_CONNECTIONS, telemetry=telemetry) as client:
+            with ListingStore(store_file, on_change) as store:
+                request_reports, failed_ranges = await harvest_listings(client, store, incremental, run_started)
+
+                with open(output_file, "w") as file:
+                    exported = store.export_jsonl(file)
+
+    if warehouse.enabled():
+        warehouse.write_listings("listings", warehouse.JsonLines(output_file))
+    if columnar.enabled():
+        columnar.write_columns(columnar.columns_path(output_file), warehouse.JsonLines(output_file))
+
+    for label, request_counts, elapsed in request_reports:
+        print_request_report(label, request_counts, elapsed)
+    print(f"{exported} listings saved to '{output_file}'.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest REIWA listings into the local listing store.")
+    parser.add_argument("--incremental", action="store_true", help="only fetch listings that are new or changed since the last run")
+    parser.add_argument("--queue", metavar="DB", help="also queue new and changed listings in this SQLite queue for enrichment_daemon.py")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args.incremental, args.queue))
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
\ No newline at end of file
+        print(f"An error occurred: {str(e)}")
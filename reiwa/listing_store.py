@@ -0,0 +1,165 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+
+STATUS_FOR_SALE = "for_sale"
+STATUS_SOLD = "sold"
+STATUS_WITHDRAWN = "withdrawn"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    listing_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    last_changed TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_status ON listings (status);
+
+CREATE TABLE IF NOT EXISTS status_transitions (
+    listing_id INTEGER NOT NULL,
+    from_status TEXT NOT NULL,
+    to_status TEXT NOT NULL,
+    changed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS status_transitions_listing ON status_transitions (listing_id);
+
+CREATE TABLE IF NOT EXISTS price_bands (
+    is_sold INTEGER NOT NULL,
+    min_price INTEGER NOT NULL,
+    max_price INTEGER NOT NULL,
+    last_harvested TEXT NOT NULL,
+    PRIMARY KEY (is_sold, min_price)
+);
+"""
+
+
+def listing_hash(listing):
+    """Stable hash of a listing's fields, used to detect changes between syncs"""
+    return hashlib.sha1(json.dumps(listing, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ListingStore:
+    """
+    Local SQLite store of REIWA listings keyed on ListingId. Records when listings are
+    first and last seen, and every status change (for sale -> sold / withdrawn). If given,
+    on_change is called with the new and changed listings of each batch once it is stored.
+    """
+
+    def __init__(self, path="reiwa_listings.db", on_change=None):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.on_change = on_change
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def upsert_listings(self, listings, seen_at):
+        """
+        Insert or update a batch of listings. Returns counts of new, changed and unchanged listings.
+        A sold listing is never moved back to for sale, matching how the harvest prefers sold records.
+        """
+        counts = {"new": 0, "changed": 0, "unchanged": 0}
+        changed_listings = []
+
+        with self.connection:
+            for listing in listings:
+                listing_id = listing["reiwa_listing_id"]
+                status = STATUS_SOLD if listing["reiwa_is_sold"] else STATUS_FOR_SALE
+                content_hash = listing_hash(listing)
+
+                row = self.connection.execute(
+                    "SELECT status, content_hash FROM listings WHERE listing_id = ?", (listing_id,)
+                ).fetchone()
+
+                if row is None:
+                    self.connection.execute(
+                        "INSERT INTO listings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (listing_id, status, content_hash, json.dumps(listing), seen_at, seen_at, seen_at)
+                    )
+                    counts["new"] += 1
+                    changed_listings.append(listing)
+                    continue
+
+                previous_status, previous_hash = row
+                if previous_status == STATUS_SOLD and status != STATUS_SOLD:
+                    self.connection.execute("UPDATE listings SET last_seen = ? WHERE listing_id = ?", (seen_at, listing_id))
+                    counts["unchanged"] += 1
+                    continue
+
+                if previous_status == status and previous_hash == content_hash:
+                    self.connection.execute("UPDATE listings SET last_seen = ? WHERE listing_id = ?", (seen_at, listing_id))
+                    counts["unchanged"] += 1
+                    continue
+
+                if previous_status != status:
+                    self.connection.execute(
+                        "INSERT INTO status_transitions VALUES (?, ?, ?, ?)",
+                        (listing_id, previous_status, status, seen_at)
+                    )
+
+                self.connection.execute(
+                    "UPDATE listings SET status = ?, content_hash = ?, data = ?, last_seen = ?, last_changed = ? WHERE listing_id = ?",
+                    (status, content_hash, json.dumps(listing), seen_at, seen_at, listing_id)
+                )
+                counts["changed"] += 1
+                changed_listings.append(listing)
+
+        if self.on_change and changed_listings:
+            self.on_change(changed_listings)
+        return counts
+
+    def mark_unseen_withdrawn(self, since):
+        """Mark for-sale listings not seen since the given timestamp as withdrawn"""
+        with self.connection:
+            stale_ids = [row[0] for row in self.connection.execute(
+                "SELECT listing_id FROM listings WHERE status = ? AND last_seen < ?", (STATUS_FOR_SALE, since)
+            )]
+            self.connection.executemany(
+                "INSERT INTO status_transitions VALUES (?, ?, ?, ?)",
+                [(listing_id, STATUS_FOR_SALE, STATUS_WITHDRAWN, since) for listing_id in stale_ids]
+            )
+            self.connection.executemany(
+                "UPDATE listings SET status = ?, last_changed = ? WHERE listing_id = ?",
+                [(STATUS_WITHDRAWN, since, listing_id) for listing_id in stale_ids]
+            )
+        return len(stale_ids)
+
+    def replace_price_bands(self, is_sold, price_ranges, harvested_at):
+        """Remember which price bands held listings in the last full harvest"""
+        with self.connection:
+            self.connection.execute("DELETE FROM price_bands WHERE is_sold = ?", (int(is_sold),))
+            self.connection.executemany(
+                "INSERT INTO price_bands VALUES (?, ?, ?, ?)",
+                [(int(is_sold), min_price, max_price, harvested_at) for min_price, max_price in price_ranges]
+            )
+
+    def price_bands(self, is_sold):
+        return self.connection.execute(
+            "SELECT min_price, max_price FROM price_bands WHERE is_sold = ? ORDER BY min_price", (int(is_sold),)
+        ).fetchall()
+
+    def export_jsonl(self, file):
+        """Write current sold and for-sale listings as newline-delimited JSON, returning the count"""
+        count = 0
+        rows = self.connection.execute(
+            "SELECT data FROM listings WHERE status != ? ORDER BY status = ? DESC, listing_id",
+            (STATUS_WITHDRAWN, STATUS_SOLD)
+        )
+        for (data,) in rows:
+            file.write(data + "\n")
+            count += 1
+        return count
+
+
+def timestamp():
+    return datetime.now().isoformat(timespec="seconds")
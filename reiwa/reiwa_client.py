@@ -0,0 +1,108 @@
+import asyncio
+import json
+import random
+import time
+
+import aiohttp
+
+BASE_URL = "https://reiwa.com.au/api/search/listing"
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ReiwaRequestError(Exception):
+    """Raised when a search request fails with a non-retryable status or still fails after the retry cap"""
+
+    def __init__(self, message, attempts):
+        super().__init__(message)
+        self.attempts = attempts
+
+
+class TokenBucket:
+    """Token bucket rate limiter: `rate` requests per second with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ReiwaClient:
+    """
+    Async client for the REIWA listing search API. Connections are pooled and kept alive,
+    requests are rate limited by a token bucket, and failures are retried with jittered
+    exponential backoff up to `max_retries` times.
+    """
+
+    def __init__(self, base_url=BASE_URL, rate=10, burst=20, max_connections=16, max_retries=6,
+                 backoff_base=1.0, backoff_cap=60.0, timeout=60, telemetry=None, endpoint="search_listing"):
+        self.base_url = base_url
+        self.telemetry = telemetry
+        self.endpoint = endpoint
+        self.bucket = TokenBucket(rate, burst)
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.session.close()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff delay for the given attempt number"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    async def search(self, params):
+        """Post a search request, returning the parsed response and the number of attempts made"""
+        for attempt in range(1, self.max_retries + 1):
+            await self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                async with self.session.post(self.base_url, json=params) as response:
+                    body = await response.read()
+                    self.record(start, status=response.status, nbytes=len(body))
+                    if response.status in RETRY_STATUSES:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status, message=response.reason
+                        )
+                    response.raise_for_status()
+                    return json.loads(body), attempt
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not isinstance(e, aiohttp.ClientResponseError):
+                    self.record(start, error=e)
+                elif e.status not in RETRY_STATUSES:
+                    raise ReiwaRequestError(f"Request failed with status {e.status}", attempt) from e
+                error = e
+            except ValueError as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise ReiwaRequestError(f"Request failed after {attempt} attempts: {error!r}", attempt) from error
+            if self.telemetry is not None:
+                self.telemetry.record_retry(self.endpoint)
+            await asyncio.sleep(self.backoff(attempt))
+
+    def record(self, start, status=None, error=None, nbytes=0):
+        if self.telemetry is not None:
+            self.telemetry.record_result(self.endpoint, time.perf_counter() - start, status, error, nbytes)
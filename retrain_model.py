@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from scipy import special
+
+import columnar
+from hyperparameter_search import EARLY_STOPPING_ROUNDS, WeightedSquaredError
+from preprocessing import TARGET, Preprocessor, clean_listings, prepare_listings, suburb_frame, school_frame, merge_reference_data
+from score_listings import load_model, read_listings
+from training_data import BATCH_SIZE, ListingBatches, fit_preprocessor, listing_dmatrices, prepared_batches
+
+STATE_FILE = 'training_state.json'
+
+# Extra boosting rounds a top-up may add on the newly sold listings
+TOPUP_ROUNDS = 200
+
+# Retrain from scratch when the model's RMSE on the newly sold listings, or on the holdout after
+# the top-up, exceeds the holdout RMSE of the last full training by this factor
+DRIFT_THRESHOLD = 1.25
+
+
+def save_training_state(path, params, objective, trained_listings, holdout_listings, holdout_rmse, rounds):
+    """
+    Record what a fully trained model was trained and validated on: its parameters and objective,
+    the listing ids of the training set and of the fixed holdout, and its holdout RMSE
+    """
+    state = {
+        'params': params,
+        'objective': {name: float(value) for name, value in vars(objective).items()} if objective is not None else None,
+        'trained_listings': [int(listing_id) for listing_id in trained_listings],
+        'holdout_listings': [int(listing_id) for listing_id in holdout_listings],
+        'holdout_rmse': float(holdout_rmse),
+        'rounds': int(rounds),
+        'trained_at': datetime.now().isoformat(timespec='seconds'),
+        'topups': [],
+    }
+    write_state(path, state)
+
+
+def write_state(path, state):
+    with open(path + '.tmp', 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def load_listings(path):
+    """
+    Enriched listings (JSON list, .jsonl or columnar directory) as the notebook loads and cleans
+    them, with an 'identifier' column
+    """
+    if os.path.isdir(path):
+        property_df = columnar.read_frame(path)
+    else:
+        property_df = pd.DataFrame(list(read_listings(path)))
+    property_df = prepare_listings(property_df)
+    property_df['identifier'] = range(1, len(property_df) + 1)
+    return clean_listings(property_df)
+
+
+def load_reference_data(suburbs_path, schools_path):
+    with open(suburbs_path, 'r') as file:
+        suburb_df = suburb_frame(json.load(file)).fillna(0)
+    suburb_df = suburb_df.query('reiwa_suburb_interest_level.notnull()')
+    with open(schools_path, 'r') as file:
+        school_df = school_frame(json.load(file))
+    return suburb_df, school_df
+
+
+def listing_matrix(booster, preprocessor, df):
+    """DMatrix of prepared sold listings with the model's fitted preprocessing, labelled with the transformed price"""
+    df = preprocessor.fill_missing(df)
+    df = df[df['reiwa_suburb_interest_level'].notnull()]
+    labels = special.boxcox(df[TARGET].to_numpy(dtype=np.float64), preprocessor.target_lambda)
+    return xgb.DMatrix(preprocessor.transform(df), label=labels, feature_names=preprocessor.feature_columns,
+                       feature_types=booster.feature_types, enable_categorical=preprocessor.native_categorical)
+
+
+def rmse(booster, dmatrix):
+    return float(np.sqrt(np.mean((booster.predict(dmatrix) - dmatrix.get_label()) ** 2)))
+
+
+def make_objective(state):
+    return WeightedSquaredError(**state['objective']) if state['objective'] else None
+
+
+def train_full(args, state, dtrain, dtest, objective):
+    if objective is not None:
+        dtrain.set_weight(objective.sample_weights(dtrain.get_label()))
+    return xgb.train(
+        params={**state['params'], 'nthread': args.threads},
+        dtrain=dtrain,
+        num_boost_round=state['rounds'],
+        evals=[(dtest, 'holdout')],
+        callbacks=[xgb.callback.EarlyStopping(rounds=EARLY_STOPPING_ROUNDS, save_best=True)],
+        verbose_eval=False
+    )
+
+
+def save_full(args, state, booster, preprocessor, objective, trained_listings, holdout_listings, dtest):
+    booster.save_model(args.model)
+    preprocessor.save(args.preprocessing)
+    holdout_rmse = rmse(booster, dtest)
+    save_training_state(args.state, state['params'], objective, trained_listings, holdout_listings,
+                        holdout_rmse, booster.num_boosted_rounds())
+    print(f'Retrained from scratch on {len(trained_listings)} sold listings: {booster.num_boosted_rounds()} rounds, '
+          f'holdout RMSE {holdout_rmse:.8f}')
+
+
+def full_retrain(args, suburb_df, school_df, state, previous):
+    """
+    Retrain from scratch on every sold listing except the fixed holdout, refitting the
+    preprocessing, with the parameters and rounds of the last full training. A model trained on
+    selected features is retrained on the same features.
+    """
+    if args.stream or args.external_memory:
+        return streamed_retrain(args, suburb_df, school_df, state, previous)
+
+    listings = load_listings(args.listings)
+    df = merge_reference_data(listings, suburb_df, school_df)
+    df = df[['identifier'] + [col for col in df.columns if col != 'identifier']]
+    preprocessor = Preprocessor(previous.use_transformation, previous.use_scaler, previous.exclude_columns,
+                                previous.use_feature_engineering, previous.native_categorical)
+    preprocessor.feature_selection = previous.feature_selection
+    df = preprocessor.fill_missing(df, fit=True)
+    df = df[df['reiwa_suburb_interest_level'].notnull()]
+    df = preprocessor.encode(df, fit=True)
+    df = preprocessor.add_features(df)
+    df = preprocessor.fit_transform(df)
+
+    df_sold = df[df['reiwa_is_sold'] == True]
+    listing_ids = listings.set_index('identifier')['reiwa_listing_id']
+    X = df_sold.drop(['reiwa_price', 'reiwa_is_sold', 'identifier'], axis=1)
+    y = df_sold['reiwa_price']
+    if previous.feature_selection:
+        # One-hot columns of categories no longer seen are all zero, as when scoring
+        X = X.reindex(columns=previous.feature_columns, fill_value=0)
+    preprocessor.feature_columns = list(X.columns)
+
+    # The holdout stays fixed across retrains
+    is_holdout = listing_ids[df_sold['identifier']].isin(set(state['holdout_listings'])).to_numpy()
+    X_train, X_test, y_train, y_test = X[~is_holdout], X[is_holdout], y[~is_holdout], y[is_holdout]
+
+    dtrain = xgb.DMatrix(X_train, label=y_train, nthread=-1, enable_categorical=preprocessor.native_categorical)
+    dtest = xgb.DMatrix(X_test, label=y_test, nthread=-1, enable_categorical=preprocessor.native_categorical)
+
+    objective = None
+    if state['objective']:
+        objective = WeightedSquaredError(np.percentile(y_train, 10), np.percentile(y_train, 90), y.min(), y.max())
+
+    booster = train_full(args, state, dtrain, dtest, objective)
+    save_full(args, state, booster, preprocessor, objective, listing_ids[df_sold.loc[X_train.index, 'identifier']],
+              listing_ids[df_sold.loc[X_test.index, 'identifier']], dtest)
+
+
+def streamed_retrain(args, suburb_df, school_df, state, previous):
+    """
+    full_retrain for histories too large to hold in memory: the preprocessing is fitted on a sample
+    and the training and holdout matrices are built from the stored listings a batch at a time, as
+    QuantileDMatrix objects or (with --external-memory) external memory matrices cached on disk
+    """
+    preprocessor = Preprocessor(previous.use_transformation, previous.use_scaler, previous.exclude_columns,
+                                previous.use_feature_engineering, previous.native_categorical)
+    fit_preprocessor(args.listings, suburb_df, school_df, preprocessor, batch_size=args.batch_size)
+    preprocessor.feature_selection = previous.feature_selection
+    if previous.feature_selection:
+        # The matrices are built by transform, which lays the listings out in these columns
+        preprocessor.feature_columns = list(previous.feature_columns)
+
+    holdout = set(state['holdout_listings'])
+    dtrain, dtest = listing_dmatrices(args.listings, suburb_df, school_df, preprocessor, holdout=holdout,
+                                      batch_size=args.batch_size, cache_dir=args.external_memory)
+
+    objective = None
+    if state['objective']:
+        y_train = dtrain.get_label()
+        y_test = dtest.get_label()
+        objective = WeightedSquaredError(np.percentile(y_train, 10), np.percentile(y_train, 90),
+                                         min(y_train.min(), y_test.min()), max(y_train.max(), y_test.max()))
+
+    booster = train_full(args, state, dtrain, dtest, objective)
+    trained_listings = ListingBatches(args.listings, suburb_df, school_df, preprocessor, 'train', holdout, args.batch_size).listing_ids()
+    holdout_listings = ListingBatches(args.listings, suburb_df, school_df, preprocessor, 'test', holdout, args.batch_size).listing_ids()
+    save_full(args, state, booster, preprocessor, objective, trained_listings, holdout_listings, dtest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Top up the trained model with newly sold listings, or retrain it when they have drifted.')
+    parser.add_argument('--listings', default='property_data.json')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--schools', default='school_data.json')
+    parser.add_argument('--model', default='xgb_model.json')
+    parser.add_argument('--preprocessing', default='preprocessing.json')
+    parser.add_argument('--state', default=STATE_FILE, help='training state saved by the notebook or the last retrain')
+    parser.add_argument('--rounds', type=int, default=TOPUP_ROUNDS, help='maximum boosting rounds added by a top-up')
+    parser.add_argument('--drift-threshold', type=float, default=DRIFT_THRESHOLD)
+    parser.add_argument('--full', action='store_true', help='retrain from scratch')
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    parser.add_argument('--stream', action='store_true',
+                        help='build full retrain data from the listings a batch at a time (QuantileDMatrix) instead of in memory')
+    parser.add_argument('--external-memory', metavar='CACHE_DIR',
+                        help='like --stream, but with external memory matrices cached in CACHE_DIR, for histories larger than RAM')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.state):
+        raise SystemExit(f'{args.state} not found; train the model with model_implementation.ipynb first, which saves it')
+    with open(args.state, 'r') as file:
+        state = json.load(file)
+
+    start_time = time.time()
+    booster, preprocessor = load_model(args.model, args.preprocessing, args.threads)
+    suburb_df, school_df = load_reference_data(args.suburbs, args.schools)
+
+    if args.full:
+        full_retrain(args, suburb_df, school_df, state, preprocessor)
+        print(f'Done in {time.time() - start_time:.2f} seconds.')
+        return
+
+    # Sold listings the model has not seen yet, and the holdout, read a batch at a time
+    holdout = set(state['holdout_listings'])
+    known = set(state['trained_listings']) | holdout
+    new_batches, holdout_batches = [], []
+    for df in prepared_batches(args.listings, suburb_df, school_df, args.batch_size):
+        sold = df[df['reiwa_is_sold'] == True]
+        new_batches.append(sold[~sold['reiwa_listing_id'].isin(known)])
+        holdout_batches.append(sold[sold['reiwa_listing_id'].isin(holdout)])
+    new_listings = pd.concat(new_batches, ignore_index=True)
+    if new_listings.empty:
+        print('No newly sold listings; the model is up to date.')
+        return
+
+    dholdout = listing_matrix(booster, preprocessor, pd.concat(holdout_batches, ignore_index=True))
+    dnew = listing_matrix(booster, preprocessor, new_listings)
+    limit = state['holdout_rmse'] * args.drift_threshold
+
+    new_rmse = rmse(booster, dnew)
+    if new_rmse > limit:
+        print(f'RMSE on {dnew.num_row()} newly sold listings is {new_rmse:.8f} (limit {limit:.8f}); retraining from scratch')
+        full_retrain(args, suburb_df, school_df, state, preprocessor)
+        print(f'Done in {time.time() - start_time:.2f} seconds.')
+        return
+
+    # Continue boosting from the current model on the newly sold listings only
+    objective = make_objective(state)
+    if objective is not None:
+        dnew.set_weight(objective.sample_weights(dnew.get_label()))
+    topped_up = xgb.train(
+        params={**state['params'], 'nthread': args.threads},
+        dtrain=dnew,
+        num_boost_round=args.rounds,
+        evals=[(dholdout, 'holdout')],
+        callbacks=[xgb.callback.EarlyStopping(rounds=EARLY_STOPPING_ROUNDS, save_best=True)],
+        verbose_eval=False,
+        xgb_model=booster
+    )
+
+    holdout_rmse = rmse(topped_up, dholdout)
+    if holdout_rmse > limit:
+        print(f'Holdout RMSE after the top-up is {holdout_rmse:.8f} (limit {limit:.8f}); retraining from scratch')
+        full_retrain(args, suburb_df, school_df, state, preprocessor)
+        print(f'Done in {time.time() - start_time:.2f} seconds.')
+        return
+
+    topped_up.save_model(args.model)
+    state['trained_listings'] += [int(listing_id) for listing_id in new_listings['reiwa_listing_id']]
+    state['topups'].append({
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'listings': dnew.num_row(),
+        'rounds': topped_up.num_boosted_rounds() - booster.num_boosted_rounds(),
+        'new_rmse': new_rmse,
+        'holdout_rmse': holdout_rmse,
+    })
+    write_state(args.state, state)
+    print(f'Topped up with {dnew.num_row()} newly sold listings: {state["topups"][-1]["rounds"]} rounds added, '
+          f'holdout RMSE {holdout_rmse:.8f}. Done in {time.time() - start_time:.2f} seconds.')
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,466 @@
+import argparse
+import hashlib
+import json
+import os
+import re
 import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+import columnar
+import warehouse
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(ROOT_DIR, '.pipeline_state.json')
+LOG_DIR = os.path.join(ROOT_DIR, 'pipeline_logs')
+REPORT_DIR = os.path.join(ROOT_DIR, 'run_reports')
+
+# Stage outputs that --columnar also writes as <name>.columns/
+COLUMNAR_OUTPUTS = [
+    'abs/census_data_processed.json', 'wapol/crime_data_processed.json', 'mesh/aus_mesh_blocks_processed.geojson',
+    'osm/osm_nodes_processed.geojson', 'reiwa/reiwa_listings.jsonl', 'suburb_data.json', 'property_data.json',
+    'school_data.json'
+]
+
+# Runs a stage script under tracemalloc and dumps a snapshot when it finishes
+TRACEMALLOC_BOOTSTRAP = """
+import runpy, sys, tracemalloc
+snapshot_path, script = sys.argv[1], sys.argv[2]
+sys.argv = [script]
+tracemalloc.start(25)
+try:
+    runpy.run_path(script, run_name='__main__')
+finally:
+    tracemalloc.take_snapshot().dump(snapshot_path)
+"""
+
+
+class Stage:
+    """
+    A pipeline step: a script run from its own directory, the files it reads and writes
+    (relative to the repository root) and any extra modules its code depends on.
+    """
+
+    def __init__(self, name, script, inputs=(), outputs=(), sources=()):
+        self.name = name
+        self.script = script
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.sources = [script] + list(sources)
+
+    @property
+    def cwd(self):
+        return os.path.join(ROOT_DIR, os.path.dirname(self.script))
+
+
+STAGES = [
+    Stage('abs', 'abs/get_census_data.py',
+          outputs=['abs/census_data_processed.json'],
+          sources=['telemetry.py', 'columnar.py', 'warehouse.py']),
+    Stage('mesh', 'mesh/get_mesh_block_data.py',
+          inputs=['mesh/mesh_block_census.csv', 'mesh/shapefile_data/MB_2021_AUST_GDA2020.shp',
+                  'mesh/shapefile_data/MB_2021_AUST_GDA2020.dbf', 'mesh/shapefile_data/MB_2021_AUST_GDA2020.shx'],
+          outputs=['mesh/aus_mesh_blocks_processed.geojson'],
+          sources=['columnar.py', 'warehouse.py']),
+    Stage('osm', 'osm/get_osm_data.py',
+          inputs=['osm/qgis_coast.geojson'],
+          outputs=['osm/osm_nodes_processed.geojson', 'osm/osm_coast_processed.geojson'],
+          sources=['columnar.py', 'warehouse.py']),
+    Stage('reiwa_housing', 'reiwa/get_housing_data.py',
+          inputs=['abs/census_data_processed.json'],
+          outputs=['reiwa/reiwa_housing_data.json'],
+          sources=['telemetry.py']),
+    Stage('reiwa_listings', 'reiwa/get_property_data.py',
+          outputs=['reiwa/reiwa_listings.jsonl'],
+          sources=['reiwa/listing_store.py', 'reiwa/reiwa_client.py', 'telemetry.py', 'columnar.py', 'warehouse.py']),
+    Stage('scsa', 'scsa/get_school_atar_data.py',
+          outputs=['scsa/processed_student_achievement_data.json']),
+    Stage('wapol_fetch', 'wapol/get_crime_data.py',
+          outputs=['wapol/crime_data.json'],
+          sources=['telemetry.py']),
+    Stage('wapol_process', 'wapol/process_crime_data.py',
+          inputs=['wapol/crime_data.json'],
+          outputs=['wapol/crime_data_processed.json'],
+          sources=['columnar.py', 'warehouse.py']),
+    Stage('suburbs', 'build_suburb_data.py',
+          inputs=['wapol/crime_data_processed.json', 'abs/census_data_processed.json', 'reiwa/reiwa_housing_data.json'],
+          outputs=['suburb_data.json'],
+          sources=['columnar.py', 'warehouse.py']),
+    Stage('properties', 'build_property_data.py',
+          inputs=['reiwa/reiwa_listings.jsonl', 'mesh/aus_mesh_blocks_processed.geojson', 'osm/osm_nodes_processed.geojson',
+                  'osm/osm_coast_processed.geojson', 'scsa/processed_student_achievement_data.json'],
+          outputs=['property_data.json', 'school_data.json'],
+          sources=['columnar.py', 'warehouse.py']),
+]
+
+
+def stage_dependencies(stages):
+    """Map each stage to the stages producing its inputs"""
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    return {stage.name: {producers[path] for path in stage.inputs if path in producers} for stage in stages}
+
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, 'r') as file:
+            return json.load(file)
+    return {'stages': {}, 'files': {}}
+
+
+def save_state(state):
+    with open(STATE_FILE, 'w') as file:
+        json.dump(state, file, indent=2)
+
+
+def file_digest(path, file_cache):
+    """Content hash of a file, reusing the cached digest while its size and mtime are unchanged"""
+    full_path = os.path.join(ROOT_DIR, path)
+    if not os.path.exists(full_path):
+        return None
+
+    stat = os.stat(full_path)
+    cached = file_cache.get(path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['digest']
+
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    file_cache[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest.hexdigest()}
+    return digest.hexdigest()
+
+
+def stage_hash(stage, file_cache):
+    """Combined hash of a stage's code and inputs"""
+    digest = hashlib.sha256()
+    for path in sorted(stage.sources) + sorted(stage.inputs):
+        digest.update(f'{path}:{file_digest(path, file_cache)}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def is_up_to_date(stage, current_hash, state):
+    outputs_exist = all(os.path.exists(os.path.join(ROOT_DIR, path)) for path in stage.outputs)
+    return outputs_exist and state['stages'].get(stage.name) == current_hash
+
+
+# Only number characters until the end of the buffer
+NUMBER_TAIL = re.compile(r'[0-9eE+\-.]*\Z')
+
+
+class JsonEntries:
+    """
+    Reads a JSON document from a file one value at a time, so the entries of a large array or
+    object can be counted while holding only one entry in memory
+    """
+
+    def __init__(self, file, chunk_size=1 << 20):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+
+    def fill(self):
+        """Drop the consumed text and read more, at least doubling what is buffered; False at the end of the file"""
+        chunk = self.file.read(max(self.chunk_size, len(self.buffer) - self.position))
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return bool(chunk)
+
+    def peek(self):
+        """Next non-whitespace character, or '' at the end of the file"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ''
+
+    def take(self, expected):
+        character = self.peek()
+        if not character or character not in expected:
+            raise ValueError(f'expected one of {expected!r}, found {character!r}')
+        self.position += 1
+        return character
+
+    def value(self):
+        """Decode the next value, reading more of the file while it is cut off at the end of the buffer"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # A number cut off at the end of the buffer decodes as a shorter number
+            if NUMBER_TAIL.match(self.buffer, end) and self.fill():
+                continue
+            self.position = end
+            return value
+
+    def count(self):
+        """Number of entries in the array or object that starts here"""
+        closing = ']' if self.take('[{') == '[' else '}'
+        if self.peek() == closing:
+            self.position += 1
+            return 0
+        entries = 0
+        while True:
+            if closing == '}':
+                self.value()
+                self.take(':')
+            self.value()
+            entries += 1
+            if self.take(',' + closing) == closing:
+                return entries
+
+
+def count_json_rows(full_path):
+    """Records in a JSON array, keys in a JSON object, or features in a GeoJSON FeatureCollection"""
+    with open(full_path, 'r', encoding='utf-8') as file:
+        entries = JsonEntries(file)
+        if entries.peek() != '{':
+            return entries.count()
+
+        entries.take('{')
+        keys = 0
+        features = None
+        while entries.peek() != '}':
+            key = entries.value()
+            entries.take(':')
+            if key == 'features' and entries.peek() == '[':
+                features = entries.count()
+            else:
+                entries.value()
+            keys += 1
+            if entries.take(',}') == '}':
+                break
+        return keys if features is None else features
+
+
+# Row counts by (path, size, mtime), so an output counted after its stage is not reread as the next stage's input
+row_counts = {}
+
+
+def artifact_stats(path):
+    """Byte size and row count of a pipeline file (lines for CSV/JSONL, records for JSON), counted without loading it"""
+    full_path = os.path.join(ROOT_DIR, path)
+    if not os.path.exists(full_path):
+        return {'path': path, 'bytes': None, 'rows': None}
+
+    stat = os.stat(full_path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in row_counts:
+        rows = None
+        try:
+            if path.endswith(('.jsonl', '.csv')):
+                with open(full_path, 'rb') as file:
+                    rows = sum(1 for line in file if line.strip())
+                if path.endswith('.csv'):
+                    rows -= 1  # Header
+            elif path.endswith(('.json', '.geojson')):
+                rows = count_json_rows(full_path)
+        except (ValueError, UnicodeDecodeError):
+            rows = None
+        row_counts[key] = rows
+
+    return {'path': path, 'bytes': stat.st_size, 'rows': row_counts[key]}
+
+
+def stage_command(stage, profile_path=None, profile_mode=None):
+    script = os.path.basename(stage.script)
+    if profile_mode == 'cprofile':
+        return [sys.executable, '-m', 'cProfile', '-o', profile_path, script]
+    if profile_mode == 'tracemalloc':
+        return [sys.executable, '-c', TRACEMALLOC_BOOTSTRAP, profile_path, script]
+    return [sys.executable, script]
+
+
+def wait_for_process(process):
+    """
+    Wait for a stage process and return its exit code, CPU time and peak RSS. Uses wait4 where
+    available; otherwise samples the process with psutil (if installed) while it runs.
+    """
+    if hasattr(os, 'wait4'):
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+        peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+        return process.returncode, usage.ru_utime, usage.ru_stime, peak_rss
+
+    if psutil is None:
+        return process.wait(), None, None, None
+
+    monitor = psutil.Process(process.pid)
+    cpu_user = cpu_system = peak_rss = 0
+    while process.poll() is None:
+        try:
+            memory = monitor.memory_info()
+            peak_rss = max(peak_rss, getattr(memory, 'peak_wset', memory.rss))
+            cpu_times = monitor.cpu_times()
+            cpu_user, cpu_system = cpu_times.user, cpu_times.system
+        except psutil.Error:
+            break
+        time.sleep(0.5)
+    return process.wait(), cpu_user, cpu_system, peak_rss
+
+
+def run_stage(stage, profile_path=None, profile_mode=None):
+    """Run a stage's script from its own directory, logging its output, and return its metrics"""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    inputs = [artifact_stats(path) for path in stage.inputs]
+
+    start_time = time.perf_counter()
+    with open(os.path.join(LOG_DIR, f'{stage.name}.log'), 'w') as log_file:
+        process = subprocess.Popen(stage_command(stage, profile_path, profile_mode), cwd=stage.cwd,
+                                   stdout=log_file, stderr=subprocess.STDOUT)
+        returncode, cpu_user, cpu_system, peak_rss = wait_for_process(process)
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        'returncode': returncode,
+        'wall_seconds': round(wall_time, 3),
+        'cpu_user_seconds': cpu_user,
+        'cpu_system_seconds': cpu_system,
+        'peak_rss_bytes': peak_rss,
+        'inputs': inputs,
+        'outputs': [artifact_stats(path) for path in stage.outputs],
+        'profile': profile_path
+    }
+
+
+def run_pipeline(stages, max_workers, forced, profiles=None, run_id=None):
+    """
+    Run stages concurrently as soon as the stages they depend on have finished. Stages whose
+    code and input hashes match the last successful run are skipped, and a failed stage stops
+    everything downstream of it. Returns each stage's status and the metrics of stages that ran.
+    """
+    dependencies = stage_dependencies(stages)
+    stages_by_name = {stage.name: stage for stage in stages}
+    profiles = profiles or {}
+    state = load_state()
+    status = {}
+    metrics = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(status) < len(stages):
+            for stage in stages:
+                if stage.name in status or stage.name in running.values():
+                    continue
+
+                dependency_status = [status.get(name) for name in dependencies[stage.name]]
+                if any(result in ('failed', 'blocked') for result in dependency_status):
+                    status[stage.name] = 'blocked'
+                    print(f'Blocked {stage.name}: an upstream stage failed')
+                    continue
+                if not all(result in ('succeeded', 'skipped') for result in dependency_status):
+                    continue
+
+                current_hash = stage_hash(stage, state['files'])
+                if stage.name not in forced and is_up_to_date(stage, current_hash, state):
+                    status[stage.name] = 'skipped'
+                    print(f'Skipped {stage.name}: up to date')
+                    continue
+
+                profile_mode = profiles.get(stage.name)
+                profile_path = None
+                if profile_mode:
+                    os.makedirs(REPORT_DIR, exist_ok=True)
+                    extension = 'prof' if profile_mode == 'cprofile' else 'tracemalloc'
+                    profile_path = os.path.join(REPORT_DIR, f'{run_id}_{stage.name}.{extension}')
+
+                print(f'Running {stage.name} ({stage.script})')
+                running[executor.submit(run_stage, stage, profile_path, profile_mode)] = stage.name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = stages_by_name[name]
+                metrics[name] = future.result()
+                returncode = metrics[name]['returncode']
+                if returncode == 0:
+                    status[name] = 'succeeded'
+                    # Hash the inputs as they were consumed, so an upstream rerun marks this stage stale
+                    state['stages'][name] = stage_hash(stage, state['files'])
+                    save_state(state)
+                    print(f'Successfully ran {stage.script} in {metrics[name]["wall_seconds"]:.1f}s')
+                else:
+                    status[name] = 'failed'
+                    print(f'Error running {stage.script}: exit code {returncode}, see {os.path.join(LOG_DIR, name + ".log")}')
+
+    return status, metrics
+
+
+def write_run_report(run_id, stages, status, metrics, wall_time):
+    """Write a JSON report of every stage's status, timings, memory and artifact sizes"""
+    report = {
+        'run_id': run_id,
+        'wall_seconds': round(wall_time, 3),
+        'stages': [{'name': stage.name, 'script': stage.script, 'status': status[stage.name], **metrics.get(stage.name, {})}
+                   for stage in stages]
+    }
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    report_path = os.path.join(REPORT_DIR, f'run_{run_id}.json')
+    with open(report_path, 'w') as file:
+        json.dump(report, file, indent=2)
+    return report_path
 
-def run_script(script_path):
-    try:
-        subprocess.run(['python', script_path], check=True)
-        print(f'Successfully ran {script_path}')
-    except subprocess.CalledProcessError as e:
-        print(f'Error running {script_path}: {e}')
 
 def main():
-    scripts = [
-        'abs/get_census_data.py',
-        'mesh/get_mesh_block_data.py',
-        'osm/get_osm_data.py',
-        'reiwa/get_housing_data.py',
-        'reiwa/get_property_data.py',
-        'scsa/get_school_atar_data.py',
-        'wapol/get_crime_data.py',
-        'wapol/process_crime_data.py',
-        'build_suburb_data.py',
-        'build_property_data.py'
-    ]
-
-    for script in scripts:
-        run_script(script)
+    parser = argparse.ArgumentParser(description='Run the data pipeline, skipping stages that are up to date.')
+    parser.add_argument('-j', '--jobs', type=int, default=4, help='maximum number of stages to run at once')
+    parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', help='rerun these stages even if up to date')
+    parser.add_argument('--force-all', action='store_true', help='rerun every stage')
+    parser.add_argument('--profile', nargs='+', default=[], metavar='STAGE', help='capture a cProfile of these stages')
+    parser.add_argument('--tracemalloc', nargs='+', default=[], metavar='STAGE', help='capture a tracemalloc snapshot of these stages')
+    parser.add_argument('--warehouse', action='store_true', help='also load each stage output into the SQLite warehouse (warehouse.db)')
+    parser.add_argument('--columnar', action='store_true', help='also write each stage output in the columnar format (<output>.columns/)')
+    args = parser.parse_args()
+
+    stage_names = [stage.name for stage in STAGES]
+    unknown = set(args.force + args.profile + args.tracemalloc) - set(stage_names)
+    if unknown:
+        parser.error(f'unknown stages: {", ".join(sorted(unknown))} (choose from {", ".join(stage_names)})')
+
+    profiles = {name: 'cprofile' for name in args.profile}
+    profiles.update({name: 'tracemalloc' for name in args.tracemalloc})
+
+    # Profiled stages always run, otherwise there would be nothing to capture
+    forced = set(stage_names) if args.force_all else set(args.force) | set(profiles)
+
+    # Stages fill the warehouse and write columnar outputs as they run, so missing ones need their stage to run once
+    if args.warehouse:
+        os.environ[warehouse.WAREHOUSE_ENV] = '1'
+        if not os.path.exists(warehouse.warehouse_path()):
+            forced = set(stage_names)
+    if args.columnar:
+        os.environ[columnar.COLUMNAR_ENV] = '1'
+        forced |= {stage.name for stage in STAGES for output in stage.outputs
+                   if output in COLUMNAR_OUTPUTS and not os.path.exists(os.path.join(ROOT_DIR, columnar.columns_path(output)))}
+
+    run_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    start_time = time.perf_counter()
+    status, metrics = run_pipeline(STAGES, args.jobs, forced, profiles, run_id)
+    report_path = write_run_report(run_id, STAGES, status, metrics, time.perf_counter() - start_time)
+
+    print('\n' + '\n'.join(f'{name}: {status[name]}' for name in stage_names))
+    print(f'Run report saved to {report_path}')
+    if any(result in ('failed', 'blocked') for result in status.values()):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
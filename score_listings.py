@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from preprocessing import Preprocessor, suburb_frame, school_frame, merge_reference_data, prepare_listings
+
+BATCH_SIZE = 50000
+
+
+def read_listings(path):
+    """Yield enriched listings from a JSON list (property_data.json) or newline-delimited JSON file"""
+    with open(path, 'r') as file:
+        if path.endswith('.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(file)
+
+
+def batches(listings, batch_size):
+    batch = []
+    for listing in listings:
+        batch.append(listing)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_model(model_path, preprocessing_path, threads):
+    booster = xgb.Booster()
+    booster.load_model(model_path)
+    booster.set_param({'nthread': threads})
+    preprocessor = Preprocessor.load(preprocessing_path)
+    if booster.feature_names and booster.feature_names != preprocessor.feature_columns:
+        raise ValueError(f"{preprocessing_path} does not match the features of {model_path}; retrain to save them together")
+    return booster, preprocessor
+
+
+def score_batch(booster, preprocessor, batch, suburb_df, school_df):
+    """Predicted sale prices for a batch of enriched listings, prepared as the training listings were"""
+    df = merge_reference_data(prepare_listings(pd.DataFrame(batch)), suburb_df, school_df)
+    features = preprocessor.transform(df)
+    return preprocessor.inverse_target(booster.inplace_predict(features))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score enriched listings with the trained model, without retraining.')
+    parser.add_argument('--listings', default='property_data.json', help='enriched listings to score (JSON list or .jsonl)')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--schools', default='school_data.json')
+    parser.add_argument('--model', default='xgb_model.json')
+    parser.add_argument('--preprocessing', default='preprocessing.json', help='fitted preprocessing saved with the model')
+    parser.add_argument('--output', default='property_data_unsold_predictions.json')
+    parser.add_argument('--all', action='store_true', help='score sold listings too (by default only unsold listings are scored)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--threads', type=int, default=os.cpu_count(), help='XGBoost prediction threads')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    booster, preprocessor = load_model(args.model, args.preprocessing, args.threads)
+
+    with open(args.suburbs, 'r') as file:
+        suburb_df = suburb_frame(json.load(file)).fillna(0)
+    with open(args.schools, 'r') as file:
+        school_df = school_frame(json.load(file))
+
+    listings = read_listings(args.listings)
+    if not args.all:
+        listings = (listing for listing in listings if not listing['reiwa_is_sold'])
+
+    scored = []
+    for batch in batches(listings, args.batch_size):
+        predictions = score_batch(booster, preprocessor, batch, suburb_df, school_df)
+        for listing, prediction in zip(batch, predictions):
+            listing['model_prediction'] = None if np.isnan(prediction) else float(prediction)
+            scored.append(listing)
+
+    with open(args.output, 'w') as file:
+        json.dump(scored, file, indent=4)
+
+    print(f"Scored {len(scored)} listings in {time.time() - start_time:.2f} seconds, saved to '{args.output}'.")
+
+if __name__ == '__main__':
+    main()
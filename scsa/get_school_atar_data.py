@@ -1,6 +1,12 @@
-from selenium import webdriver
 import json
-import time
+import re
+import requests
+
+PAGE_URL = 'https://senior-secondary.scsa.wa.edu.au/certification/student-achievement-data-by-school'
+REQUEST_TIMEOUT = 30
+
+# Matches the assignment of the dataset in the page's inline script, e.g. "window.studentDataList = [...]"
+DATASET_PATTERN = re.compile(r'studentDataList\s*=\s*')
 
 def convert_value(value):
     """Convert value to int or float, or return 0 if empty"""
@@ -23,29 +29,61 @@ def process_record(record):
         processed_record[new_key] = convert_value(value)
     return processed_record
 
-# Initialize the WebDriver (replace 'chromedriver' with the path to your WebDriver if necessary)
-driver = webdriver.Chrome()  # For Firefox, use webdriver.Firefox()
+def extract_student_data(html):
+    """Pull the embedded studentDataList array out of the page HTML, or return None if it isn't there"""
+    decoder = json.JSONDecoder()
+    for match in DATASET_PATTERN.finditer(html):
+        try:
+            data, _ = decoder.raw_decode(html, match.end())
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, list):
+            return data
+    return None
+
+def fetch_student_data():
+    """Fetch the page over plain HTTP and extract the dataset from its script payload"""
+    response = requests.get(PAGE_URL, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return extract_student_data(response.text)
 
-# Navigate to the webpage
-driver.get('https://senior-secondary.scsa.wa.edu.au/certification/student-achievement-data-by-school')
+def fetch_student_data_with_browser():
+    """Fallback: render the page in Chrome and read window.studentDataList once it is defined"""
+    from selenium import webdriver
+    from selenium.webdriver.support.ui import WebDriverWait
 
-# Allow the page to load completely
-time.sleep(5)
+    # Initialize the WebDriver (replace 'chromedriver' with the path to your WebDriver if necessary)
+    driver = webdriver.Chrome()  # For Firefox, use webdriver.Firefox()
+    try:
+        driver.get(PAGE_URL)
+        WebDriverWait(driver, 30).until(lambda d: d.execute_script('return window.studentDataList !== undefined;'))
+        json_data = driver.execute_script('return JSON.stringify(window.studentDataList);')
+    finally:
+        driver.quit()
+
+    return json.loads(json_data)
 
-# Execute JavaScript to retrieve the data
-json_data = driver.execute_script('return JSON.stringify(window.studentDataList);')
+def load_student_data():
+    """The dataset from the plain HTTP page, falling back to the browser if the request fails or it isn't embedded"""
+    try:
+        data = fetch_student_data()
+    except requests.exceptions.RequestException as e:
+        print("Error occurred while fetching the achievement data page:", e)
+        data = None
 
-# Close the browser
-driver.quit()
+    if data is None:
+        print("Embedded dataset not found in page, falling back to the browser.")
+        data = fetch_student_data_with_browser()
+    return data
 
-# Parse the JSON data
-data = json.loads(json_data)
+if __name__ == '__main__':
+    data = load_student_data()
 
-# Process the data
-processed_data = [process_record(record) for record in data]
+    # Process the data
+    processed_data = [process_record(record) for record in data]
 
-# Save the processed data to a JSON file
-with open('processed_student_achievement_data.json', 'w') as json_file:
-    json.dump(processed_data, json_file, indent=4)
+    # Save the processed data to a JSON file
+    with open('processed_student_achievement_data.json', 'w') as json_file:
+        json.dump(processed_data, json_file, indent=4)
 
-print("Processed data has been saved to 'processed_student_achievement_data.json'")
+    print("Processed data has been saved to 'processed_student_achievement_data.json'")
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+TELEMETRY_DIR = os.path.join(ROOT_DIR, 'telemetry')
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+def outcome_label(status=None, error=None):
+    """Classify a request as its status class ('2xx', '5xx', ...) or the exception type it raised"""
+    if error is not None:
+        return type(error).__name__
+    return f'{status // 100}xx'
+
+
+class EndpointStats:
+    def __init__(self):
+        self.outcomes = {}
+        self.retries = 0
+        self.bytes = 0
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds, outcome, nbytes):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        self.bytes += nbytes
+        self.latency_sum += seconds
+        self.count += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+                break
+        else:
+            self.bucket_counts[-1] += 1
+
+    def latency_quantile(self, quantile):
+        """Approximate a latency quantile from the histogram (upper bound of the bucket it falls in)"""
+        target = quantile * self.count
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + [float('inf')], self.bucket_counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+
+class Telemetry:
+    """
+    Request counters and latency histograms per endpoint for a scraper. While running, the
+    metrics are rewritten every `interval` seconds to telemetry/<scraper>.prom in the Prometheus
+    text format; a summary is printed when the scraper finishes.
+    """
+
+    def __init__(self, scraper, interval=15):
+        self.scraper = scraper
+        self.interval = interval
+        self.path = os.path.join(TELEMETRY_DIR, f'{scraper}.prom')
+        self.endpoints = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stop_event = threading.Event()
+        self.writer = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self.started = time.time()
+        self.writer = threading.Thread(target=self._write_periodically, daemon=True)
+        self.writer.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.writer is not None:
+            self.writer.join()
+        self.write_textfile()
+        self.print_summary()
+
+    def _endpoint(self, endpoint):
+        if endpoint not in self.endpoints:
+            self.endpoints[endpoint] = EndpointStats()
+        return self.endpoints[endpoint]
+
+    def record(self, endpoint, seconds, outcome, nbytes=0):
+        with self.lock:
+            self._endpoint(endpoint).observe(seconds, outcome, nbytes)
+
+    def record_result(self, endpoint, seconds, status=None, error=None, nbytes=0):
+        """Record a request by its HTTP status, or by the exception it raised"""
+        self.record(endpoint, seconds, outcome_label(status, error), nbytes)
+
+    def record_retry(self, endpoint):
+        with self.lock:
+            self._endpoint(endpoint).retries += 1
+
+    def request(self, send, endpoint, *args, **kwargs):
+        """Call `send` (e.g. requests.get or session.post) and record its latency, outcome and size"""
+        start = time.perf_counter()
+        try:
+            response = send(*args, **kwargs)
+        except Exception as e:
+            self.record_result(endpoint, time.perf_counter() - start, error=e)
+            raise
+        self.record_result(endpoint, time.perf_counter() - start, response.status_code, nbytes=len(response.content))
+        return response
+
+    def _write_periodically(self):
+        while not self.stop_event.wait(self.interval):
+            self.write_textfile()
+
+    def render(self):
+        labels = f'scraper="{self.scraper}"'
+        lines = [
+            '# HELP scraper_requests_total HTTP requests made, by outcome (status class or error type).',
+            '# TYPE scraper_requests_total counter',
+        ]
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            for endpoint, stats in endpoints:
+                for outcome, count in sorted(stats.outcomes.items()):
+                    lines.append(f'scraper_requests_total{{{labels},endpoint="{endpoint}",outcome="{outcome}"}} {count}')
+
+            lines += ['# HELP scraper_retries_total Requests retried after a failure.', '# TYPE scraper_retries_total counter']
+            for endpoint, stats in endpoints:
+                lines.append(f'scraper_retries_total{{{labels},endpoint="{endpoint}"}} {stats.retries}')
+
+            lines += ['# HELP scraper_response_bytes_total Response body bytes received.', '# TYPE scraper_response_bytes_total counter']
+            for endpoint, stats in endpoints:
+                lines.append(f'scraper_response_bytes_total{{{labels},endpoint="{endpoint}"}} {stats.bytes}')
+
+            lines += ['# HELP scraper_request_duration_seconds Request latency.', '# TYPE scraper_request_duration_seconds histogram']
+            for endpoint, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ['+Inf'], stats.bucket_counts):
+                    cumulative += count
+                    lines.append(f'scraper_request_duration_seconds_bucket{{{labels},endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'scraper_request_duration_seconds_sum{{{labels},endpoint="{endpoint}"}} {stats.latency_sum:.6f}')
+                lines.append(f'scraper_request_duration_seconds_count{{{labels},endpoint="{endpoint}"}} {stats.count}')
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self):
+        """Write the metrics atomically so a collector never reads a partial file"""
+        os.makedirs(TELEMETRY_DIR, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(temp_path, self.path)
+
+    def print_summary(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        print(f'\nRequest telemetry for {self.scraper} ({elapsed:.1f}s):')
+        with self.lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                outcomes = ', '.join(f'{count} {outcome}' for outcome, count in sorted(stats.outcomes.items()))
+                mean = stats.latency_sum / stats.count if stats.count else 0
+                print(f'  {endpoint}: {stats.count} requests ({stats.count / elapsed:.1f}/s; {outcomes}), '
+                      f'{stats.retries} retries, {stats.bytes / 1e6:.1f} MB, '
+                      f'latency mean {mean:.2f}s p50 <= {stats.latency_quantile(0.5)}s p95 <= {stats.latency_quantile(0.95)}s')
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The scraper scripts run from their own directories and import their neighbours directly
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in (REPO_ROOT, os.path.join(REPO_ROOT, 'reiwa'), os.path.join(REPO_ROOT, 'scsa')):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
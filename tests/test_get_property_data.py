@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import get_property_data
+from listing_store import ListingStore, STATUS_FOR_SALE
+from reiwa_client import ReiwaClient
+
+
+def fake_result(listing_id, price):
+    return {
+        "ListingId": listing_id,
+        "Price": price,
+        "Address": f"{listing_id} Test Street",
+        "Latitude": -31.95,
+        "Longitude": 115.86,
+        "PropertyType": "House",
+        "ListingImageUrls": [],
+        "PropertyDetailsURL": f"/property/{listing_id}",
+        "DisplayPrice": str(price),
+        "Suburb": "Perth",
+    }
+
+
+class FakeSearchApi:
+    """
+    Local stand-in for the REIWA search API, paginating listings filtered by price and sold status.
+    `fail` is called with each request's criteria and page and returns a status to fail it with.
+    """
+
+    def __init__(self, sold, for_sale, fail=None):
+        self.listings = {True: sold, False: for_sale}
+        self.fail = fail or (lambda criteria, page: None)
+        self.requests = []
+
+    async def search(self, request):
+        params = await request.json()
+        criteria, paging = params["SearchCriteria"], params["PaginatedRequest"]
+        page, page_size = paging["CurrentPage"], paging["PageSize"]
+        self.requests.append((criteria["MinPrice"], criteria["MaxPrice"], page, page_size))
+
+        status = self.fail(criteria, page)
+        if status:
+            return web.Response(status=status)
+
+        matches = [result for result in self.listings[criteria["IsSold"]]
+                   if criteria["MinPrice"] <= result["Price"] <= criteria["MaxPrice"]]
+        results = matches[(page - 1) * page_size:page * page_size]
+        return web.json_response({"Success": True, "Result": {"PaginatedResponse": {"TotalResults": len(matches), "Results": results}}})
+
+
+def run_harvest(api, store, incremental=False, run_started="2024-06-01T00:00:00"):
+    async def harvest():
+        app = web.Application()
+        app.router.add_post("/api/search/listing", api.search)
+        async with TestServer(app) as server:
+            async with ReiwaClient(base_url=str(server.make_url("/api/search/listing")), rate=1000, burst=1000,
+                                   max_retries=3, backoff_base=0.001) as client:
+                return await get_property_data.harvest_listings(client, store, incremental, run_started)
+    return asyncio.run(harvest())
+
+
+def statuses(store):
+    return dict(store.connection.execute("SELECT listing_id, status FROM listings"))
+
+
+def test_full_harvest_reads_every_page(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_property_data, "PAGE_SIZE", 2)
+    sold = [fake_result(listing_id, 455_000) for listing_id in range(1, 6)]
+    for_sale = [fake_result(10, 1_234_000), fake_result(11, 9_995_000)]
+    api = FakeSearchApi(sold, for_sale)
+
+    with ListingStore(str(tmp_path / "listings.db")) as store:
+        _, failed_ranges = run_harvest(api, store)
+
+        assert failed_ranges == []
+        assert statuses(store) == {**{listing_id: "sold" for listing_id in range(1, 6)}, 10: STATUS_FOR_SALE, 11: STATUS_FOR_SALE}
+        assert store.price_bands(True) == [(450_000, 459_999)]
+        assert store.price_bands(False) == [(1_230_000, 1_239_999), (9_990_000, 9_999_999)]
+
+    # Five sold listings in one band at two per page
+    assert sorted(page for min_price, _, page, page_size in api.requests if min_price == 450_000 and page_size == 2) == [1, 2, 3]
+
+
+def test_transient_failures_are_retried(tmp_path):
+    attempts = {}
+
+    def fail_first_attempt(criteria, page):
+        key = (criteria["IsSold"], criteria["MinPrice"], criteria["MaxPrice"], page)
+        attempts[key] = attempts.get(key, 0) + 1
+        return 503 if attempts[key] == 1 else None
+
+    api = FakeSearchApi([fake_result(1, 455_000)], [fake_result(2, 1_234_000)], fail_first_attempt)
+    with ListingStore(str(tmp_path / "listings.db")) as store:
+        request_reports, failed_ranges = run_harvest(api, store)
+
+        assert failed_ranges == []
+        assert statuses(store) == {1: "sold", 2: STATUS_FOR_SALE}
+    assert all(request_counts["probe"] + request_counts["harvest"] > 0 for _, request_counts, _ in request_reports)
+
+
+def test_failed_range_keeps_listings_and_price_bands(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_property_data, "PAGE_SIZE", 2)
+    for_sale = [fake_result(listing_id, 1_234_000) for listing_id in range(1, 6)] + [fake_result(6, 2_345_000)]
+
+    with ListingStore(str(tmp_path / "listings.db")) as store:
+        run_harvest(FakeSearchApi([], for_sale), store, run_started="2024-05-01T00:00:00")
+        bands = store.price_bands(False)
+
+        # Page 3 of the 1.23m band never succeeds, so its last listing is not seen this run
+        api = FakeSearchApi([], for_sale, lambda criteria, page: 503 if criteria["MinPrice"] == 1_230_000 and page == 3 else None)
+        _, failed_ranges = run_harvest(api, store)
+
+        assert failed_ranges == [(1_230_000, 1_239_999)]
+        assert set(statuses(store).values()) == {STATUS_FOR_SALE}
+        assert store.price_bands(False) == bands
+
+
+def test_full_harvest_marks_unseen_listings_withdrawn(tmp_path):
+    with ListingStore(str(tmp_path / "listings.db")) as store:
+        run_harvest(FakeSearchApi([], [fake_result(1, 455_000), fake_result(2, 1_234_000)]), store, run_started="2024-05-01T00:00:00")
+        run_harvest(FakeSearchApi([], [fake_result(1, 455_000)]), store)
+
+        assert statuses(store) == {1: STATUS_FOR_SALE, 2: "withdrawn"}
+        assert store.price_bands(False) == [(450_000, 459_999)]
+
+
+def test_incremental_sync_pages_until_nothing_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(get_property_data, "INCREMENTAL_PAGE_SIZE", 2)
+    for_sale = [fake_result(listing_id, 455_000) for listing_id in range(1, 6)]
+
+    with ListingStore(str(tmp_path / "listings.db")) as store:
+        run_harvest(FakeSearchApi([], for_sale[2:]), store, run_started="2024-05-01T00:00:00")
+
+        # The two new listings fill the first page; the second page holds only listings already stored
+        api = FakeSearchApi([], for_sale)
+        _, failed_ranges = run_harvest(api, store, incremental=True)
+
+        assert failed_ranges == []
+        assert set(statuses(store)) == set(range(1, 6))
+        assert [page for _, _, page, _ in api.requests] == [1, 2]
+
+
+@pytest.mark.parametrize("status", [404, 503])
+def test_failed_requests_report_the_attempts_made(tmp_path, monkeypatch, status):
+    monkeypatch.setattr(get_property_data, "PAGE_SIZE", 2)
+    for_sale = [fake_result(listing_id, 1_234_000) for listing_id in range(1, 6)]
+
+    # 404 is not retried; 503 is retried up to the client's three attempts
+    api = FakeSearchApi([], for_sale, lambda criteria, page: status if page == 3 else None)
+    with ListingStore(str(tmp_path / "listings.db")) as store:
+        request_reports, failed_ranges = run_harvest(api, store)
+
+    assert failed_ranges == [(1_230_000, 1_239_999)]
+    assert sum(request_counts["probe"] + request_counts["harvest"] for _, request_counts, _ in request_reports) == len(api.requests)
+    assert sum(page == 3 for _, _, page, _ in api.requests) == (1 if status == 404 else 3)
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+import requests
+
+import get_school_atar_data
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'scsa_student_achievement.html')
+
+
+@pytest.fixture
+def page_html():
+    with open(FIXTURE, encoding='utf-8') as file:
+        return file.read()
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+def test_extract_student_data_reads_the_embedded_dataset(page_html):
+    data = get_school_atar_data.extract_student_data(page_html)
+
+    assert [record['school'] for record in data] == [
+        'Perth Modern School',
+        "St Mary's Anglican Girls' School; Karrinyup",
+        'Kalgoorlie-Boulder Community High School',
+    ]
+    assert data[0]['fouratarper'] == '97.2'
+
+
+def test_extract_student_data_processes_like_the_browser_dataset(page_html):
+    records = [get_school_atar_data.process_record(record) for record in get_school_atar_data.extract_student_data(page_html)]
+
+    assert records[1] == {
+        'scsa_school': "St Mary's Anglican Girls' School; Karrinyup", 'scsa_cert': 100, 'scsa_awnum': 0, 'scsa_awper': 0,
+        'scsa_ewnum': 4, 'scsa_fouratarper': 91.5, 'scsa_numendper': 99, 'scsa_readendper': 100, 'scsa_writeendpe': 99.5,
+    }
+    assert records[2]['scsa_fouratarper'] == 'n/a'
+
+
+@pytest.mark.parametrize('html', [
+    '<html><body><script>var rows = window.studentDataList || [];</script></body></html>',
+    '<html><body><script>window.studentDataList = {"school": "Perth Modern School"};</script></body></html>',
+    '<html><body><p>Scheduled maintenance</p></body></html>',
+])
+def test_extract_student_data_without_the_dataset(html):
+    assert get_school_atar_data.extract_student_data(html) is None
+
+
+def test_load_student_data_uses_the_page_without_a_browser(page_html, monkeypatch):
+    monkeypatch.setattr(get_school_atar_data.requests, 'get', lambda url, timeout: FakeResponse(page_html))
+    monkeypatch.setattr(get_school_atar_data, 'fetch_student_data_with_browser', lambda: pytest.fail('browser started'))
+
+    assert len(get_school_atar_data.load_student_data()) == 3
+
+
+def test_load_student_data_falls_back_to_the_browser_when_the_dataset_is_missing(monkeypatch):
+    browser_data = [{'school': 'Perth Modern School'}]
+    monkeypatch.setattr(get_school_atar_data.requests, 'get', lambda url, timeout: FakeResponse('<html><body></body></html>'))
+    monkeypatch.setattr(get_school_atar_data, 'fetch_student_data_with_browser', lambda: browser_data)
+
+    assert get_school_atar_data.load_student_data() is browser_data
+
+
+def test_load_student_data_falls_back_to_the_browser_when_the_request_fails(monkeypatch):
+    def unreachable(url, timeout):
+        raise requests.exceptions.ConnectionError('unreachable')
+
+    browser_data = [{'school': 'Perth Modern School'}]
+    monkeypatch.setattr(get_school_atar_data.requests, 'get', unreachable)
+    monkeypatch.setattr(get_school_atar_data, 'fetch_student_data_with_browser', lambda: browser_data)
+
+    assert get_school_atar_data.load_student_data() is browser_data
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+from preprocessing import Preprocessor
+
+
+def listings(rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'reiwa_price': rng.uniform(300_000, 2_000_000, rows),
+        'osm_distance_to_perth_cbd': rng.uniform(0.5, 60, rows),
+        'osm_nearest_train_station': rng.uniform(0.1, 15, rows),
+        'reiwa_bedrooms': rng.integers(1, 6, rows),
+    })
+
+
+def fitted_preprocessor(df):
+    preprocessor = Preprocessor()
+    fitted = preprocessor.fit_transform(df.copy())
+    preprocessor.feature_columns = [col for col in fitted.columns if col != 'reiwa_price']
+    return preprocessor, fitted
+
+
+def test_transform_all_float_columns():
+    df = listings()
+    preprocessor, fitted = fitted_preprocessor(df)
+
+    # As after feature selection keeps only the float distances
+    preprocessor.feature_columns = ['osm_distance_to_perth_cbd', 'osm_nearest_train_station']
+    frame = df[preprocessor.feature_columns].copy()
+    features = preprocessor.transform(frame)
+
+    np.testing.assert_allclose(features, fitted[preprocessor.feature_columns].to_numpy(), rtol=1e-5, atol=1e-5)
+    pd.testing.assert_frame_equal(frame, df[preprocessor.feature_columns])
+
+
+def test_transform_matches_fit_transform_and_transform_record():
+    df = listings()
+    preprocessor, fitted = fitted_preprocessor(df)
+    features = preprocessor.transform(df.drop(columns='reiwa_price'))
+
+    np.testing.assert_allclose(features, fitted[preprocessor.feature_columns].to_numpy(), rtol=1e-5, atol=1e-5)
+    record = df.drop(columns='reiwa_price').iloc[0].to_dict()
+    np.testing.assert_allclose(preprocessor.transform_record(record), features[:1], rtol=1e-5, atol=1e-5)
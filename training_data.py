@@ -0,0 +1,201 @@
+import os
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from scipy import special
+
+import columnar
+from preprocessing import TARGET, clean_listings, merge_reference_data, prepare_listings
+from score_listings import batches, read_listings
+
+BATCH_SIZE = 50000
+
+# Listings the streamed preprocessing is fitted on (medians, categories, transformations and scaler)
+FIT_SAMPLE_SIZE = 250000
+
+# Share of sold listings held out for evaluation when there is no fixed holdout
+TEST_SIZE = 0.06
+
+def count_listings(path):
+    if os.path.isdir(path):
+        return columnar.read_manifest(path)['rows']
+    return sum(1 for _ in read_listings(path))
+
+
+def read_batches(path, batch_size=BATCH_SIZE):
+    """
+    Yield stored listings as DataFrames of at most `batch_size` rows, from a columnar directory
+    (property_data.columns), a newline-delimited JSON file or a JSON list. Only a JSON list has
+    to be parsed whole; the other two are read a batch at a time.
+    """
+    if os.path.isdir(path):
+        rows = columnar.read_manifest(path)['rows']
+        for start in range(0, rows, batch_size):
+            yield pd.DataFrame(columnar.read_rows(path, start, min(start + batch_size, rows)))
+    else:
+        for batch in batches(read_listings(path), batch_size):
+            yield pd.DataFrame(batch)
+
+
+def hashed_fraction(listing_ids):
+    """A fixed pseudo-random number in [0, 1) per listing id, to sample and split without a shuffle"""
+    ids = np.asarray(listing_ids, dtype=np.int64).astype(np.uint64)
+    return (ids * np.uint64(2654435761) % np.uint64(2 ** 32)) / 2 ** 32
+
+
+def prepared_batches(path, suburb_df, school_df, batch_size=BATCH_SIZE):
+    """
+    Yield the stored listings in batches, prepared as the notebook prepares them: missing values
+    zeroed and land sizes fixed, duplicates (across batches too) and unrealistic listings dropped, and suburb and
+    school data joined
+    """
+    seen = np.empty(0, dtype=np.int64)
+    for batch in read_batches(path, batch_size):
+        batch = prepare_listings(batch)
+        batch = batch[~batch['reiwa_listing_id'].isin(seen)]
+        seen = np.union1d(seen, batch['reiwa_listing_id'].to_numpy(dtype=np.int64))
+        batch = clean_listings(batch)
+        if len(batch):
+            yield merge_reference_data(batch, suburb_df, school_df)
+
+
+def fit_preprocessor(path, suburb_df, school_df, preprocessor, sample_size=FIT_SAMPLE_SIZE, batch_size=BATCH_SIZE):
+    """
+    Fit the preprocessing on about `sample_size` listings, picked by listing id so the sample is
+    the same on every run. With fewer listings than that, it is fitted on all of them, exactly as
+    the notebook fits it.
+    """
+    fraction = min(1, sample_size / max(1, count_listings(path)))
+    sample = pd.concat([batch[hashed_fraction(batch['reiwa_listing_id']) < fraction]
+                        for batch in prepared_batches(path, suburb_df, school_df, batch_size)], ignore_index=True)
+
+    df = preprocessor.fill_missing(sample, fit=True)
+    df = df[df['reiwa_suburb_interest_level'].notnull()]
+    df = preprocessor.encode(df, fit=True)
+    df = preprocessor.add_features(df)
+    df = preprocessor.fit_transform(df)
+    preprocessor.feature_columns = [col for col in df.columns if col not in ('reiwa_price', 'reiwa_is_sold', 'identifier')]
+    return preprocessor
+
+
+def feature_types(preprocessor):
+    return ['c' if col in preprocessor.categories else 'float' for col in preprocessor.feature_columns]
+
+
+class ListingBatches(xgb.DataIter):
+    """
+    XGBoost data iterator over one subset of the stored listings ('train', 'test' or 'unsold').
+    Each batch is prepared, transformed with the fitted preprocessing and handed to XGBoost before
+    the next is read, so building a QuantileDMatrix or external memory DMatrix from it needs
+    memory for one batch rather than the whole history. Sold listings are split into train and
+    test by the fixed `holdout` listing ids, or by listing id hash when there is none.
+    """
+
+    def __init__(self, path, suburb_df, school_df, preprocessor, subset, holdout=None, batch_size=BATCH_SIZE,
+                 cache_prefix=None):
+        self.path = path
+        self.suburb_df = suburb_df
+        self.school_df = school_df
+        self.preprocessor = preprocessor
+        self.subset = subset
+        self.holdout = holdout
+        self.batch_size = batch_size
+        self.batches = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def in_subset(self, df):
+        sold = (df['reiwa_is_sold'] == True).to_numpy()
+        if self.subset == 'unsold':
+            return ~sold
+        if self.holdout is not None:
+            in_test = df['reiwa_listing_id'].isin(self.holdout).to_numpy()
+        else:
+            in_test = hashed_fraction(df['reiwa_listing_id']) < TEST_SIZE
+        return sold & (in_test if self.subset == 'test' else ~in_test)
+
+    def subset_batches(self):
+        for df in prepared_batches(self.path, self.suburb_df, self.school_df, self.batch_size):
+            df = df[self.in_subset(df)]
+            df = self.preprocessor.fill_missing(df)
+            df = df[df['reiwa_suburb_interest_level'].notnull()]
+            if len(df):
+                yield df
+
+    def transformed_batches(self):
+        for df in self.subset_batches():
+            labels = special.boxcox(df[TARGET].to_numpy(dtype=np.float64), self.preprocessor.target_lambda)
+            yield self.preprocessor.transform(df), labels
+
+    def listing_ids(self):
+        """Listing ids in this subset, in a separate pass that skips the transformation"""
+        return [int(listing_id) for df in self.subset_batches() for listing_id in df['reiwa_listing_id']]
+
+    def reset(self):
+        self.batches = None
+
+    def next(self, input_data):
+        if self.batches is None:
+            self.batches = self.transformed_batches()
+        batch = next(self.batches, None)
+        if batch is None:
+            return False
+        features, labels = batch
+        input_data(data=features, label=labels, feature_names=self.preprocessor.feature_columns,
+                   feature_types=feature_types(self.preprocessor))
+        return True
+
+
+class FrameBatches(xgb.DataIter):
+    """Data iterator over an in-memory feature frame in row batches, to build a QuantileDMatrix from it"""
+
+    def __init__(self, X, y, batch_size=BATCH_SIZE):
+        self.X = X
+        self.y = y
+        self.batch_size = batch_size
+        self.position = 0
+        super().__init__()
+
+    def reset(self):
+        self.position = 0
+
+    def next(self, input_data):
+        if self.position >= len(self.X):
+            return False
+        end = self.position + self.batch_size
+        input_data(data=self.X.iloc[self.position:end], label=self.y.iloc[self.position:end])
+        self.position = end
+        return True
+
+
+def build_dmatrix(data_iter, ref=None, enable_categorical=False):
+    """
+    QuantileDMatrix built batch by batch from `data_iter` or, when the iterator has a cache prefix,
+    an external memory matrix whose pages are written to disk there, for histories larger than RAM.
+    Eval sets should pass the training matrix as `ref` so they share its quantile cuts.
+    """
+    if data_iter.cache_prefix is None:
+        return xgb.QuantileDMatrix(data_iter, ref=ref, enable_categorical=enable_categorical)
+    if hasattr(xgb, 'ExtMemQuantileDMatrix'):
+        return xgb.ExtMemQuantileDMatrix(data_iter, ref=ref, enable_categorical=enable_categorical)
+    # XGBoost 2.0 builds external memory matrices from an iterator with a cache prefix
+    return xgb.DMatrix(data_iter, enable_categorical=enable_categorical)
+
+
+def listing_dmatrices(path, suburb_df, school_df, preprocessor, subsets=('train', 'test'), holdout=None,
+                      batch_size=BATCH_SIZE, cache_dir=None):
+    """
+    DMatrix objects streamed from the stored listings for each of `subsets`, the first being the
+    training set whose quantile cuts the others share. With `cache_dir` they are external memory
+    matrices cached there, otherwise QuantileDMatrix objects.
+    """
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    dmatrices = []
+    for subset in subsets:
+        cache_prefix = os.path.join(cache_dir, subset) if cache_dir is not None else None
+        data_iter = ListingBatches(path, suburb_df, school_df, preprocessor, subset, holdout, batch_size, cache_prefix)
+        ref = dmatrices[0] if dmatrices else None
+        dmatrices.append(build_dmatrix(data_iter, ref, preprocessor.native_categorical))
+    return dmatrices
@@ -0,0 +1,261 @@
+import argparse
+import json
+import math
+import os
+import socketserver
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import build_property_data as enrichment
+from preprocessing import prepare_listing, suburb_frame, school_frame
+from score_listings import load_model, score_batch
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+# OSM nodes fetched per nearest-neighbour query while walking out from a property (grown until the walk ends)
+OSM_NEIGHBOURS = 256
+
+
+def unit_vectors(lons, lats):
+    """
+    Points on the unit sphere. Straight-line distances between them order pairs of points exactly
+    as great circle distances do, so a KD-tree over them answers haversine nearest and radius queries.
+    """
+    lons, lats = np.radians(np.asarray(lons, dtype=float)), np.radians(np.asarray(lats, dtype=float))
+    return np.stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+def chord_length(distance):
+    """Straight-line distance on the unit sphere between points `distance` km apart on the ground"""
+    return 2 * math.sin(distance / (2 * enrichment.EARTH_RADIUS))
+
+
+class ReferenceIndex:
+    """
+    build_property_data's reference data with spatial indexes over it, built once: KD-trees over
+    the mesh blocks and OSM nodes and the coastline R-tree. enrich() adds the same osm_*,
+    coast and school fields to a listing as process_property and nearest_coast_distances, by
+    visiting only the nodes near it instead of measuring the distance to every one.
+    """
+
+    def __init__(self):
+        enrichment.load_reference_data()
+        self.coast_index = enrichment.build_coast_index()
+
+        schools = enrichment.scsa_school_data
+        self.school_lons = np.array([school['longitude'] for school in schools])
+        self.school_lats = np.array([school['latitude'] for school in schools])
+
+        mesh_blocks = enrichment.mesh_block_data['features']
+        mesh_coordinates = np.array([feature['geometry']['coordinates'][:2] for feature in mesh_blocks], dtype=float)
+        self.mesh_lons, self.mesh_lats = mesh_coordinates[:, 0], mesh_coordinates[:, 1]
+        self.mesh_population = [feature['properties']['Population'] for feature in mesh_blocks]
+        self.mesh_dwellings = [feature['properties']['Dwelling'] for feature in mesh_blocks]
+        self.mesh_tree = cKDTree(unit_vectors(self.mesh_lons, self.mesh_lats))
+
+        # Each node's feature types, in the order process_property checks them, with their output key
+        nodes = enrichment.osm_node_data['features']
+        osm_coordinates = np.array([feature['geometry']['coordinates'][:2] for feature in nodes], dtype=float)
+        self.osm_lons, self.osm_lats = osm_coordinates[:, 0], osm_coordinates[:, 1]
+        self.node_types = [
+            [(category, f'osm_{category}_{feature_type}') for feature_type, category in enrichment.feature_categories.items()
+             if feature_type in feature['properties']]
+            for feature in nodes
+        ]
+        self.osm_tree = cKDTree(unit_vectors(self.osm_lons, self.osm_lats))
+        self.nearest_keys = [key for key in enrichment.osm_feature_template if key.startswith('osm_nearest_')]
+
+    def walk_osm_nodes(self, indices, distances):
+        """
+        process_property's walk over OSM nodes in order of distance. Returns the features and
+        whether the walk ended before running out of nodes.
+        """
+        osm_features = enrichment.osm_feature_template.copy()
+        missing = set(self.nearest_keys)
+        for index, distance in zip(indices, distances):
+            for category, key in self.node_types[index]:
+                if category == 'nearest' and distance < osm_features[key]:
+                    osm_features[key] = distance
+                    missing.discard(key)
+                    break
+                elif category == 'local' and distance <= enrichment.LOCAL_COMMUNITY_RADIUS:
+                    osm_features[key] += 1
+            if not missing and distance > enrichment.LOCAL_COMMUNITY_RADIUS:
+                return osm_features, True
+        return osm_features, False
+
+    def osm_features(self, lon, lat, point):
+        neighbours = min(OSM_NEIGHBOURS, len(self.node_types))
+        while True:
+            _, indices = self.osm_tree.query(point, k=neighbours)
+            indices = np.atleast_1d(indices)
+            distances = enrichment.haversine_distance_array(lon, lat, self.osm_lons[indices], self.osm_lats[indices])
+
+            # Nodes at the same distance are visited in file order, as the stable sort in process_property does
+            order = np.lexsort((indices, distances))
+            osm_features, ended = self.walk_osm_nodes(indices[order].tolist(), distances[order].tolist())
+            if ended or neighbours == len(self.node_types):
+                return osm_features
+            neighbours = min(neighbours * 4, len(self.node_types))
+
+    def enrich(self, listing):
+        """Add the osm_*, coast and closest school fields to a listing (a dict with reiwa_longitude and reiwa_latitude)"""
+        lon, lat = float(listing['reiwa_longitude']), float(listing['reiwa_latitude'])
+        point = unit_vectors(lon, lat)
+
+        listing['osm_nearest_coast'] = float(enrichment.nearest_coast_distances([lon], [lat], self.coast_index)[0])
+
+        # Mesh blocks within the local community radius (the KD-tree radius is padded for rounding)
+        candidates = np.array(sorted(self.mesh_tree.query_ball_point(point, chord_length(enrichment.LOCAL_COMMUNITY_RADIUS) * (1 + 1e-9))), dtype=np.intp)
+        distances = enrichment.haversine_distance_array(lon, lat, self.mesh_lons[candidates], self.mesh_lats[candidates])
+        local_blocks = candidates[distances <= enrichment.LOCAL_COMMUNITY_RADIUS].tolist()
+        listing['osm_local_community_population'] = sum(self.mesh_population[index] for index in local_blocks)
+        listing['osm_local_community_dwellings'] = sum(self.mesh_dwellings[index] for index in local_blocks)
+
+        listing['osm_distance_to_perth_cbd'] = enrichment.haversine_distance(lon, lat, *enrichment.PERTH_CBD_COORDS)
+        listing['osm_distance_to_perth_airport'] = enrichment.haversine_distance(lon, lat, *enrichment.PERTH_AIRPORT_COORDS)
+        listing.update(self.osm_features(lon, lat, point))
+
+        school_distances = enrichment.haversine_distance_array(lon, lat, self.school_lons, self.school_lats)
+        closest = int(np.argmin(school_distances))
+        listing['scsa_school_id'] = enrichment.scsa_school_data[closest]['school_id']
+        listing['scsa_school_distance'] = float(school_distances[closest])
+        return listing
+
+
+class Valuer:
+    """The reference index, suburb and school tables and the trained model, loaded once to value listings"""
+
+    def __init__(self, model_path, preprocessing_path, suburbs_path, threads=1):
+        self.index = ReferenceIndex()
+        with open(suburbs_path, 'r') as file:
+            self.suburb_df = suburb_frame(json.load(file)).fillna(0)
+        self.school_df = school_frame(enrichment.scsa_school_data)
+
+        # Suburb and school fields by key, joined onto a listing as merge_reference_data joins them
+        self.suburb_rows = self.suburb_df.set_index('reiwa_suburb').to_dict('index')
+        self.school_rows = self.school_df.set_index('scsa_school_id').to_dict('index')
+
+        # Single listings are best predicted on the request's thread
+        self.booster, self.preprocessor = load_model(model_path, preprocessing_path, threads)
+
+    def value(self, listing):
+        """Enriched fields and predicted sale price of a listing"""
+        if listing.get('reiwa_suburb') not in self.suburb_rows:
+            raise ValueError(f"unknown reiwa_suburb {listing.get('reiwa_suburb')!r}")
+        enriched = self.index.enrich(dict(listing))
+        record = {**prepare_listing(enriched), **self.suburb_rows[listing['reiwa_suburb']], **self.school_rows.get(enriched['scsa_school_id'], {})}
+        features = self.preprocessor.transform_record(record)
+        prediction = self.preprocessor.inverse_target(self.booster.inplace_predict(features))[0]
+        fields = {key: enriched[key] for key in enriched if key not in listing}
+        return {'model_prediction': None if np.isnan(prediction) else float(prediction), 'features': fields}
+
+    def value_batch(self, listings):
+        """Listings enriched and given a model_prediction, scored together as score_listings scores a batch"""
+        enriched = [self.index.enrich(dict(listing)) for listing in listings]
+        if enriched:
+            predictions = score_batch(self.booster, self.preprocessor, enriched, self.suburb_df, self.school_df)
+            for listing, prediction in zip(enriched, predictions):
+                listing['model_prediction'] = None if np.isnan(prediction) else float(prediction)
+        return enriched
+
+
+class ValuationHandler(BaseHTTPRequestHandler):
+    """POST /value with a listing as JSON returns its valuation; GET /health reports readiness"""
+
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer each response so its headers and body leave in one write (separate small writes
+    # stall on delayed acknowledgements)
+    wbufsize = -1
+
+    def send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/value':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            listing = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(listing, dict):
+                raise ValueError('the request body must be a JSON object')
+            if 'reiwa_latitude' not in listing or 'reiwa_longitude' not in listing:
+                raise ValueError('reiwa_latitude and reiwa_longitude are required')
+            start = time.perf_counter()
+            result = self.server.valuer.value(listing)
+            result['elapsed_ms'] = (time.perf_counter() - start) * 1000
+        # Missing fields and fields of the wrong type surface from enrichment and preprocessing
+        except (KeyError, TypeError, ValueError) as error:
+            self.send_json(400, {'error': f'{type(error).__name__}: {error}'})
+            return
+        except Exception as error:
+            self.log_error('valuation failed: %r', error)
+            self.send_json(500, {'error': f'{type(error).__name__}: {error}'})
+            return
+        self.send_json(200, result)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(valuer, host=HOST, port=PORT, unix_socket=None, verbose=False):
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = UnixHTTPServer(unix_socket, ValuationHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ValuationHandler)
+    server.valuer = valuer
+    server.verbose = verbose
+    print(f"Serving valuations on {unix_socket or f'http://{host}:{port}'}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Value single listings over HTTP, with the reference data and model loaded once.')
+    parser.add_argument('--suburbs', default='suburb_data.json')
+    parser.add_argument('--model', default='xgb_model.json')
+    parser.add_argument('--preprocessing', default='preprocessing.json', help='fitted preprocessing saved with the model')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--socket', help='listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    valuer = Valuer(args.model, args.preprocessing, args.suburbs)
+    print(f"Loaded the reference data, indexes and model in {time.time() - start_time:.2f} seconds.")
+    serve(valuer, args.host, args.port, args.socket, args.verbose)
+
+if __name__ == '__main__':
+    main()
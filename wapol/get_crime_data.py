@@ -1,9 +1,17 @@
-import requests
 import json
+import os
+import sys
+import requests
+
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from telemetry import Telemetry
+
+telemetry = Telemetry("wapol")
 
 def retrieve_crime_data(url):
     try:
-        response = requests.get(url)
+        response = telemetry.request(requests.get, "locality_crime_stats", url)
         response.raise_for_status()  # Raise an exception for non-2xx status codes
         crime_data = response.json()
         return crime_data
@@ -23,6 +31,7 @@ if __name__ == '__main__':
     url = 'https://www.police.wa.gov.au/apiws/CrimeStatsApi/GetLocalityCrimeStats/'
     file_path = 'crime_data.json'
 
-    crime_data = retrieve_crime_data(url)
+    with telemetry:
+        crime_data = retrieve_crime_data(url)
     if crime_data is not None:
         save_crime_data(crime_data, file_path)
\ No newline at end of file
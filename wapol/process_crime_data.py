@@ -1,4 +1,11 @@
 import json
+import os
+import sys
+
+# Shared modules live in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import columnar
+import warehouse
 
 def process_crime_data(crime_data):
     processed_data = {}
@@ -53,4 +60,10 @@ if __name__ == '__main__':
         crime_data = json.load(file)
 
     processed_data = process_crime_data(crime_data)
-    save_processed_data(processed_data, 'crime_data_processed.json')
\ No newline at end of file
+    save_processed_data(processed_data, 'crime_data_processed.json')
+
+    rows = [row for years in processed_data.values() for row in years.values()]
+    if warehouse.enabled():
+        warehouse.write_table('crime', rows, indexes=('Locality',))
+    if columnar.enabled():
+        columnar.write_columns(columnar.columns_path('crime_data_processed.json'), rows)
@@ -0,0 +1,185 @@
+import json
+import math
+import os
+import sqlite3
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(ROOT_DIR, 'warehouse.db')
+
+# Stages write to the warehouse when PIPELINE_WAREHOUSE is set (to '1' for the default path, or a path)
+WAREHOUSE_ENV = 'PIPELINE_WAREHOUSE'
+
+EARTH_RADIUS = 6371.0  # in kilometers
+
+SQL_TYPES = {bool: 'INTEGER', int: 'INTEGER', float: 'REAL', str: 'TEXT'}
+
+
+def enabled():
+    return bool(os.environ.get(WAREHOUSE_ENV))
+
+
+def warehouse_path():
+    value = os.environ.get(WAREHOUSE_ENV, '')
+    return DEFAULT_PATH if value in ('', '1') else value
+
+
+def connect(path=None):
+    """Open the warehouse; WAL mode lets concurrently running stages queue their writes"""
+    connection = sqlite3.connect(path or warehouse_path(), timeout=300)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+
+def quote(identifier):
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class JsonLines:
+    """Re-iterable view over a newline-delimited JSON file, so large artifacts are never fully loaded"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, 'r') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def infer_schema(records):
+    """Column name -> SQL type over all records, in first-seen order. Lists and dicts are stored as JSON text."""
+    schema = {}
+    for record in records:
+        for column, value in record.items():
+            if value is None:
+                schema.setdefault(column, None)
+                continue
+            sql_type = SQL_TYPES.get(type(value), 'TEXT')
+            current = schema.get(column)
+            if current is None or current == sql_type:
+                schema[column] = sql_type
+            elif {current, sql_type} == {'INTEGER', 'REAL'}:
+                schema[column] = 'REAL'
+            else:
+                schema[column] = 'TEXT'
+    return {column: sql_type or 'TEXT' for column, sql_type in schema.items()}
+
+
+def to_sql_value(value):
+    """Lists and dicts as JSON text; everything else is stored as it is"""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    # Infinite floats pass through unchanged and SQLite keeps them in REAL columns (e.g. osm_nearest_*
+    # when nothing was found), so warehouse reads match the JSON files
+    return value
+
+
+def write_table(name, records, key=None, indexes=(), path=None):
+    """
+    Replace table `name` with the given records in one transaction. `records` must be
+    re-iterable (a list or JsonLines): it is read once to infer typed columns and once to insert.
+    """
+    schema = infer_schema(records)
+    columns = list(schema)
+    column_definitions = [
+        f'{quote(column)} {sql_type}{" PRIMARY KEY" if column == key else ""}' for column, sql_type in schema.items()
+    ]
+
+    connection = connect(path)
+    with connection:
+        connection.execute(f'DROP TABLE IF EXISTS {quote(name)}')
+        connection.execute(f'CREATE TABLE {quote(name)} ({", ".join(column_definitions)})')
+        for column in indexes:
+            connection.execute(f'CREATE INDEX {quote(f"{name}_{column}")} ON {quote(name)} ({quote(column)})')
+
+        placeholders = ', '.join('?' for _ in columns)
+        insert_sql = f'INSERT OR REPLACE INTO {quote(name)} ({", ".join(map(quote, columns))}) VALUES ({placeholders})'
+        connection.executemany(insert_sql, (tuple(to_sql_value(record.get(column)) for column in columns) for record in records))
+    connection.close()
+
+
+def append_table(name, records, key=None, path=None):
+    """
+    Insert or replace records in table `name`, creating it, or adding columns for fields it does
+    not have yet, so a long-running process can keep appending to it
+    """
+    records = list(records)
+    schema = infer_schema(records)
+    columns = list(schema)
+
+    connection = connect(path)
+    with connection:
+        existing = {row[1] for row in connection.execute(f'PRAGMA table_info({quote(name)})')}
+        if not existing:
+            column_definitions = [
+                f'{quote(column)} {sql_type}{" PRIMARY KEY" if column == key else ""}' for column, sql_type in schema.items()
+            ]
+            connection.execute(f'CREATE TABLE {quote(name)} ({", ".join(column_definitions)})')
+        for column in columns:
+            if existing and column not in existing:
+                connection.execute(f'ALTER TABLE {quote(name)} ADD COLUMN {quote(column)} {schema[column]}')
+
+        placeholders = ', '.join('?' for _ in columns)
+        insert_sql = f'INSERT OR REPLACE INTO {quote(name)} ({", ".join(map(quote, columns))}) VALUES ({placeholders})'
+        connection.executemany(insert_sql, (tuple(to_sql_value(record.get(column)) for column in columns) for record in records))
+    connection.close()
+
+
+def write_points(name, points, path=None):
+    """Replace R*Tree table `name` with (id, longitude, latitude) points"""
+    connection = connect(path)
+    with connection:
+        connection.execute(f'DROP TABLE IF EXISTS {quote(name)}')
+        connection.execute(f'CREATE VIRTUAL TABLE {quote(name)} USING rtree(id, min_lon, max_lon, min_lat, max_lat)')
+        connection.executemany(
+            f'INSERT INTO {quote(name)} VALUES (?, ?, ?, ?, ?)',
+            ((point_id, lon, lon, lat, lat) for point_id, lon, lat in points)
+        )
+    connection.close()
+
+
+def write_features(name, feature_collection, path=None):
+    """Store a point FeatureCollection as a `name` table of properties plus a `name`_rtree index on row id"""
+    records = [{'id': index, **feature['properties'], 'longitude': feature['geometry']['coordinates'][0],
+                'latitude': feature['geometry']['coordinates'][1]}
+               for index, feature in enumerate(feature_collection['features'])]
+    write_table(name, records, key='id', path=path)
+    write_points(f'{name}_rtree', ((record['id'], record['longitude'], record['latitude']) for record in records), path=path)
+
+
+def write_listings(name, records, path=None):
+    """Store REIWA listing records keyed on listing id, indexed on suburb, with a `name`_rtree on their coordinates"""
+    write_table(name, records, key='reiwa_listing_id', indexes=('reiwa_suburb',), path=path)
+    write_points(f'{name}_rtree', ((record['reiwa_listing_id'], record['reiwa_longitude'], record['reiwa_latitude'])
+                                   for record in records), path=path)
+
+
+def query(sql, parameters=(), path=None):
+    """Run a query and return rows as dicts"""
+    connection = connect(path)
+    connection.row_factory = sqlite3.Row
+    rows = [dict(row) for row in connection.execute(sql, parameters)]
+    connection.close()
+    return rows
+
+
+def read_frame(sql, parameters=(), path=None):
+    """Run a query into a pandas DataFrame (only the rows and columns asked for are read)"""
+    import pandas as pd
+
+    connection = connect(path)
+    frame = pd.read_sql_query(sql, connection, params=parameters)
+    connection.close()
+    return frame
+
+
+def within_radius(table, lon, lat, radius_km, id_column='id', path=None):
+    """Rows of `table` whose point lies inside a bounding box of radius_km around lon/lat, via its R*Tree"""
+    dlat = math.degrees(radius_km / EARTH_RADIUS)
+    dlon = math.degrees(radius_km / (EARTH_RADIUS * math.cos(math.radians(lat))))
+    return query(
+        f'SELECT t.* FROM {quote(table)} t JOIN {quote(table + "_rtree")} r ON t.{quote(id_column)} = r.id '
+        f'WHERE r.min_lon >= ? AND r.max_lon <= ? AND r.min_lat >= ? AND r.max_lat <= ?',
+        (lon - dlon, lon + dlon, lat - dlat, lat + dlat), path=path
+    )